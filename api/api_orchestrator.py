@@ -1,28 +1,810 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from urllib.parse import urlencode
+import asyncio
+import hashlib
+import json as _json
 import httpx
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 import logging
+import os
+import time
+
+try:
+    from api.metrics import install_metrics, outcome_of
+except ImportError:  # run from inside api/ (uvicorn api_orchestrator:main_app)
+    from metrics import install_metrics, outcome_of
+
+try:
+    from api.http_helpers import (compress_body, compression_summary, etag_matches, negotiate_encoding,
+                                  new_compression_counters, not_modified_since)
+except ImportError:
+    from http_helpers import (compress_body, compression_summary, etag_matches, negotiate_encoding,
+                              new_compression_counters, not_modified_since)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MCSI_URL = os.getenv("MCSI_URL", "http://mcsi:8000")
+YIELD_URL = os.getenv("YIELD_URL", "http://yield:8001")
+MCSI_URL_LOCAL = os.getenv("MCSI_URL_LOCAL", "http://localhost:8000")
+YIELD_URL_LOCAL = os.getenv("YIELD_URL_LOCAL", "http://localhost:8001")
+
+# Connection pool settings shared by all upstream clients
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Background health probing and circuit breaking
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "10"))
+UPSTREAM_PROBE_TIMEOUT = float(os.getenv("UPSTREAM_PROBE_TIMEOUT", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "15"))
+
+# Response cache: MCSI and yield data change weekly
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+CACHE_STALE_WHILE_REVALIDATE = float(os.getenv("RESPONSE_CACHE_STALE_WHILE_REVALIDATE", "3600"))
+CACHE_STALE_IF_ERROR = float(os.getenv("RESPONSE_CACHE_STALE_IF_ERROR", "86400"))
+
+# Composite endpoints: each upstream call gets this long before the page renders without it
+DASHBOARD_CALL_TIMEOUT = float(os.getenv("DASHBOARD_CALL_TIMEOUT", "5"))
+
+# Statewide fan-out
+IOWA_COUNTY_FIPS = [f"19{n:03d}" for n in range(1, 198, 2)]
+STATE_FANOUT_CONCURRENCY = int(os.getenv("STATE_FANOUT_CONCURRENCY", "16"))
+YIELD_BATCH_SIZE = int(os.getenv("YIELD_BATCH_SIZE", "99"))
+# After a 404/405 from /forecast/batch, use per-county calls for this long before asking again
+YIELD_BATCH_RETRY_SECONDS = float(os.getenv("YIELD_BATCH_RETRY_SECONDS", "300"))
+STATE_CALL_TIMEOUT = 30.0
+
+# Response compression (bodies below the threshold are sent as-is; GZIP_LEVEL / BROTLI_QUALITY in http_helpers)
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+
+# Server-Sent Events
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "10000"))
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+SSE_QUEUE_SIZE = 8  # per subscriber; a slow client loses its oldest events, not the broker
+SSE_RETRY_MS = 5000
+
+
+# ==================== Upstream Clients ====================
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without touching the network when an upstream's circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    closed:    requests flow; consecutive failures are counted
+    open:      requests fail fast until reset_timeout has passed
+    half_open: one trial request is let through; success closes, failure re-opens
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        # Half-open: a single trial at a time (a trial that never reported back expires)
+        now = self.clock()
+        if self.trial_started is None or now - self.trial_started >= self.reset_timeout:
+            self.trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            self.trial_started = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one in-flight task
+
+    The first caller for a key (the leader) starts the call; callers that
+    arrive while it is running share its result or exception. The call runs
+    as its own task, so a cancelled caller does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every caller went away
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self.leaders,
+            "collapsed_calls": self.followers,
+            "collapse_ratio": round(self.followers / total, 4) if total else None,
+        }
+
+
+class UpstreamClient:
+    """
+    Pooled, health-aware HTTP client for one upstream service
+
+    A single httpx.AsyncClient per upstream keeps connections alive across
+    requests instead of paying TCP setup and DNS on every call. The client is
+    opened in the app lifespan, or lazily on first use (e.g. under a
+    TestClient that was not entered as a context manager).
+
+    Candidate base URLs are probed in the background and requests go
+    straight to the active (first healthy) one. A circuit breaker fails
+    requests fast while the upstream is down instead of stacking timeouts.
+    Identical concurrent fetch_json calls share one upstream request.
+
+    The latest ETag / Last-Modified seen from the upstream (on data responses
+    or health probes) is kept as its data version; listeners are called when
+    it changes.
+    """
+
+    def __init__(self, name: str, base_urls: List[str], transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.name = name
+        self.base_urls = base_urls
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.breaker = CircuitBreaker()
+        self.healthy: Dict[str, Optional[bool]] = {url: None for url in base_urls}
+        self.active_url = base_urls[0]
+        self.flights = SingleFlight()
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.version_listeners: List[Callable[["UpstreamClient"], Any]] = []
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    def _build_client(self) -> httpx.AsyncClient:
+        kwargs = dict(
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(10.0),
+            transport=self.transport,
+        )
+        try:
+            return httpx.AsyncClient(http2=UPSTREAM_HTTP2, **kwargs)
+        except ImportError:
+            logger.warning(f"{self.name}: HTTP/2 requested but 'h2' is not installed, using HTTP/1.1")
+            return httpx.AsyncClient(**kwargs)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send to the active base URL, or fail fast if the circuit is open"""
+        if not self.breaker.allow():
+            metrics.observe_dependency(self.name, 0.0, "circuit_open")
+            raise UpstreamUnavailable(f"{self.name} circuit open")
+
+        base_url = self.active_url
+        client = self.client
+        self.in_flight += 1
+        self.requests += 1
+        metrics.dependency_in_flight.inc(self.name)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, f"{base_url}{path}", **kwargs)
+        except httpx.HTTPError:
+            self.errors += 1
+            self.breaker.record_failure()
+            self._mark_unhealthy(base_url)
+            metrics.observe_dependency(self.name, time.perf_counter() - started, outcome_of(None))
+            raise
+        finally:
+            self.in_flight -= 1
+            metrics.dependency_in_flight.dec(self.name)
+
+        metrics.observe_dependency(self.name, time.perf_counter() - started, outcome_of(response.status_code))
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._observe_version(response)
+        return response
+
+    def _observe_version(self, response: httpx.Response):
+        etag = response.headers.get("etag")
+        if not response.is_success or not etag or etag == self.etag:
+            return
+        previous, self.etag = self.etag, etag
+        self.last_modified = response.headers.get("last-modified")
+        if previous is not None:
+            logger.info(f"{self.name}: data version {previous} -> {etag}")
+            for listener in self.version_listeners:
+                listener(self)
+
+    def _mark_unhealthy(self, base_url: str):
+        self.healthy[base_url] = False
+        alternatives = [u for u in self.base_urls if u != base_url and self.healthy[u] is not False]
+        if base_url == self.active_url and alternatives:
+            self.active_url = alternatives[0]
+            logger.warning(f"{self.name}: {base_url} failed, switching to {self.active_url}")
+
+    async def probe(self):
+        """Check every candidate's /health and route to the first healthy one"""
+        client = self.client
+
+        async def check(base_url: str) -> Optional[httpx.Response]:
+            try:
+                response = await client.get(f"{base_url}/health", timeout=UPSTREAM_PROBE_TIMEOUT)
+                return response if response.status_code < 500 else None
+            except httpx.HTTPError:
+                return None
+
+        responses = await asyncio.gather(*(check(u) for u in self.base_urls))
+        self.healthy = {u: r is not None for u, r in zip(self.base_urls, responses)}
+        healthy = [(u, r) for u, r in zip(self.base_urls, responses) if r is not None]
+        if healthy and healthy[0][0] != self.active_url:
+            logger.info(f"{self.name}: routing to {healthy[0][0]}")
+            self.active_url = healthy[0][0]
+        if healthy:
+            self._observe_version(healthy[0][1])
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def fetch_json(self, method: str, path: str, params: Optional[dict] = None,
+                         json: Optional[Any] = None, timeout: Optional[float] = None) -> Any:
+        """Request and decode JSON, coalesced with identical in-flight calls"""
+        key = f"{method} {ResponseCache.key(path, params)}"
+        if json is not None:
+            key += " " + _json.dumps(json, sort_keys=True, separators=(",", ":"))
+
+        kwargs = {"params": params, "json": json}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        async def call():
+            response = await self.request(method, path, **kwargs)
+            response.raise_for_status()
+            return response.json()
+
+        return await self.flights.do(key, call)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "active_url": self.active_url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "coalescing": self.flights.stats(),
+            "data_version": self.etag,
+            "last_modified": self.last_modified,
+            "pool": _pool_stats(self._client),
+        }
+
+
+def _pool_stats(client: Optional[httpx.AsyncClient]) -> dict:
+    """Connection pool utilization (reads httpcore internals, best effort)"""
+    limits = {
+        "max_connections": UPSTREAM_MAX_CONNECTIONS,
+        "max_keepalive": UPSTREAM_MAX_KEEPALIVE,
+        "keepalive_expiry": UPSTREAM_KEEPALIVE_EXPIRY,
+    }
+    if client is None or client.is_closed:
+        return dict(limits, open=False)
+    try:
+        connections = client._transport._pool.connections
+        idle = sum(1 for c in connections if c.is_idle())
+        return dict(
+            limits,
+            open=True,
+            http2=UPSTREAM_HTTP2,
+            connections=len(connections),
+            idle=idle,
+            active=len(connections) - idle,
+            utilization=round((len(connections) - idle) / UPSTREAM_MAX_CONNECTIONS, 4),
+        )
+    except AttributeError:
+        return dict(limits, open=True)
+
+
+UPSTREAMS: Dict[str, UpstreamClient] = {
+    "mcsi": UpstreamClient("mcsi", [MCSI_URL, MCSI_URL_LOCAL]),
+    "yield": UpstreamClient("yield", [YIELD_URL, YIELD_URL_LOCAL]),
+}
+
+
+# ==================== Response Cache ====================
+
+
+class CacheEntry:
+    __slots__ = ("value", "stored_at", "encodings")
+
+    def __init__(self, value: Any, stored_at: float):
+        self.value = value
+        self.stored_at = stored_at
+        self.encodings: Dict[str, bytes] = {}  # "identity" JSON and compressed variants, built on first use
+
+
+class ResponseCache:
+    """
+    In-process TTL + LRU cache for proxied responses
+
+    age < ttl:                              fresh hit
+    age < ttl + stale_while_revalidate:     served immediately, refreshed in the background
+    fetch fails and age < stale_if_error:   served stale instead of an error
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL,
+                 stale_while_revalidate: float = CACHE_STALE_WHILE_REVALIDATE,
+                 stale_if_error: float = CACHE_STALE_IF_ERROR, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.clock = clock
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.counters = {"hits": 0, "stale_hits": 0, "stale_on_error": 0, "misses": 0,
+                         "evictions": 0, "refreshes": 0, "refresh_errors": 0}
+
+    @staticmethod
+    def key(route: str, params: Optional[dict] = None) -> str:
+        """Route plus query params, sorted with None values dropped"""
+        items = sorted((k, str(v)) for k, v in (params or {}).items() if v is not None)
+        return f"{route}?{urlencode(items)}" if items else route
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        age = self.clock() - entry.stored_at if entry else None
+
+        if entry and age < self.ttl:
+            self.counters["hits"] += 1
+            self._entries.move_to_end(key)
+            return entry.value
+
+        if entry and age < self.ttl + self.stale_while_revalidate:
+            self.counters["stale_hits"] += 1
+            self._entries.move_to_end(key)
+            self._schedule_refresh(key, fetch)
+            return entry.value
+
+        self.counters["misses"] += 1
+        try:
+            value = await fetch()
+        except Exception:
+            if entry and age < self.stale_if_error:
+                self.counters["stale_on_error"] += 1
+                logger.warning(f"Serving stale {key} ({age:.0f}s old): upstream failed")
+                return entry.value
+            raise
+        self.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = CacheEntry(value, self.clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _schedule_refresh(self, key: str, fetch: Callable[[], Awaitable[Any]]):
+        if key not in self._refreshing:
+            self._refreshing[key] = asyncio.create_task(self._refresh(key, fetch))
+
+    async def _refresh(self, key: str, fetch: Callable[[], Awaitable[Any]]):
+        try:
+            self.set(key, await fetch())
+            self.counters["refreshes"] += 1
+        except Exception as e:
+            self.counters["refresh_errors"] += 1
+            logger.warning(f"Background refresh of {key} failed: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def encoded(self, key: str, value: Any, encoding: Optional[str]) -> tuple:
+        """
+        (body, content_encoding) for a cached value
+
+        The JSON and each compressed variant are stored on the entry the first
+        time they are needed, so repeat hits never re-serialize or recompress.
+        """
+        entry = self._entries.get(key)
+        encodings = entry.encodings if entry is not None and entry.value is value else {}
+
+        body = encodings.get("identity")
+        if body is None:
+            body = encodings["identity"] = render_json(value)
+        if encoding is None or len(body) < COMPRESSION_MIN_BYTES:
+            return body, None
+        if encoding in encodings:
+            compression_counters["precompressed_hits"] += 1
+            return encodings[encoding], encoding
+        encodings[encoding] = compress_body(body, encoding, compression_counters)
+        return encodings[encoding], encoding
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["stale_hits"] + c["misses"]
+        return dict(
+            c,
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            ttl=self.ttl,
+            stale_while_revalidate=self.stale_while_revalidate,
+            stale_if_error=self.stale_if_error,
+            hit_ratio=round((c["hits"] + c["stale_hits"]) / lookups, 4) if lookups else None,
+            fresh_hit_ratio=round(c["hits"] / lookups, 4) if lookups else None,
+        )
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_on_new_version(upstream: UpstreamClient):
+    """New upstream data (a new MCSI week, a promoted yield model) makes cached responses outdated"""
+    logger.info(f"Clearing response cache: {upstream.name} data changed")
+    response_cache.clear()
+
+
+for _upstream in UPSTREAMS.values():
+    _upstream.version_listeners.append(invalidate_on_new_version)
+
+
+# ==================== Compression ====================
+
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html")
+compression_counters = new_compression_counters("precompressed_hits", "below_threshold")
+
+
+def render_json(value: Any) -> bytes:
+    """Same bytes as FastAPI's JSONResponse"""
+    return _json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def compression_stats() -> dict:
+    return dict(min_bytes=COMPRESSION_MIN_BYTES, **compression_summary(compression_counters))
+
+
+def cached_json(request: Request, key: str, value: Any) -> Response:
+    """Serve a cached value with its stored JSON / compressed bytes"""
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    body, applied = response_cache.encoded(key, value, encoding)
+    headers = {"Vary": "Accept-Encoding"}
+    if applied:
+        headers["Content-Encoding"] = applied
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# ==================== Conditional GET ====================
+
+conditional_counters = {"not_modified": 0, "tagged": 0}
+
+# Routes mark degraded responses (failed upstream calls) with this header;
+# those are never tagged with the data-version ETag, so a client cannot
+# revalidate a partial page into a 304 once the upstreams recover.
+NO_STORE = {"Cache-Control": "no-store"}
+
+
+def is_no_store(response: Response) -> bool:
+    return "no-store" in response.headers.get("cache-control", "")
+
+
+def route_validators(path: str) -> Optional[Dict[str, str]]:
+    """
+    Validators for an orchestrator route, from the upstream data versions it depends on
+
+    MCSI routes pass the MCSI ETag / Last-Modified through. Yield and dashboard
+    responses also depend on the live yield model, so their ETag combines both
+    versions (and carries no Last-Modified, which a model promotion would not
+    advance).
+    """
+    mcsi = UPSTREAMS["mcsi"]
+    if path.startswith("/api/mcsi/") and mcsi.etag:
+        validators = {"ETag": mcsi.etag}
+        if mcsi.last_modified:
+            validators["Last-Modified"] = mcsi.last_modified
+        return validators
+    if path.startswith(("/api/yield/", "/api/county/")):
+        yield_etag = UPSTREAMS["yield"].etag
+        if mcsi.etag and yield_etag:
+            digest = hashlib.sha1(f"{mcsi.etag}|{yield_etag}".encode()).hexdigest()[:16]
+            return {"ETag": f'W/"agri-{digest}"'}
+    return None
+
+
+# ==================== Data Push (SSE) ====================
+
+
+class Subscriber:
+    __slots__ = ("queue", "fips", "summary")
+
+    def __init__(self, fips: Optional[List[str]], summary: bool):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.fips = fips
+        self.summary = summary
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {_json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class EventBroker:
+    """
+    Fan-out of data-version notifications to SSE subscribers
+
+    Publishers only enqueue; a single task encodes each event once and drops
+    it into every subscriber's bounded queue. An idle subscriber is just a
+    coroutine waiting on its queue.
+    """
+
+    def __init__(self):
+        self.subscribers: set = set()
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.counters = {"published": 0, "delivered": 0, "dropped": 0}
+
+    def subscribe(self, fips: Optional[List[str]] = None, summary: bool = False) -> Subscriber:
+        subscriber = Subscriber(fips, summary)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: dict):
+        self.counters["published"] += 1
+        self.events.put_nowait(event)
+
+    async def run(self):
+        # The queue binds to the loop that first waits on it: start each run (lifespan) with a fresh one
+        pending, self.events = self.events, asyncio.Queue()
+        while not pending.empty():
+            self.events.put_nowait(pending.get_nowait())
+        while True:
+            event = await self.events.get()
+            try:
+                await self.fan_out(event)
+            except Exception as e:
+                logger.warning(f"Event fan-out failed: {e}")
+
+    async def fan_out(self, event: dict):
+        subscribers = list(self.subscribers)
+        wanted = {f for sub in subscribers if sub.summary and sub.fips for f in sub.fips}
+        summaries = await county_summaries(wanted) if wanted and event.get("source") == "mcsi" else {}
+
+        shared = format_sse(event["type"], event)
+        for sub in subscribers:
+            if sub.summary and sub.fips and summaries:
+                message = format_sse(event["type"], dict(event, counties={f: summaries.get(f) for f in sub.fips}))
+            else:
+                message = shared
+            self._deliver(sub, message)
+
+    def _deliver(self, subscriber: Subscriber, message: str):
+        if subscriber.queue.full():
+            subscriber.queue.get_nowait()
+            self.counters["dropped"] += 1
+        subscriber.queue.put_nowait(message)
+        self.counters["delivered"] += 1
+
+    def stats(self) -> dict:
+        return dict(self.counters, subscribers=len(self.subscribers), pending=self.events.qsize())
+
+
+async def county_summaries(fips_codes) -> Dict[str, Optional[dict]]:
+    """Compact current MCSI per county, for subscribers that asked for it"""
+    semaphore = asyncio.Semaphore(STATE_FANOUT_CONCURRENCY)
+
+    async def summary(fips):
+        async with semaphore:
+            try:
+                mcsi = await response_cache.get_or_fetch(ResponseCache.key(f"/mcsi/{fips}"), lambda: fetch_mcsi(fips))
+            except Exception as e:
+                logger.warning(f"Summary for {fips} unavailable: {e}")
+                return None
+        return {
+            key: mcsi.get(key)
+            for key in ("week_start", "week_of_season", "overall_stress_index", "overall_status", "primary_driver")
+        }
+
+    codes = sorted(fips_codes)
+    return dict(zip(codes, await asyncio.gather(*(summary(f) for f in codes))))
+
+
+broker = EventBroker()
+
+
+def publish_data_version(upstream: UpstreamClient):
+    broker.publish({
+        "type": "data_version",
+        "source": upstream.name,
+        "version": upstream.etag,
+        "last_modified": upstream.last_modified,
+    })
+
+
+for _upstream in UPSTREAMS.values():
+    _upstream.version_listeners.append(publish_data_version)
+
+
+async def sse_stream(request: Request, subscriber: Subscriber):
+    """Current versions first, then pushed events; comment keepalives while idle"""
+    try:
+        versions = {name: upstream.etag for name, upstream in UPSTREAMS.items()}
+        yield f"retry: {SSE_RETRY_MS}\n" + format_sse("hello", {"versions": versions, "fips": subscriber.fips})
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                message = ": keepalive\n\n"
+            yield message
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def probe_upstreams():
+    await asyncio.gather(*(upstream.probe() for upstream in UPSTREAMS.values()))
+
+
+async def probe_loop():
+    while True:
+        await asyncio.sleep(UPSTREAM_PROBE_INTERVAL)
+        try:
+            await probe_upstreams()
+        except Exception as e:
+            logger.warning(f"Upstream probe failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resolve healthy URLs before taking traffic, then keep probing
+    await probe_upstreams()
+    logger.info(f"Upstream pools ready (max {UPSTREAM_MAX_CONNECTIONS} connections, http2={UPSTREAM_HTTP2})")
+    prober = asyncio.create_task(probe_loop())
+    fan_out = asyncio.create_task(broker.run())
+    yield
+    prober.cancel()
+    fan_out.cancel()
+    for upstream in UPSTREAMS.values():
+        await upstream.aclose()
+
 
 api_router = APIRouter()  # Create router
-main_app = FastAPI(title="AgriGuard API Orchestrator", version="1.1.0")
+main_app = FastAPI(title="AgriGuard API Orchestrator", version="1.1.0", lifespan=lifespan)
 
 # Root-level health check for K8s probes
 @main_app.get("/health")
 async def root_health():
     return {"status": "healthy"}
 
+@main_app.middleware("http")
+async def compress_response(request: Request, call_next):
+    """Negotiated br/gzip for uncached JSON above COMPRESSION_MIN_BYTES (streams pass through)"""
+    response = await call_next(request)
+    content_type = response.headers.get("content-type", "")
+    if (
+        response.status_code != 200
+        or "content-encoding" in response.headers
+        or not content_type.startswith(COMPRESSIBLE_TYPES)
+    ):
+        return response
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    headers["vary"] = "Accept-Encoding"
+    if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+        body = compress_body(body, encoding, compression_counters)
+        headers["content-encoding"] = encoding
+    elif encoding:
+        compression_counters["below_threshold"] += 1
+    return Response(body, status_code=response.status_code, headers=headers)
+
+
+@main_app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """
+    Answer If-None-Match / If-Modified-Since with 304 from known upstream versions
+
+    No upstream call is made for a revalidation that matches. Fresh 200
+    responses are tagged if the version did not change while they were built
+    and the route did not mark them no-store.
+    """
+    if request.method != "GET":
+        return await call_next(request)
+
+    path = request.url.path
+    before = route_validators(path)
+    if before:
+        if_none_match = request.headers.get("if-none-match")
+        if etag_matches(if_none_match, before["ETag"]) or (
+            if_none_match is None
+            and not_modified_since(request.headers.get("if-modified-since"), before.get("Last-Modified"))
+        ):
+            conditional_counters["not_modified"] += 1
+            return Response(status_code=304, headers=dict(before, **{"Cache-Control": "no-cache"}))
+
+    response = await call_next(request)
+    after = route_validators(path)
+    if response.status_code == 200 and after and (before is None or before == after) and not is_no_store(response):
+        conditional_counters["tagged"] += 1
+        response.headers.update(after)
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 main_app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
 )
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-MCSI_URL = "http://mcsi:8000"
-YIELD_URL = "http://yield:8001"
-MCSI_URL_LOCAL = "http://localhost:8000"
-YIELD_URL_LOCAL = "http://localhost:8001"
+# Outermost: per-route/per-upstream latency, Server-Timing and Prometheus /metrics
+metrics = install_metrics(main_app, service="orchestrator")
 
 
 @api_router.get("/health")
@@ -31,99 +813,426 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@api_router.get("/upstreams")
+async def upstream_stats():
+    """Routing, circuit state, pool utilization and request counts per upstream"""
+    return {name: upstream.stats() for name, upstream in UPSTREAMS.items()}
+
+
+@api_router.get("/events")
+async def subscribe_events(request: Request, fips: Optional[str] = None, summary: bool = False):
+    """
+    Server-Sent Events: a `data_version` event whenever MCSI or yield data changes
+
+    fips: comma-separated counties; with summary=true their new MCSI summary
+    is included in each MCSI event, so clients need not refetch.
+    """
+    if len(broker.subscribers) >= SSE_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many subscribers")
+    counties = [f.strip() for f in fips.split(",") if f.strip()] if fips else None
+    subscriber = broker.subscribe(counties, summary)
+    return StreamingResponse(
+        sse_stream(request, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api_router.get("/events/stats")
+async def event_stats():
+    """SSE subscribers and delivery counts"""
+    return broker.stats()
+
+
+@api_router.get("/cache")
+async def cache_stats():
+    """Response cache hit ratios and size, conditional GET counts and compression ratios"""
+    return dict(response_cache.stats(), conditional=dict(conditional_counters), compression=compression_stats())
+
+
+# ==================== Upstream Fetches ====================
+
+
+async def fetch_mcsi(fips: str) -> dict:
+    return await UPSTREAMS["mcsi"].fetch_json("GET", f"/mcsi/county/{fips}", timeout=10.0)
+
+
+async def fetch_timeseries(fips: str, limit: Optional[int] = 30, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None, timeout: float = 15.0) -> list:
+    params = {"limit": limit}
+    if start_date:
+        params["start_date"] = start_date
+    if end_date:
+        params["end_date"] = end_date
+    return await UPSTREAMS["mcsi"].fetch_json("GET", f"/mcsi/county/{fips}/timeseries", params=params, timeout=timeout)
+
+
+def build_yield_request(fips: str, timeseries: list, week: Optional[int] = None) -> dict:
+    """Convert an MCSI timeseries into the yield service's raw_data request"""
+    if not isinstance(timeseries, list):
+        timeseries = [timeseries]
+
+    current_week = week if week else max(item.get("week_of_season", 0) for item in timeseries)
+    filtered = [item for item in timeseries if item.get("week_of_season", 0) <= current_week]
+
+    raw_data = {}
+    for item in filtered:
+        w = item.get("week_of_season", 0)
+        indicators = item.get("indicators", {})
+        raw_data[str(w)] = {
+            "water_deficit_mean": indicators.get("water_deficit_mean", 0),
+            "lst_days_above_32C": int(indicators.get("lst_mean", 0)),
+            "ndvi_mean": indicators.get("ndvi_mean", 0.5),
+            "vpd_mean": indicators.get("vpd_mean", 0),
+            "pr_sum": indicators.get("precipitation_mean", 0),
+        }
+
+    return {"fips": fips, "current_week": current_week, "year": 2025, "raw_data": raw_data}
+
+
+def build_forecast_request(fips: str, timeseries: list, week: Optional[int] = None) -> Optional[dict]:
+    """
+    MCSI timeseries -> the yield service's ForecastRequest (used by /forecast/batch)
+
+    Season-to-date features in the units the model was trained on: days with
+    LST > 32 °C, water deficit and precipitation (mm) summed over the weeks,
+    mean and minimum NDVI. MCSI reports precipitation as a daily mean, so a
+    week contributes 7x that. The MCSI `lst_mean` is a temperature, not a day
+    count, so None is returned (and callers forecast per county) unless every
+    week carries an `lst_days_above_32C` indicator.
+    """
+    if not isinstance(timeseries, list):
+        timeseries = [timeseries]
+    current_week = week if week else max(item.get("week_of_season", 0) for item in timeseries)
+    weeks = [item.get("indicators", {}) for item in timeseries if item.get("week_of_season", 0) <= current_week]
+    if not weeks or any(w.get("lst_days_above_32C") is None for w in weeks):
+        return None
+
+    ndvi = [w.get("ndvi_mean", 0.5) for w in weeks]
+    return {
+        "fips": fips,
+        "week": current_week,
+        "year": 2025,
+        "heat_days": float(sum(w["lst_days_above_32C"] for w in weeks)),
+        "water_deficit": float(sum(w.get("water_deficit_mean", 0) for w in weeks)),
+        "precip": float(sum(7.0 * w.get("precipitation_mean", 0) for w in weeks)),
+        "ndvi_avg": float(sum(ndvi) / len(ndvi)),
+        "ndvi_min": float(min(ndvi)),
+    }
+
+
+def format_yield_response(fips: str, current_week: int, ydata: dict) -> dict:
+    return {
+        "fips": fips,
+        "week": current_week,
+        # /forecast answers in yield_forecast_bu_acre, /forecast/batch items in predicted_yield
+        "predicted_yield": ydata.get("yield_forecast_bu_acre", ydata.get("predicted_yield")),
+        "confidence_interval": ydata.get("forecast_uncertainty", ydata.get("uncertainty", 0.31)),
+        "confidence_lower": ydata.get("confidence_interval_lower"),
+        "confidence_upper": ydata.get("confidence_interval_upper"),
+        "primary_driver": ydata.get("primary_driver", "unknown"),
+        "model_r2": ydata.get("model_r2", 0.835),
+    }
+
+
+async def fetch_yield(fips: str, week: Optional[int] = None, timeseries: Optional[list] = None) -> dict:
+    """MCSI timeseries -> yield forecast; pass timeseries to skip re-fetching it"""
+    if timeseries is None:
+        timeseries = await fetch_timeseries(fips, limit=30, timeout=30.0)
+
+    yield_req = build_yield_request(fips, timeseries, week)
+    logger.info(f"Yield forecast {fips} week {yield_req['current_week']}")
+
+    ydata = await UPSTREAMS["yield"].fetch_json("POST", "/forecast", json=yield_req, timeout=15.0)
+    return format_yield_response(fips, yield_req["current_week"], ydata)
+
+
+# ==================== Routes ====================
+
+
 @api_router.get("/mcsi/{fips}/timeseries")
 async def get_mcsi_timeseries(
-    fips: str, start_date: Optional[str] = None, end_date: Optional[str] = None, limit: Optional[int] = 30
+    request: Request,
+    fips: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: Optional[int] = 30,
 ):
+    key = ResponseCache.key(f"/mcsi/{fips}/timeseries", {"limit": limit, "start_date": start_date, "end_date": end_date})
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            url = f"{MCSI_URL}/mcsi/county/{fips}/timeseries?limit={limit}"
-            if start_date:
-                url += f"&start_date={start_date}"
-            if end_date:
-                url += f"&end_date={end_date}"
-            try:
-                response = await client.get(url)
-            except:
-                url_local = f"{MCSI_URL_LOCAL}/mcsi/county/{fips}/timeseries?limit={limit}"
-                if start_date:
-                    url_local += f"&start_date={start_date}"
-                if end_date:
-                    url_local += f"&end_date={end_date}"
-                response = await client.get(url_local)
-            response.raise_for_status()
-            return response.json()
+        value = await response_cache.get_or_fetch(key, lambda: fetch_timeseries(fips, limit, start_date, end_date))
     except Exception as e:
         logger.error(f"MCSI error: {e}")
         raise HTTPException(status_code=503, detail="MCSI unavailable")
+    return cached_json(request, key, value)
 
 
 @api_router.get("/mcsi/{fips}")
-async def get_mcsi(fips: str):
+async def get_mcsi(request: Request, fips: str):
+    key = ResponseCache.key(f"/mcsi/{fips}")
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            try:
-                response = await client.get(f"{MCSI_URL}/mcsi/county/{fips}")
-            except:
-                response = await client.get(f"{MCSI_URL_LOCAL}/mcsi/county/{fips}")
-            response.raise_for_status()
-            return response.json()
+        value = await response_cache.get_or_fetch(key, lambda: fetch_mcsi(fips))
     except Exception as e:
         raise HTTPException(status_code=503, detail="MCSI unavailable")
+    return cached_json(request, key, value)
 
 
-@api_router.get("/yield/{fips}")
-async def get_yield_forecast(fips: str, week: Optional[int] = None):
+# ==================== Statewide Fan-out ====================
+
+# monotonic time until which /forecast/batch is assumed missing (after a 404/405)
+yield_batch_unavailable_until = 0.0
+
+
+async def cached_timeseries(fips: str) -> list:
+    key = ResponseCache.key(f"/mcsi/{fips}/timeseries", {"limit": 30})
+    return await response_cache.get_or_fetch(key, lambda: fetch_timeseries(fips, limit=30, timeout=STATE_CALL_TIMEOUT))
+
+
+async def cached_yield(fips: str, week: Optional[int], timeseries: Optional[list] = None) -> dict:
+    key = ResponseCache.key(f"/yield/{fips}", {"week": week})
+    return await response_cache.get_or_fetch(key, lambda: fetch_yield(fips, week, timeseries))
+
+
+async def forecast_batch(forecast_reqs: List[dict]) -> Optional[list]:
+    """
+    Forecasts from the yield service's /forecast/batch, or None if it has no batch endpoint
+
+    Only 404/405 mean "no endpoint", and that is re-checked after
+    YIELD_BATCH_RETRY_SECONDS; any other error (a 422 is a request bug) raises.
+    """
+    global yield_batch_unavailable_until
+    if time.monotonic() < yield_batch_unavailable_until:
+        return None
+    body = {"requests": forecast_reqs}
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                ts_res = await client.get(f"{MCSI_URL}/mcsi/county/{fips}/timeseries?limit=30")
-            except:
-                ts_res = await client.get(f"{MCSI_URL_LOCAL}/mcsi/county/{fips}/timeseries?limit=30")
-            ts_res.raise_for_status()
-            timeseries = ts_res.json()
-            if not isinstance(timeseries, list):
-                timeseries = [timeseries]
-
-            current_week = week if week else max(item.get("week_of_season", 0) for item in timeseries)
-            filtered = [item for item in timeseries if item.get("week_of_season", 0) <= current_week]
-
-            raw_data = {}
-            for item in filtered:
-                w = item.get("week_of_season", 0)
-                indicators = item.get("indicators", {})
-                raw_data[str(w)] = {
-                    "water_deficit_mean": indicators.get("water_deficit_mean", 0),
-                    "lst_days_above_32C": int(indicators.get("lst_mean", 0)),
-                    "ndvi_mean": indicators.get("ndvi_mean", 0.5),
-                    "vpd_mean": indicators.get("vpd_mean", 0),
-                    "pr_sum": indicators.get("precipitation_mean", 0),
-                }
-
-            yield_req = {"fips": fips, "current_week": current_week, "year": 2025, "raw_data": raw_data}
-            logger.info(f"Yield forecast {fips} week {current_week}")
+        data = await UPSTREAMS["yield"].fetch_json("POST", "/forecast/batch", json=body, timeout=STATE_CALL_TIMEOUT)
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        if status in (404, 405):
+            logger.info(f"Yield batch endpoint unavailable ({status}), using per-county calls "
+                        f"for {YIELD_BATCH_RETRY_SECONDS:.0f}s")
+            yield_batch_unavailable_until = time.monotonic() + YIELD_BATCH_RETRY_SECONDS
+            return None
+        if status == 422:
+            logger.error(f"Yield service rejected batch request: {e.response.text[:500]}")
+        raise
+    return data["forecasts"]
 
-            try:
-                yres = await client.post(f"{YIELD_URL}/forecast", json=yield_req, timeout=15.0)
-            except:
-                yres = await client.post(f"{YIELD_URL_LOCAL}/forecast", json=yield_req, timeout=15.0)
-            yres.raise_for_status()
-            ydata = yres.json()
-
-            return {
-                "fips": fips,
-                "week": current_week,
-                "predicted_yield": ydata.get("yield_forecast_bu_acre"),
-                "confidence_interval": ydata.get("forecast_uncertainty", 0.31),
-                "confidence_lower": ydata.get("confidence_interval_lower"),
-                "confidence_upper": ydata.get("confidence_interval_upper"),
-                "primary_driver": ydata.get("primary_driver", "unknown"),
-                "model_r2": ydata.get("model_r2", 0.835),
-            }
+
+async def timed_county(fips: str, awaitable) -> dict:
+    t0 = time.perf_counter()
+    try:
+        value = await awaitable
+        result = {"fips": fips, "status": "ok", "forecast": value}
+    except Exception as e:
+        result = {"fips": fips, "status": "error", "error": describe_error(e, STATE_CALL_TIMEOUT)}
+    result["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return result
+
+
+async def county_pipeline(fips: str, week: Optional[int], semaphore: asyncio.Semaphore) -> dict:
+    """MCSI timeseries -> yield forecast for one county, holding one concurrency slot"""
+    async with semaphore:
+        timeseries = await cached_timeseries(fips)
+        return await cached_yield(fips, week, timeseries)
+
+
+async def statewide_batched(counties: List[str], week: Optional[int], semaphore: asyncio.Semaphore):
+    """
+    Fetch every timeseries under the semaphore, then score them with /forecast/batch
+
+    Returns (results, mode); falls back to per-county yield calls when the
+    yield service has no batch endpoint or the MCSI data lacks a batch
+    feature. Batch forecasts are not written to the per-county /yield/{fips}
+    cache: the two endpoints score different feature sets.
+    """
+
+    async def fetch(fips):
+        async with semaphore:
+            return await cached_timeseries(fips)
+
+    stage = await asyncio.gather(*[timed_county(fips, fetch(fips)) for fips in counties])
+    ready = [r for r in stage if r["status"] == "ok"]
+    timeseries = {r["fips"]: r.pop("forecast") for r in ready}
+    requests = {fips: build_forecast_request(fips, ts, week) for fips, ts in timeseries.items()}
+
+    t0 = time.perf_counter()
+    chunks = [list(requests)[i : i + YIELD_BATCH_SIZE] for i in range(0, len(requests), YIELD_BATCH_SIZE)]
+    if any(r is None for r in requests.values()):
+        batches = [None]
+    else:
+        batches = await asyncio.gather(
+            *[forecast_batch([requests[f] for f in chunk]) for chunk in chunks], return_exceptions=True
+        )
+
+    if any(b is None for b in batches):
+        # No batch endpoint: finish each county individually, reusing its timeseries
+        async def finish(fips):
+            async with semaphore:
+                return await cached_yield(fips, week, timeseries[fips])
+
+        finished = await asyncio.gather(*[timed_county(r["fips"], finish(r["fips"])) for r in ready])
+        for r, f in zip(ready, finished):
+            r.update(f, latency_ms=round(r["latency_ms"] + f["latency_ms"], 1))
+        return stage, "per_county"
+
+    batch_ms = (time.perf_counter() - t0) * 1000
+    by_fips = {r["fips"]: r for r in ready}
+    for chunk, forecasts in zip(chunks, batches):
+        for fips in chunk:
+            r = by_fips[fips]
+            r["latency_ms"] = round(r["latency_ms"] + batch_ms, 1)
+            if isinstance(forecasts, BaseException):
+                r.update(status="error", error=describe_error(forecasts, STATE_CALL_TIMEOUT))
+                continue
+            r["forecast"] = format_yield_response(fips, requests[fips]["week"], forecasts[chunk.index(fips)])
+    return stage, "batch"
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def statewide_summary(results: List[dict], elapsed_s: float, concurrency: int, mode: str) -> dict:
+    latencies = sorted(r["latency_ms"] for r in results)
+    failures = {r["fips"]: r["error"] for r in results if r["status"] == "error"}
+    return {
+        "counties": len(results),
+        "succeeded": len(results) - len(failures),
+        "failed": len(failures),
+        "failures": failures,
+        "mode": mode,
+        "concurrency": concurrency,
+        "elapsed_ms": round(elapsed_s * 1000, 1),
+        "latency_ms": {
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+@api_router.get("/yield/state")
+async def get_state_yield(
+    week: Optional[int] = None,
+    concurrency: Optional[int] = Query(None, ge=1, le=len(IOWA_COUNTY_FIPS)),
+    stream: bool = False,
+):
+    """
+    Yield forecasts for all 99 Iowa counties
+
+    County pipelines run concurrently, at most `concurrency` at a time. The
+    default response uses the yield batch endpoint when one exists. With
+    stream=true, each county is written as an NDJSON line as soon as it
+    finishes, and a final {"summary": ...} line follows.
+    """
+    limit = concurrency or STATE_FANOUT_CONCURRENCY
+    semaphore = asyncio.Semaphore(limit)
+    started = time.perf_counter()
+
+    if stream:
+
+        async def lines():
+            results = []
+            tasks = [timed_county(fips, county_pipeline(fips, week, semaphore)) for fips in IOWA_COUNTY_FIPS]
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                results.append(result)
+                yield _json.dumps(result) + "\n"
+            summary = statewide_summary(results, time.perf_counter() - started, limit, "per_county")
+            yield _json.dumps({"summary": summary}) + "\n"
+
+        # Headers go out before any county has finished, so a stream is
+        # never known to be complete and is not tagged.
+        return StreamingResponse(lines(), media_type="application/x-ndjson", headers=NO_STORE)
+
+    results, mode = await statewide_batched(IOWA_COUNTY_FIPS, week, semaphore)
+    summary = statewide_summary(results, time.perf_counter() - started, limit, mode)
+    content = {"summary": summary, "results": results}
+    if summary["failed"]:
+        return JSONResponse(content, headers=NO_STORE)
+    return content
+
+
+@api_router.get("/yield/{fips}")
+async def get_yield_forecast(request: Request, fips: str, week: Optional[int] = None):
+    key = ResponseCache.key(f"/yield/{fips}", {"week": week})
+    try:
+        value = await response_cache.get_or_fetch(key, lambda: fetch_yield(fips, week))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Yield error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return cached_json(request, key, value)
+
+
+def describe_error(e: BaseException, timeout: float) -> str:
+    if isinstance(e, asyncio.TimeoutError):
+        return f"timed out after {timeout:g}s"
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"upstream returned {e.response.status_code}"
+    return str(e) or type(e).__name__
+
+
+@api_router.get("/county/{fips}/dashboard")
+async def get_county_dashboard(fips: str, week: Optional[int] = None):
+    """
+    Current MCSI, timeseries and yield forecast for one county in one round trip
+
+    MCSI and timeseries are fetched concurrently; the yield forecast reuses
+    the timeseries instead of fetching it again. Each call has its own
+    deadline, and a call that fails or times out is reported under "errors"
+    while the rest of the page is still returned.
+    """
+    timeout = DASHBOARD_CALL_TIMEOUT
+    timings: Dict[str, float] = {}
+
+    async def timed(name: str, awaitable):
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        finally:
+            timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+    ts_key = ResponseCache.key(f"/mcsi/{fips}/timeseries", {"limit": 30})
+    timeseries_task = asyncio.ensure_future(
+        response_cache.get_or_fetch(ts_key, lambda: fetch_timeseries(fips, limit=30, timeout=timeout))
+    )
+
+    async def forecast():
+        timeseries = await asyncio.shield(timeseries_task)
+        key = ResponseCache.key(f"/yield/{fips}", {"week": week})
+        return await response_cache.get_or_fetch(key, lambda: fetch_yield(fips, week, timeseries))
+
+    names = ["mcsi", "timeseries", "yield"]
+    try:
+        results = await asyncio.gather(
+            timed("mcsi", response_cache.get_or_fetch(ResponseCache.key(f"/mcsi/{fips}"), lambda: fetch_mcsi(fips))),
+            timed("timeseries", asyncio.shield(timeseries_task)),
+            timed("yield", forecast()),
+            return_exceptions=True,
+        )
+    finally:
+        timeseries_task.cancel()
+
+    payload = {"fips": fips, "errors": {}, "timings_ms": timings}
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Dashboard {fips}: {name} failed: {describe_error(result, timeout)}")
+            payload[name] = None
+            payload["errors"][name] = describe_error(result, timeout)
+        else:
+            payload[name] = result
+    payload["partial"] = bool(payload["errors"])
 
+    if len(payload["errors"]) == len(names):
+        raise HTTPException(status_code=503, detail=payload["errors"])
+    if payload["partial"]:
+        return JSONResponse(payload, headers=NO_STORE)
+    return payload
 
 
 # Mount API router at /api prefix
@@ -0,0 +1,113 @@
+"""
+Compression and Conditional GET Helpers for AgriGuard FastAPI Services
+
+Accept-Encoding negotiation, br/gzip compression with per-encoding ratio and
+CPU counters, and If-None-Match / If-Modified-Since checks, shared by the
+orchestrator and the MCSI service. Standard library only; br is offered
+when the brotli package is installed.
+
+Usage:
+    from api.http_helpers import compress_body, negotiate_encoding, new_compression_counters
+
+    compression_counters = new_compression_counters("below_threshold")
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding:
+        body = compress_body(body, encoding, compression_counters)
+"""
+
+import gzip
+import os
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+
+# ==================== Compression ====================
+
+def new_compression_counters(*extra: str) -> Dict[str, Any]:
+    """Per-encoding byte / CPU counters, plus a zeroed counter for each name in extra"""
+    counters: Dict[str, Any] = {
+        encoding: {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0} for encoding in ("br", "gzip")
+    }
+    counters.update(dict.fromkeys(extra, 0))
+    return counters
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header (q=0 excludes)"""
+    if not accept_encoding:
+        return None
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if offered.get(encoding, offered.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(body: bytes, encoding: str, counters: Dict[str, Any]) -> bytes:
+    """Compress with br or gzip, adding the sizes and CPU time to counters[encoding]"""
+    t0 = time.thread_time()
+    if encoding == "br":
+        out = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        out = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    stats = counters[encoding]
+    stats["responses"] += 1
+    stats["bytes_in"] += len(body)
+    stats["bytes_out"] += len(out)
+    stats["cpu_ms"] += (time.thread_time() - t0) * 1000
+    return out
+
+
+def compression_summary(counters: Dict[str, Any]) -> dict:
+    """Counters with CPU time rounded and the compression ratio per encoding"""
+    summary = {"brotli_available": brotli is not None}
+    for key, value in counters.items():
+        if isinstance(value, dict):
+            value = dict(
+                value,
+                cpu_ms=round(value["cpu_ms"], 2),
+                ratio=round(value["bytes_in"] / value["bytes_out"], 2) if value["bytes_out"] else None,
+            )
+        summary[key] = value
+    return summary
+
+
+# ==================== Conditional GET ====================
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match or not etag:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in (c.removeprefix("W/") for c in candidates)
+
+
+def not_modified_since(if_modified_since: Optional[str], last_modified: Optional[str]) -> bool:
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,233 @@
+"""
+Request / Dependency Instrumentation for AgriGuard FastAPI Services
+
+Latency histograms, status counters and in-flight gauges per route and per
+dependency (upstream service, vector store, LLM), a per-request
+Server-Timing header, and a Prometheus text /metrics endpoint. No
+dependencies beyond Starlette.
+
+Usage:
+    from api.metrics import install_metrics
+
+    metrics = install_metrics(app, service="mcsi")
+
+    with metrics.timed("chroma"):
+        results = collection.query(...)
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+# Prometheus client defaults (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the charset
+
+# Timings recorded while the current request is being handled: name -> [total ms, count]
+_request_timings: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.label_names, k)} {v:g}" for k, v in sorted(self.values.items())]
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts incl. +Inf, sum, count)
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+def outcome_of(status_code: Optional[int]) -> str:
+    return f"{status_code // 100}xx" if status_code else "error"
+
+
+class Metrics:
+    """Metric families for one service, plus the Server-Timing collector"""
+
+    def __init__(self, service: str, buckets=DEFAULT_BUCKETS):
+        self.service = service
+        self.requests = Counter("http_requests_total", "HTTP requests by route, method and status",
+                                ("route", "method", "status"))
+        self.latency = Histogram("http_request_duration_seconds", "Time to response start by route",
+                                 ("route", "method"), buckets)
+        self.in_flight = Gauge("http_requests_in_flight", "Requests currently being handled")
+        self.dependency_latency = Histogram("dependency_request_duration_seconds",
+                                            "Outbound calls by dependency and outcome",
+                                            ("dependency", "outcome"), buckets)
+        self.dependency_in_flight = Gauge("dependency_requests_in_flight", "Outbound calls in progress",
+                                          ("dependency",))
+        self.families = [self.requests, self.latency, self.in_flight, self.dependency_latency,
+                         self.dependency_in_flight]
+
+    def observe_dependency(self, name: str, seconds: float, outcome: str):
+        self.dependency_latency.observe(seconds, name, outcome)
+        record_timing(name, seconds * 1000)
+
+    @contextmanager
+    def timed(self, name: str):
+        """Time an outbound call; exceptions count as outcome "error" """
+        self.dependency_in_flight.inc(name)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.dependency_in_flight.dec(name)
+            self.observe_dependency(name, time.perf_counter() - started, outcome)
+
+    def render(self) -> str:
+        lines = [f'# service="{_escape(self.service)}"']
+        for family in self.families:
+            lines += family.render()
+        return "\n".join(lines) + "\n"
+
+
+def record_timing(name: str, ms: float):
+    """Add to the current request's Server-Timing entry for name (no-op outside a request)"""
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += ms
+        entry[1] += 1
+
+
+def server_timing_header(timings: Dict[str, List[float]], total_ms: float) -> str:
+    parts = []
+    for name, (ms, count) in timings.items():
+        part = f"{name};dur={ms:.1f}"
+        if count > 1:
+            part += f';desc="{count} calls"'
+        parts.append(part)
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: per-route latency, status and in-flight, plus Server-Timing
+
+    Routes are labelled by their template (/api/yield/{fips}), not the raw
+    path, to keep label cardinality bounded.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self._route_paths: Dict[object, str] = {}
+
+    def route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            app = scope.get("app")
+            routes = getattr(getattr(app, "router", None), "routes", [])
+            path = next((r.path for r in routes if getattr(r, "endpoint", None) is endpoint), "unmatched")
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metrics = self.metrics
+        timings: Dict[str, List[float]] = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = {"code": None}
+        metrics.in_flight.inc()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                elapsed = time.perf_counter() - started
+                route, method = self.route_label(scope), scope["method"]
+                metrics.latency.observe(elapsed, route, method)
+                metrics.requests.inc(route, method, str(message["status"]))
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(timings, elapsed * 1000).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            if status["code"] is None:
+                metrics.requests.inc(self.route_label(scope), scope["method"], "500")
+            raise
+        finally:
+            metrics.in_flight.dec()
+            _request_timings.reset(token)
+
+
+def install_metrics(app, service: str, path: str = "/metrics", buckets=DEFAULT_BUCKETS) -> Metrics:
+    """Add the middleware and a Prometheus text endpoint to a FastAPI/Starlette app"""
+    metrics = Metrics(service, buckets)
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    async def prometheus_metrics(request: Request):
+        return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.add_route(path, prometheus_metrics, methods=["GET"], include_in_schema=False)
+    return metrics
@@ -10,17 +10,37 @@ Calculates weekly corn stress indicators from satellite and weather data:
 Data source: Clean weekly aggregates from GCS
 """
 
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import hashlib
 import logging
+import os
+import time
 from enum import Enum
 
+try:
+    from api.metrics import install_metrics
+except ImportError:  # uvicorn mcsi_service:app: the image copies api/metrics.py onto PYTHONPATH
+    try:
+        from metrics import install_metrics
+    except ImportError:
+        install_metrics = None
+
+try:
+    from api.http_helpers import (compress_body, compression_summary, etag_matches, negotiate_encoding,
+                                  new_compression_counters, not_modified_since)
+except ImportError:  # copied next to metrics.py by the image
+    from http_helpers import (compress_body, compression_summary, etag_matches, negotiate_encoding,
+                              new_compression_counters, not_modified_since)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,13 +51,23 @@ app = FastAPI(
     version="1.0.0"
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# ==================== Data Version ====================
+
+def compute_data_version(data: pd.DataFrame) -> tuple:
+    """
+    Weak ETag and Last-Modified for a loaded weekly dataset
+
+    The ETag hashes every row, so any correction to the data changes it, not
+    only a new week. Last-Modified is the end of the latest week (capped at now).
+    """
+    row_hash = int(pd.util.hash_pandas_object(data, index=False).sum())
+    latest = data['week_start'].max()
+    digest = hashlib.sha1(f"{len(data)}:{latest}:{row_hash}".encode()).hexdigest()[:16]
+
+    week_end = (latest + timedelta(days=6)).to_pydatetime().replace(tzinfo=timezone.utc)
+    last_modified = min(week_end, datetime.now(timezone.utc))
+    return f'W/"mcsi-{digest}"', format_datetime(last_modified, usegmt=True)
+
 
 # ==================== Data Models ====================
 
@@ -117,6 +147,8 @@ class MCSICalculator:
         """Initialize calculator with thresholds"""
         self.data = None
         self.climatology = None
+        self.etag = None
+        self.last_modified = None
         self._load_data()
     
     def _load_data(self):
@@ -140,7 +172,9 @@ class MCSICalculator:
             # Ensure date columns are datetime
             self.data['week_start'] = pd.to_datetime(self.data['week_start'])
             
-            logger.info(f"Loaded {len(self.data)} weekly records")
+            self.etag, self.last_modified = compute_data_version(self.data)
+
+            logger.info(f"Loaded {len(self.data)} weekly records (version {self.etag})")
             logger.info(f"Data date range: {self.data['week_start'].min()} to {self.data['week_start'].max()}")
             
         except Exception as e:
@@ -549,13 +583,139 @@ class MCSICalculator:
 calculator = MCSICalculator()
 
 
+# ==================== Response Compression ====================
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))  # GZIP_LEVEL / BROTLI_QUALITY in http_helpers
+RESPONSE_CACHE_ENTRIES = int(os.getenv("MCSI_RESPONSE_CACHE_ENTRIES", "512"))
+
+# (data version, path, query) -> {"content-type", "identity", "gzip", "br"}
+response_bodies: "OrderedDict[tuple, dict]" = OrderedDict()
+compression_counters = new_compression_counters("body_cache_hits", "body_cache_misses")
+
+
+@app.middleware("http")
+async def compressed_responses(request: Request, call_next):
+    """
+    Negotiated br/gzip for JSON bodies above COMPRESSION_MIN_BYTES
+
+    Responses only change when the data reloads, so /mcsi/* bodies are kept
+    (LRU-bounded) next to their gzip/br variants and repeat requests skip both
+    the MCSI computation and recompression.
+    """
+    if request.method != "GET":
+        return await call_next(request)
+
+    cacheable = request.url.path.startswith("/mcsi/")
+    key = (calculator.etag, request.url.path, request.url.query)
+    cached = response_bodies.get(key) if cacheable else None
+    if cached is None:
+        response = await call_next(request)
+        if response.status_code != 200 or not response.headers.get("content-type", "").startswith("application/json"):
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        # Everything the route set except the length, which changes with the encoding
+        headers = [(k, v) for k, v in response.raw_headers if k.lower() != b"content-length"]
+        cached = {"headers": headers, "identity": body}
+        if cacheable:
+            compression_counters["body_cache_misses"] += 1
+            response_bodies[key] = cached
+            while len(response_bodies) > RESPONSE_CACHE_ENTRIES:
+                response_bodies.popitem(last=False)
+    else:
+        compression_counters["body_cache_hits"] += 1
+        response_bodies.move_to_end(key)
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    body = cached["identity"]
+    if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+        if encoding not in cached:
+            cached[encoding] = compress_body(body, encoding, compression_counters)
+        body = cached[encoding]
+    else:
+        encoding = None
+
+    response = Response(body)
+    response.raw_headers.extend(cached["headers"])
+    response.headers.add_vary_header("Accept-Encoding")
+    if encoding:
+        response.headers["content-encoding"] = encoding
+    return response
+
+
+@app.get("/compression")
+async def compression_stats():
+    """Compression ratio and CPU time per encoding, and body cache hits"""
+    return dict(min_bytes=COMPRESSION_MIN_BYTES, cached_bodies=len(response_bodies),
+                **compression_summary(compression_counters))
+
+
+# GETs whose body is a function of the loaded data; /health only advertises the version
+DATA_PATH_PREFIX = "/mcsi/"
+
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """
+    ETag / Last-Modified on /mcsi/* GETs, keyed on the loaded data version
+
+    The data only changes when the service reloads, so a matching
+    If-None-Match is answered with 304 before any MCSI is computed.
+    /health carries the ETag (the orchestrator's version probe) but is never
+    a 304; /metrics, /compression and /indicators change independently of
+    the data and get no validators.
+    """
+    path = request.url.path
+    if request.method != "GET" or calculator.etag is None:
+        return await call_next(request)
+    if not path.startswith(DATA_PATH_PREFIX):
+        response = await call_next(request)
+        if path == "/health" and response.status_code == 200:
+            response.headers["ETag"] = calculator.etag
+        return response
+
+    validators = {
+        "ETag": calculator.etag,
+        "Last-Modified": calculator.last_modified,
+        "Cache-Control": "no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, calculator.etag) or (
+        if_none_match is None
+        and not_modified_since(request.headers.get("if-modified-since"), calculator.last_modified)
+    ):
+        return Response(status_code=304, headers=validators)
+
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(validators)
+    return response
+
+
+# Added after the HTTP middlewares so it wraps them: body-cache hits and 304s
+# never reach the route, and still need the CORS headers for the caller's origin
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Outermost: request latency, Server-Timing and Prometheus /metrics
+if install_metrics is None:
+    logger.warning("metrics module not found: /metrics and Server-Timing are disabled")
+metrics = install_metrics(app, service="mcsi") if install_metrics else None
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
         "service": "MCSI API",
-        "data_loaded": calculator.data is not None
+        "data_loaded": calculator.data is not None,
+        "data_version": calculator.etag,
+        "last_modified": calculator.last_modified,
     }
 
 
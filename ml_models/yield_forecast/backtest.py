@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Yield Forecast Backtest & Throughput Harness
+
+Replays weekly forecasts for every county-season in local Parquet fixtures
+through the yield service predict path (in-process or over HTTP) and writes
+a JSON report with accuracy per forecast week and serving cost.
+
+Fixtures:
+    features  fips, year, week, heat_days, water_deficit, precip, ndvi_avg, ndvi_min
+              (+ actual_yield, unless --yields is given)
+    yields    fips, year, actual_yield
+
+Usage (from the repository root):
+    python -m ml_models.yield_forecast.backtest --features weekly.parquet --yields yields.parquet
+    python -m ml_models.yield_forecast.backtest --features weekly.parquet --model candidate.npz
+    python -m ml_models.yield_forecast.backtest --features weekly.parquet --url http://localhost:8001 --batch-size 99
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from ml_models.yield_forecast import yield_forecast_service as service
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ["fips", "year", "week"]
+
+
+# ============================================================================
+# FIXTURES
+# ============================================================================
+
+
+def load_fixtures(features_path: str, yields_path: Optional[str] = None,
+                  start_year: int = 2016, end_year: int = 2024) -> pd.DataFrame:
+    """Load weekly features joined to end-of-season yields, one row per forecast"""
+    df = pd.read_parquet(features_path)
+    if yields_path:
+        yields = pd.read_parquet(yields_path)[["fips", "year", "actual_yield"]]
+        df = df.drop(columns=["actual_yield"], errors="ignore").merge(yields, on=["fips", "year"], how="inner")
+
+    missing = [c for c in KEY_COLUMNS + service.FEATURE_NAMES + ["actual_yield"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"Fixtures missing columns: {missing}")
+
+    df["fips"] = df["fips"].astype(str).str.zfill(5)
+    df = df[(df["year"] >= start_year) & (df["year"] <= end_year)].dropna(subset=service.FEATURE_NAMES + ["actual_yield"])
+    return df.sort_values(["year", "week", "fips"]).reset_index(drop=True)
+
+
+def to_requests(rows: pd.DataFrame) -> List[dict]:
+    records = rows[KEY_COLUMNS + service.FEATURE_NAMES].to_dict(orient="records")
+    for r in records:
+        r["fips"] = str(r["fips"])
+        r["year"] = int(r["year"])
+        r["week"] = int(r["week"])
+    return records
+
+
+# ============================================================================
+# PREDICTORS
+# ============================================================================
+
+
+class InProcessPredictor:
+    """Calls the same code path as POST /forecast(/batch), without the network"""
+
+    mode = "in_process"
+
+    def __init__(self, model: Optional[service.YieldModel] = None):
+        self.model = model or service.registry.live
+
+    def __call__(self, payloads: List[dict]) -> List[dict]:
+        requests = [service.ForecastRequest(**p) for p in payloads]
+        return service.predict_forecasts(requests, self.model)
+
+
+class HttpPredictor:
+    """Posts to a running yield service; any httpx.Client-compatible client works"""
+
+    mode = "http"
+
+    def __init__(self, base_url: str, client=None, timeout: float = 15.0):
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        self.client = client or httpx.Client(timeout=timeout)
+
+    def __call__(self, payloads: List[dict]) -> List[dict]:
+        if len(payloads) == 1:
+            response = self.client.post(f"{self.base_url}/forecast", json=payloads[0])
+            response.raise_for_status()
+            return [response.json()]
+        response = self.client.post(f"{self.base_url}/forecast/batch", json={"requests": payloads})
+        response.raise_for_status()
+        return response.json()["forecasts"]
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+
+def accuracy(actual: np.ndarray, predicted: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> dict:
+    if len(actual) == 0:
+        return {"n": 0, "mae": None, "rmse": None, "bias": None, "r2": None, "interval_coverage": None,
+                "mean_interval_width": None}
+    err = predicted - actual
+    ss_tot = float(((actual - actual.mean()) ** 2).sum())
+    return {
+        "n": int(len(actual)),
+        "mae": float(np.abs(err).mean()),
+        "rmse": float(np.sqrt((err ** 2).mean())),
+        "bias": float(err.mean()),
+        "r2": 1.0 - float((err ** 2).sum()) / ss_tot if ss_tot > 0 else None,
+        "interval_coverage": float(np.mean((actual >= lower) & (actual <= upper))),
+        "mean_interval_width": float((upper - lower).mean()),
+    }
+
+
+def latency_summary(latencies_s: List[float]) -> Optional[dict]:
+    """Per-call latency percentiles in ms, or None when nothing was timed"""
+    if len(latencies_s) == 0:
+        return None
+    ms = np.asarray(latencies_s) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(ms.mean()), "max": float(ms.max())}
+
+
+# ============================================================================
+# BACKTEST
+# ============================================================================
+
+
+def run_backtest(df: pd.DataFrame, predictor: Callable[[List[dict]], List[dict]], batch_size: int = 1,
+                 warmup: int = 5) -> dict:
+    """Replay every row of df through predictor and score accuracy and serving cost"""
+    payloads = to_requests(df)
+
+    for i in range(min(warmup, len(payloads))):
+        predictor(payloads[i : i + 1])
+
+    forecasts, latencies = [], []
+    started = time.perf_counter()
+    for i in range(0, len(payloads), batch_size):
+        t0 = time.perf_counter()
+        forecasts.extend(predictor(payloads[i : i + batch_size]))
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    actual = df["actual_yield"].to_numpy(dtype=float)
+    predicted = np.array([f["predicted_yield"] for f in forecasts])
+    lower = np.array([f.get("confidence_interval_lower", f["predicted_yield"]) for f in forecasts])
+    upper = np.array([f.get("confidence_interval_upper", f["predicted_yield"]) for f in forecasts])
+    weeks = df["week"].to_numpy()
+
+    by_week = {
+        str(int(w)): accuracy(actual[weeks == w], predicted[weeks == w], lower[weeks == w], upper[weeks == w])
+        for w in np.unique(weeks)
+    }
+
+    return {
+        "mode": getattr(predictor, "mode", "custom"),
+        "model": getattr(getattr(predictor, "model", None), "name", None),
+        "years": [int(df["year"].min()), int(df["year"].max())] if len(df) else None,
+        "counties": int(df["fips"].nunique()),
+        "n_forecasts": len(forecasts),
+        "batch_size": batch_size,
+        "elapsed_s": elapsed,
+        "throughput_forecasts_per_s": len(forecasts) / elapsed if elapsed > 0 else None,
+        "latency_ms_per_call": latency_summary(latencies),
+        "accuracy": {"overall": accuracy(actual, predicted, lower, upper), "by_week": by_week},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest yield forecasts for accuracy and serving cost")
+    parser.add_argument("--features", required=True, help="Weekly features Parquet fixture")
+    parser.add_argument("--yields", help="End-of-season yields Parquet (if not in features)")
+    parser.add_argument("--start-year", type=int, default=2016)
+    parser.add_argument("--end-year", type=int, default=2024)
+    parser.add_argument("--model", help="Model artifact (.npz) to evaluate in-process instead of the live one")
+    parser.add_argument("--url", help="Yield service base URL; replays over HTTP instead of in-process")
+    parser.add_argument("--batch-size", type=int, default=1, help="Forecasts per call (>1 uses /forecast/batch)")
+    parser.add_argument("--output", default="yield_backtest_report.json", help="Report path")
+    args = parser.parse_args()
+
+    df = load_fixtures(args.features, args.yields, args.start_year, args.end_year)
+    logger.info(f"Loaded {len(df)} forecasts ({df['fips'].nunique()} counties, {args.start_year}-{args.end_year})")
+
+    if args.url:
+        predictor = HttpPredictor(args.url)
+    else:
+        model = service.YieldModel.from_artifact(args.model) if args.model else None
+        predictor = InProcessPredictor(model)
+
+    report = run_backtest(df, predictor, batch_size=args.batch_size)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if not report["n_forecasts"]:
+        logger.warning(f"No forecasts to score for {args.start_year}-{args.end_year}; wrote empty report to {args.output}")
+        return 1
+
+    overall = report["accuracy"]["overall"]
+    lat = report["latency_ms_per_call"]
+    r2 = overall["r2"] if overall["r2"] is not None else float("nan")
+    logger.info(f"MAE {overall['mae']:.2f} bu/acre, R² {r2:.3f}, coverage {overall['interval_coverage']:.2%}")
+    logger.info(
+        f"{report['throughput_forecasts_per_s']:.0f} forecasts/s, "
+        f"p50 {lat['p50']:.2f} ms, p95 {lat['p95']:.2f} ms, p99 {lat['p99']:.2f} ms"
+    )
+    logger.info(f"✓ Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
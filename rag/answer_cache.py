@@ -0,0 +1,122 @@
+"""
+Semantic Answer Cache for AgriBot Chat
+
+Near-duplicate questions about the same county and week reuse a previous
+LLM answer. Entries are partitioned by (county, week, stress bucket) so an
+answer is never served against different field conditions; within a
+partition a hit needs cosine similarity >= threshold between query
+embeddings. Entries expire after a TTL and the cache is LRU-bounded.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Stress indices are 0-100; answers are reused within a band of this width
+DEFAULT_STRESS_BUCKET_WIDTH = 10.0
+STRESS_KEYS = ("csi_overall", "water_stress", "heat_stress")
+
+
+def stress_bucket(agri_context: Optional[dict], width: float = DEFAULT_STRESS_BUCKET_WIDTH) -> Tuple:
+    """Coarse stress context: each index floored to its band (None when missing)"""
+    agri_context = agri_context or {}
+    bucket = []
+    for key in STRESS_KEYS:
+        value = agri_context.get(key)
+        try:
+            bucket.append(int(float(value) // width))
+        except (TypeError, ValueError):
+            bucket.append(None)
+    return tuple(bucket)
+
+
+@dataclass
+class CachedAnswer:
+    partition: Hashable
+    vector: np.ndarray  # unit-normalized query embedding
+    answer: str
+    contexts: List[dict]
+    stored_at: float
+    hits: int = field(default=0)
+
+
+class SemanticAnswerCache:
+    """
+    Thread-safe semantic cache of chat answers
+
+    lookup() returns (answer, similarity) for the most similar live entry in
+    the same partition, or None.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _expire(self, now: float):
+        stale = [k for k, e in self._entries.items() if now - e.stored_at > self.ttl]
+        for k in stale:
+            del self._entries[k]
+        self.counters["expired"] += len(stale)
+
+    def lookup(self, partition: Hashable, vector: Sequence[float]) -> Optional[Tuple[CachedAnswer, float]]:
+        query = self._unit(vector)
+        with self._lock:
+            self._expire(self.clock())
+            candidates = [(k, e) for k, e in self._entries.items() if e.partition == partition]
+            if candidates:
+                similarities = np.stack([e.vector for _, e in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    entry.hits += 1
+                    self.counters["hits"] += 1
+                    return entry, float(similarities[best])
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, partition: Hashable, vector: Sequence[float], answer: str, contexts: List[dict]):
+        with self._lock:
+            self._entries[self._next_id] = CachedAnswer(partition, self._unit(vector), answer, contexts, self.clock())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        return dict(
+            c,
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            threshold=self.threshold,
+            ttl_seconds=self.ttl,
+            hit_ratio=round(c["hits"] / lookups, 4) if lookups else None,
+        )
@@ -0,0 +1,247 @@
+"""
+BM25 Keyword Index for Hybrid RAG Retrieval
+
+Dense embeddings blur exact agronomic terms and product codes ("SDD",
+"MOD13A1", "VT/R1"). This inverted index is built at seed time over the
+same chunks (same ids) as the Chroma collection and persisted next to it:
+postings are CSR arrays (term offsets, uint32 chunk ids, uint16 term
+frequencies) in one .npz, with vocabulary and chunk texts in JSON.
+
+hybrid_search() runs the keyword query alongside the vector query and merges
+the two rankings by reciprocal rank fusion.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from rag.metadata_filter import MetadataBitmaps
+except ImportError:
+    from metadata_filter import MetadataBitmaps
+
+logger = logging.getLogger(__name__)
+
+POSTINGS_FILE = "postings.npz"
+CHUNKS_FILE = "chunks.json"
+
+# Okapi BM25 defaults
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Reciprocal rank fusion constant (Cormack et al.)
+RRF_K = 60
+
+# Words with internal "/", "." or "-" (VT/R1, 0.6, El-Nino) are kept whole and also split
+_TOKEN = re.compile(r"[a-z0-9]+(?:[/.\-][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over compact CSR postings"""
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[dict],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ):
+        self.vocabulary = vocabulary
+        self.offsets, self.doc_ids, self.tfs, self.doc_len = offsets, doc_ids, tfs, doc_len
+        self.ids, self.documents, self.metadatas = ids, documents, metadatas
+        self.k1, self.b = k1, b
+
+        n = len(ids)
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_len = float(doc_len.mean()) if n else 1.0
+        # Per-chunk length normalization, precomputed once
+        self._norm = (k1 * (1 - b + b * doc_len / max(avg_len, 1e-9))).astype(np.float32)
+        self.bitmaps = MetadataBitmaps(metadatas)
+        self.queries = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: Optional[List[dict]] = None,
+              k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        postings: List[List[tuple]] = []
+        doc_len = np.zeros(len(documents), dtype=np.uint32)
+        for doc_id, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_id, min(tf, 65535)))
+
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        flat = [entry for plist in postings for entry in plist]
+        doc_ids = np.fromiter((d for d, _ in flat), dtype=np.uint32, count=len(flat))
+        tfs = np.fromiter((tf for _, tf in flat), dtype=np.uint16, count=len(flat))
+        metadatas = [m or {} for m in (metadatas or [{}] * len(ids))]
+        return cls(vocabulary, offsets, doc_ids, tfs, doc_len, list(ids), list(documents), metadatas, k1, b)
+
+    def save(self, path: str) -> "BM25Index":
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, POSTINGS_FILE), offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs,
+                 doc_len=self.doc_len)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(path, CHUNKS_FILE), "w") as f:
+            json.dump({"terms": terms, "ids": self.ids, "documents": self.documents, "metadatas": self.metadatas,
+                       "k1": self.k1, "b": self.b}, f)
+        logger.info(f"Saved BM25 index: {len(self)} chunks, {len(terms)} terms, {len(self.doc_ids)} postings")
+        return self
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        """Index saved by save(), or None when there is none"""
+        postings_path = os.path.join(path, POSTINGS_FILE)
+        chunks_path = os.path.join(path, CHUNKS_FILE)
+        if not (os.path.exists(postings_path) and os.path.exists(chunks_path)):
+            return None
+        with open(chunks_path) as f:
+            chunks = json.load(f)
+        with np.load(postings_path) as arrays:
+            index = cls(
+                {term: i for i, term in enumerate(chunks["terms"])},
+                arrays["offsets"], arrays["doc_ids"], arrays["tfs"], arrays["doc_len"],
+                chunks["ids"], chunks["documents"], chunks["metadatas"], chunks["k1"], chunks["b"],
+            )
+        logger.info(f"Loaded BM25 index: {len(index)} chunks from {path}")
+        return index
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def query(self, query: str, n_results: int = 10, where: Optional[dict] = None) -> dict:
+        """Collection.query-shaped single-query result with BM25 "scores" (chunks matching no term omitted)"""
+        self.queries += 1
+        scores = self.scores(query)
+        allowed = self.bitmaps.mask(where)
+        if allowed is not None:
+            scores[~allowed] = 0
+        matching = np.flatnonzero(scores)
+        k = min(n_results, len(matching))
+        top = matching[np.argpartition(-scores[matching], k - 1)[:k]] if k else matching[:0]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return {
+            "ids": [[self.ids[i] for i in top]],
+            "documents": [[self.documents[i] for i in top]],
+            "metadatas": [[self.metadatas[i] for i in top]],
+            "scores": [[float(scores[i]) for i in top]],
+        }
+
+    def stats(self) -> dict:
+        return {"chunks": len(self), "terms": len(self.vocabulary), "postings": int(len(self.doc_ids)),
+                "queries": self.queries}
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[tuple]:
+    """(id, score) by descending sum of 1 / (k + rank) over the rankings"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def fuse_results(vector: dict, keyword: dict, n_results: int, k: int = RRF_K) -> dict:
+    """
+    Merge single-query vector and BM25 results into one Collection.query-shaped result
+
+    "scores" holds the fused RRF score; "distances" keeps the vector distance
+    where the chunk came from the vector search (None for keyword-only hits).
+    """
+    chunks = {}
+    for result in (keyword, vector):
+        metadatas = result.get("metadatas") or [[{}] * len(result["ids"][0])]
+        for chunk_id, document, metadata in zip(result["ids"][0], result["documents"][0], metadatas[0]):
+            chunks[chunk_id] = (document, metadata or {})
+    distances = dict(zip(vector["ids"][0], (vector.get("distances") or [[]])[0]))
+
+    fused = reciprocal_rank_fusion([vector["ids"][0], keyword["ids"][0]], k)[:n_results]
+    return {
+        "ids": [[chunk_id for chunk_id, _ in fused]],
+        "documents": [[chunks[chunk_id][0] for chunk_id, _ in fused]],
+        "metadatas": [[chunks[chunk_id][1] for chunk_id, _ in fused]],
+        "distances": [[distances.get(chunk_id) for chunk_id, _ in fused]],
+        "scores": [[round(score, 6) for _, score in fused]],
+    }
+
+
+def split_results(results: dict) -> List[dict]:
+    """Multi-query Collection.query result -> one single-query result per query"""
+    count = len(results["ids"])
+    return [
+        {key: value[i:i + 1] if isinstance(value, list) else value for key, value in results.items()}
+        for i in range(count)
+    ]
+
+
+def _default_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+    return _executor
+
+
+def hybrid_search_batch(vector_search: Callable[[int], dict], keyword_index: BM25Index, queries: List[str],
+                        n_results: int, candidates: int, executor: Optional[ThreadPoolExecutor] = None,
+                        where: Optional[dict] = None) -> List[dict]:
+    """
+    BM25 for every query on a worker thread while vector_search(candidates)
+    (one multi-query call) runs on this one, then RRF per query
+
+    Both sides fetch `candidates` (> n_results) so fusion can promote chunks
+    that only one retriever ranks highly. `where` restricts the keyword side
+    the same way it restricts the vector search.
+    """
+    executor = executor or _default_executor()
+    keyword_future = executor.submit(lambda: [keyword_index.query(q, candidates, where) for q in queries])
+    vectors = split_results(vector_search(candidates))
+    return [fuse_results(vector, keyword, n_results) for vector, keyword in zip(vectors, keyword_future.result())]
+
+
+def hybrid_search(vector_search: Callable[[int], dict], keyword_index: BM25Index, query: str,
+                  n_results: int, candidates: int, executor: Optional[ThreadPoolExecutor] = None,
+                  where: Optional[dict] = None) -> dict:
+    """Single-query hybrid_search_batch"""
+    return hybrid_search_batch(vector_search, keyword_index, [query], n_results, candidates, executor, where)[0]
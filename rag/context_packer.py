@@ -0,0 +1,208 @@
+"""
+Context Assembly for RAG Prompts
+
+Retrieved chunks overlap (the seeder splits pages with a 100-char overlap)
+and the same PDF may have been indexed more than once, so raw top-k wastes
+prompt tokens on repeated text. pack_contexts():
+
+1. merges chunks from the same source and page whose text overlaps
+   (end of one == start of the next) into one passage,
+2. drops near-duplicates by word-shingle Jaccard similarity,
+3. orders the rest by maximal marginal relevance (relevance vs. lexical
+   similarity to what is already selected),
+4. packs passages into a token budget, trimming the last one at a sentence
+   or word boundary instead of blindly cutting every chunk at 500 chars.
+"""
+
+import re
+from typing import Dict, FrozenSet, List, Optional
+
+# Rough English average for the Gemini / MiniLM tokenizers; no tokenizer dependency
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 1200
+MIN_MERGE_OVERLAP = 20  # chars of suffix/prefix overlap that mark adjacent chunks
+MAX_MERGE_OVERLAP = 300
+SHINGLE_SIZE = 4  # words
+DUPLICATE_JACCARD = 0.8
+MMR_LAMBDA = 0.7
+MIN_PARTIAL_TOKENS = 48  # don't bother packing a trimmed tail shorter than this
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"[.!?]\s")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, -(-len(text) // CHARS_PER_TOKEN))
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> FrozenSet[int]:
+    words = _words(text)
+    if len(words) < size:
+        return frozenset([hash(tuple(words))]) if words else frozenset()
+    return frozenset(hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1))
+
+
+def jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def candidates_from_results(results: dict) -> List[dict]:
+    """Single-query Collection.query (or fused) result -> candidate dicts, best first"""
+    ids = results["ids"][0] if results.get("ids") else []
+    documents = results["documents"][0] if results.get("documents") else []
+    metadatas = (results.get("metadatas") or [[{}] * len(ids)])[0]
+    if results.get("scores"):
+        scores = results["scores"][0]
+    else:
+        distances = (results.get("distances") or [[None] * len(ids)])[0]
+        scores = [1 - d if d is not None else 0.0 for d in distances]
+    return [
+        {"id": chunk_id, "text": text or "", "metadata": metadata or {}, "score": float(score)}
+        for chunk_id, text, metadata, score in zip(ids, documents, metadatas, scores)
+    ]
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 below MIN_MERGE_OVERLAP)"""
+    for length in range(min(len(a), len(b), MAX_MERGE_OVERLAP), MIN_MERGE_OVERLAP - 1, -1):
+        if a.endswith(b[:length]):
+            return length
+    return 0
+
+
+def _location(candidate: dict) -> tuple:
+    metadata = candidate["metadata"]
+    return (metadata.get("source"), metadata.get("page"))
+
+
+def _follows(first: dict, second: dict) -> bool:
+    """second directly follows first: by chunk position when the seeder recorded it, else by text overlap"""
+    if first["span"] and second["span"]:
+        return second["span"][0] == first["span"][1] + 1
+    return True
+
+
+def merge_adjacent(candidates: List[dict]) -> List[dict]:
+    """Join overlapping chunks of the same source/page; the passage keeps its best score and rank"""
+    passages = []
+    for c in candidates:
+        position = c["metadata"].get("chunk_index")
+        passages.append(dict(c, ids=[c["id"]], span=(position, position) if isinstance(position, int) else None))
+    merged = True
+    while merged:
+        merged = False
+        for i, first in enumerate(passages):
+            for j, second in enumerate(passages):
+                if i == j or _location(first) != _location(second) or first["metadata"].get("source") is None:
+                    continue
+                if not _follows(first, second):
+                    continue
+                overlap = _overlap(first["text"], second["text"])
+                if not overlap:
+                    continue
+                keep, drop = (i, j) if i < j else (j, i)
+                passages[keep] = dict(
+                    passages[keep],
+                    text=first["text"] + second["text"][overlap:],
+                    score=max(first["score"], second["score"]),
+                    ids=first["ids"] + second["ids"],
+                    span=(first["span"][0], second["span"][1]) if first["span"] and second["span"] else None,
+                )
+                del passages[drop]
+                merged = True
+                break
+            if merged:
+                break
+    return passages
+
+
+def drop_near_duplicates(passages: List[dict], threshold: float = DUPLICATE_JACCARD) -> List[dict]:
+    """Keep the best-ranked of any passages whose shingle sets are near-identical"""
+    kept: List[dict] = []
+    for passage in passages:
+        passage["_shingles"] = shingles(passage["text"])
+        if all(jaccard(passage["_shingles"], other["_shingles"]) < threshold for other in kept):
+            kept.append(passage)
+    return kept
+
+
+def mmr_order(passages: List[dict], lambda_: float = MMR_LAMBDA) -> List[dict]:
+    """Greedy maximal marginal relevance; similarity is word-set Jaccard"""
+    if not passages:
+        return []
+    # Scale-free relevance: RRF scores (~0.03) and cosine similarities both map to (0, 1]
+    high = max(p["score"] for p in passages)
+    relevance = [p["score"] / high if high > 0 else 1.0 for p in passages]
+    vocab = [frozenset(_words(p["text"])) for p in passages]
+
+    remaining = list(range(len(passages)))
+    order: List[int] = []
+    while remaining:
+        def marginal(i):
+            redundancy = max((jaccard(vocab[i], vocab[j]) for j in order), default=0.0)
+            return lambda_ * relevance[i] - (1 - lambda_) * redundancy
+
+        best = max(remaining, key=marginal)
+        order.append(best)
+        remaining.remove(best)
+    return [passages[i] for i in order]
+
+
+def trim_to_tokens(text: str, tokens: int) -> str:
+    """Cut at the last sentence end (else word break) that fits the token allowance"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    sentence_ends = [m.end() for m in _SENTENCE_END.finditer(head + " ")]
+    if sentence_ends and sentence_ends[-1] > limit // 2:
+        return head[:sentence_ends[-1]].rstrip()
+    return head.rsplit(" ", 1)[0].rstrip()
+
+
+def pack_contexts(
+    candidates: List[dict],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    max_contexts: Optional[int] = None,
+    duplicate_threshold: float = DUPLICATE_JACCARD,
+    lambda_: float = MMR_LAMBDA,
+) -> List[dict]:
+    """
+    Candidates (best first, as from candidates_from_results) -> prompt contexts
+
+    Each context: text, score, source, page, ids (merged chunk ids), tokens.
+    """
+    passages = mmr_order(drop_near_duplicates(merge_adjacent(candidates), duplicate_threshold), lambda_)
+
+    contexts: List[Dict] = []
+    remaining = token_budget
+    for passage in passages:
+        if max_contexts is not None and len(contexts) >= max_contexts:
+            break
+        text = passage["text"].strip()
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if remaining < MIN_PARTIAL_TOKENS:
+                break
+            text = trim_to_tokens(text, remaining)
+            tokens = estimate_tokens(text)
+        contexts.append(
+            {
+                "text": text,
+                "score": passage["score"],
+                "source": passage["metadata"].get("source"),
+                "page": passage["metadata"].get("page"),
+                "ids": passage["ids"],
+                "tokens": tokens,
+            }
+        )
+        remaining -= tokens
+        if remaining <= 0:
+            break
+    return contexts
@@ -0,0 +1,137 @@
+"""
+Query Embedding Cache for RAG Retrieval
+
+Normalized query text -> embedding, in an in-memory LRU with an optional
+SQLite tier that survives restarts. Entries are keyed by embedding model
+name, so switching models never serves stale vectors. Searches pass the
+vectors to Chroma as query_embeddings, so repeat questions skip embedding
+inference entirely.
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Chroma's default embedding function, used by seed_rag_knowledge_base.py when adding documents
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+Embedder = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+def normalize_query(text: str) -> str:
+    """Case, whitespace and trailing punctuation do not change the question (the model is uncased)"""
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?!. ")
+
+
+def default_embedder() -> Embedder:
+    """Chroma's ONNX MiniLM embedder, created on first use (loads the model)"""
+    from chromadb.utils import embedding_functions
+
+    embedder = embedding_functions.DefaultEmbeddingFunction()
+    if embedder is None:
+        raise RuntimeError("Chroma default embedding function unavailable (thin client)")
+    return embedder
+
+
+class EmbeddingCache:
+    """
+    LRU (+ optional SQLite) cache in front of an embedding function
+
+    Thread-safe; misses in one call are embedded in a single batch.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        max_entries: int = 4096,
+        path: Optional[str] = None,
+    ):
+        self._embedder = embedder
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "embed_calls": 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, query))"
+            )
+            self._db.commit()
+
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = default_embedder()
+        return self._embedder
+
+    def _remember(self, key: str, vector: List[float]):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _from_disk(self, key: str) -> Optional[List[float]]:
+        row = self._db.execute(
+            "SELECT vector FROM embeddings WHERE model = ? AND query = ?", (self.model_name, key)
+        ).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32).tolist() if row else None
+
+    def embed(self, queries: List[str]) -> List[List[float]]:
+        """Embeddings for queries, in order; only unseen normalized queries reach the model"""
+        keys = [normalize_query(q) for q in queries]
+        found = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                elif self._db is not None and (vector := self._from_disk(key)) is not None:
+                    self._remember(key, vector)
+                    self.counters["disk_hits"] += 1
+                if vector is not None:
+                    found[key] = vector
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            vectors = [np.asarray(v, dtype=np.float32) for v in self.embedder(missing)]
+            with self._lock:
+                self.counters["misses"] += len(missing)
+                self.counters["embed_calls"] += 1
+                for key, vector in zip(missing, vectors):
+                    found[key] = vector.tolist()
+                    self._remember(key, found[key])
+                if self._db is not None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, query, vector) VALUES (?, ?, ?)",
+                        [(self.model_name, key, vector.tobytes()) for key, vector in zip(missing, vectors)],
+                    )
+                    self._db.commit()
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["disk_hits"] + c["misses"]
+        return dict(
+            c,
+            model=self.model_name,
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            persistent=self._db is not None,
+            hit_ratio=round((c["hits"] + c["disk_hits"]) / lookups, 4) if lookups else None,
+        )
@@ -0,0 +1,136 @@
+"""
+Metadata Filters for RAG Retrieval
+
+RetrievalFilter is the structured filter accepted by the query and chat
+APIs (source document, doc type, page range, year). to_where() turns it into
+a Chroma `where` clause; MetadataBitmaps evaluates the same clause against
+in-process chunk metadata (embedded vector index, BM25) using one
+precomputed boolean bitmap per (field, value) and a numeric column per
+field for range operators.
+"""
+
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from pydantic import BaseModel, Field, model_validator
+
+StrOrList = Optional[Union[str, List[str]]]
+
+
+class RetrievalFilter(BaseModel):
+    source: StrOrList = Field(None, description="Source document file name(s)")
+    doc_type: StrOrList = Field(None, description="e.g. nass_report, extension_guide, technical_guide")
+    page_min: Optional[int] = Field(None, ge=1)
+    page_max: Optional[int] = Field(None, ge=1)
+    year: Optional[int] = Field(None, description="Document year (from created_at)")
+
+    @model_validator(mode="after")
+    def check_page_range(self):
+        if self.page_min is not None and self.page_max is not None and self.page_min > self.page_max:
+            raise ValueError("page_min must not exceed page_max")
+        return self
+
+    def to_where(self) -> Optional[dict]:
+        """Chroma where clause, or None when no field is set"""
+        clauses = []
+        for field in ("source", "doc_type"):
+            value = getattr(self, field)
+            if isinstance(value, list):
+                clauses.append({field: {"$in": value}} if len(value) > 1 else {field: {"$eq": value[0]}})
+            elif value is not None:
+                clauses.append({field: {"$eq": value}})
+        if self.page_min is not None:
+            clauses.append({"page": {"$gte": self.page_min}})
+        if self.page_max is not None:
+            clauses.append({"page": {"$lte": self.page_max}})
+        if self.year is not None:
+            clauses.append({"year": {"$eq": self.year}})
+        if not clauses:
+            return None
+        # Chroma requires $and for more than one condition
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def where_of(filters: Optional[RetrievalFilter]) -> Optional[dict]:
+    return filters.to_where() if filters is not None else None
+
+
+_RANGE_OPS = {
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+class MetadataBitmaps:
+    """
+    Chroma where-clause evaluation over a fixed list of chunk metadata
+
+    Equality and $in are ORs of precomputed per-value bitmaps; range
+    operators compare a precomputed float column (NaN where missing).
+    """
+
+    def __init__(self, metadatas: Sequence[dict]):
+        self.size = len(metadatas)
+        self.bitmaps: Dict[str, Dict[object, np.ndarray]] = {}
+        self.columns: Dict[str, np.ndarray] = {}
+        for row, metadata in enumerate(metadatas):
+            for key, value in (metadata or {}).items():
+                values = self.bitmaps.setdefault(key, {})
+                if value not in values:
+                    values[value] = np.zeros(self.size, dtype=bool)
+                values[value][row] = True
+        for key, values in self.bitmaps.items():
+            numeric = {v: bits for v, bits in values.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+            if numeric:
+                column = np.full(self.size, np.nan)
+                for value, bits in numeric.items():
+                    column[bits] = value
+                self.columns[key] = column
+
+    def _none(self) -> np.ndarray:
+        return np.zeros(self.size, dtype=bool)
+
+    def _equals(self, key: str, value) -> np.ndarray:
+        return self.bitmaps.get(key, {}).get(value, self._none())
+
+    def _condition(self, key: str, condition) -> np.ndarray:
+        if not isinstance(condition, dict):
+            return self._equals(key, condition)
+        mask = np.ones(self.size, dtype=bool)
+        for op, operand in condition.items():
+            if op == "$eq":
+                mask &= self._equals(key, operand)
+            elif op == "$ne":
+                mask &= ~self._equals(key, operand)
+            elif op == "$in":
+                mask &= np.logical_or.reduce([self._equals(key, v) for v in operand] or [self._none()])
+            elif op == "$nin":
+                mask &= ~np.logical_or.reduce([self._equals(key, v) for v in operand] or [self._none()])
+            elif op in _RANGE_OPS:
+                column = self.columns.get(key)
+                if column is None:
+                    return self._none()
+                with np.errstate(invalid="ignore"):
+                    mask &= _RANGE_OPS[op](column, operand)
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+        return mask
+
+    def mask(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Boolean mask of matching chunks, or None for no filter"""
+        if not where:
+            return None
+        masks = []
+        for key, condition in where.items():
+            if key == "$and":
+                masks.append(np.logical_and.reduce([self.mask(c) for c in condition]))
+            elif key == "$or":
+                masks.append(np.logical_or.reduce([self.mask(c) for c in condition]))
+            else:
+                masks.append(self._condition(key, condition))
+        return np.logical_and.reduce(masks)
+
+    def stats(self) -> dict:
+        return {"fields": sorted(self.bitmaps), "bitmaps": sum(len(v) for v in self.bitmaps.values())}
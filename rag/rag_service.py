@@ -1,51 +1,297 @@
 from fastapi import FastAPI
 from fastapi import HTTPException
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager, nullcontext
 import chromadb
+import logging
 import os
+import threading
+import time
+from typing import List, Optional
 from dotenv import load_dotenv
 
+try:
+    from api.metrics import install_metrics
+except ImportError:  # uvicorn rag_service:app: the image copies api/metrics.py onto PYTHONPATH
+    try:
+        from metrics import install_metrics
+    except ImportError:
+        install_metrics = None
+
+try:
+    from rag.embedding_cache import DEFAULT_EMBEDDING_MODEL, EmbeddingCache
+except ImportError:  # run from inside rag/ (uvicorn rag_service:app)
+    from embedding_cache import DEFAULT_EMBEDDING_MODEL, EmbeddingCache
+
+try:
+    from rag.vector_index import VectorIndex
+except ImportError:
+    from vector_index import VectorIndex
+
+try:
+    from rag.bm25_index import BM25Index, hybrid_search_batch, split_results
+except ImportError:
+    from bm25_index import BM25Index, hybrid_search_batch, split_results
+
+try:
+    from rag.context_packer import candidates_from_results, pack_contexts
+except ImportError:
+    from context_packer import candidates_from_results, pack_contexts
+
+try:
+    from rag.metadata_filter import RetrievalFilter, where_of
+except ImportError:
+    from metadata_filter import RetrievalFilter, where_of
+
 load_dotenv()
 
-app = FastAPI()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 CHROMADB_HOST = os.getenv("CHROMADB_HOST", "chromadb")
 CHROMADB_PORT = int(os.getenv("CHROMADB_PORT", 8000))
+RAG_COLLECTION_NAME = os.getenv("RAG_COLLECTION_NAME", "corn-stress-knowledge")
+WARMUP_QUERY = "corn water stress during pollination"
+
+# Query embedding cache; the model name must match the embedder used when seeding
+RAG_EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # SQLite file; unset = memory only
+
+# "embedded": answer top-k from an in-process copy of the collection (synced from Chroma); "chroma": query Chroma
+RAG_RETRIEVAL_BACKEND = os.getenv("RAG_RETRIEVAL_BACKEND", "chroma")
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "./vector_index")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")  # float16 halves memory
+
+# Hybrid retrieval: BM25 (built by the seeder) fused with vector search by reciprocal rank fusion
+RAG_HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "true").lower() == "true"
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./bm25_index")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))  # per retriever, before fusion
+
+# Context assembly for /chat: merge overlapping neighbours, drop near-duplicates, MMR, pack into a token budget
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 15))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", 64))  # per /query/batch request
+
+
+class ChromaStore:
+    """
+    Chroma client and collection handle shared by all requests
+
+    Resolved once at startup instead of per request. If a query fails (Chroma
+    restarted, collection re-seeded), the handle is re-resolved and the query
+    retried once.
+    """
+
+    def __init__(self, host: str, port: int, collection_name: str, client_factory=chromadb.HttpClient):
+        self.host = host
+        self.port = port
+        self.collection_name = collection_name
+        self.client_factory = client_factory
+        self.client = None
+        self.collection = None
+        self.warmed_up = False
+        self.last_error = None
+        self.connects = 0
+        self.warmup_ms = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.collection is not None and self.warmed_up
+
+    def connect(self):
+        with self._lock:
+            try:
+                client = self.client_factory(host=self.host, port=self.port)
+                collection = client.get_collection(self.collection_name)
+            except Exception as e:
+                self.collection = None
+                self.last_error = str(e)
+                raise
+            self.client, self.collection = client, collection
+            self.connects += 1
+            self.last_error = None
+            logger.info(f"Connected to Chroma {self.host}:{self.port}/{self.collection_name}")
+            return collection
+
+    def warm_up(self):
+        """The first query loads the embedding model and the server-side index; pay for it before taking traffic"""
+        t0 = time.perf_counter()
+        self.query(query_embeddings=embedding_cache.embed([WARMUP_QUERY]), n_results=1)
+        self.warmup_ms = round((time.perf_counter() - t0) * 1000, 1)
+        logger.info(f"Chroma warm-up query took {self.warmup_ms} ms")
+
+    def query(self, **kwargs):
+        collection = self.collection or self.connect()
+        try:
+            results = collection.query(**kwargs)
+        except Exception as e:
+            logger.warning(f"Chroma query failed ({e}), reconnecting")
+            self.collection = None
+            results = self.connect().query(**kwargs)
+        self.warmed_up = True
+        return results
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "connected": self.collection is not None,
+            "collection": self.collection_name,
+            "connects": self.connects,
+            "warmup_ms": self.warmup_ms,
+            "last_error": self.last_error,
+        }
+
+
+store = ChromaStore(CHROMADB_HOST, CHROMADB_PORT, RAG_COLLECTION_NAME)
+embedding_cache = EmbeddingCache(
+    model_name=RAG_EMBEDDING_MODEL, max_entries=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH
+)
+vector_index = VectorIndex(VECTOR_INDEX_PATH, dtype=VECTOR_INDEX_DTYPE)
+bm25_index = None
+
+
+def use_embedded_index() -> bool:
+    return RAG_RETRIEVAL_BACKEND == "embedded" and vector_index.ready
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global bm25_index
+    if RAG_HYBRID_SEARCH:
+        try:
+            bm25_index = BM25Index.load(BM25_INDEX_PATH)
+        except Exception as e:
+            logger.warning(f"BM25 index unreadable, using vector search only: {e}")
+    if RAG_RETRIEVAL_BACKEND == "embedded" and vector_index.load():
+        embedding_cache.embed([WARMUP_QUERY])  # load the embedding model before taking traffic
+    try:
+        store.connect()
+        if RAG_RETRIEVAL_BACKEND == "embedded" and not vector_index.ready:
+            vector_index.sync_from(store.collection)
+        store.warm_up()
+    except Exception as e:
+        # Keep serving: /ready reports 503 (unless the embedded index is loaded) and the next query retries
+        logger.warning(f"Chroma not ready at startup: {e}")
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Request latency, Server-Timing and Prometheus /metrics
+if install_metrics is None:
+    logger.warning("metrics module not found: /metrics and Server-Timing are disabled")
+metrics = install_metrics(app, service="rag") if install_metrics else None
+
+
+def timed(name: str):
+    return metrics.timed(name) if metrics else nullcontext()
 
 
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 5
+    filters: Optional[RetrievalFilter] = None
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+    top_k: int = 5
+    filters: Optional[RetrievalFilter] = None  # applied to every query
+
+
+def search_batch(queries: List[str], top_k: int, where: Optional[dict] = None) -> List[dict]:
+    """One batched embedding call and one multi-query vector search for all queries; per-query results"""
+    with timed("embed"):
+        embeddings = embedding_cache.embed(queries)
+    filter_kwargs = {"where": where} if where else {}
+
+    def vector_search(n_results: int) -> dict:
+        if use_embedded_index():
+            with timed("vector_index"):
+                return vector_index.query(query_embeddings=embeddings, n_results=n_results, **filter_kwargs)
+        with timed("chroma"):
+            return store.query(query_embeddings=embeddings, n_results=n_results, **filter_kwargs)
+
+    if bm25_index is None:
+        return split_results(vector_search(top_k))
+    # Keyword search runs alongside; results are fused by reciprocal rank
+    return hybrid_search_batch(
+        vector_search, bm25_index, queries, top_k, max(HYBRID_CANDIDATES, top_k), where=where
+    )
+
+
+def search(query: str, top_k: int, where: Optional[dict] = None) -> dict:
+    return search_batch([query], top_k, where)[0]
 
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "chroma": store.status(),
+        "vector_index": vector_index.stats(),
+        "bm25_index": bm25_index.stats() if bm25_index is not None else None,
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return {"embedding_cache": embedding_cache.stats()}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: Chroma connected and warmed up, or the embedded index loaded"""
+    status = store.status()
+    ready = status["ready"] or use_embedded_index()
+    return JSONResponse(dict(status, ready=ready), status_code=200 if ready else 503)
+
+
+@app.post("/index/sync")
+def sync_index():
+    """Refresh the embedded vector index from Chroma (after re-seeding)"""
+    try:
+        vector_index.sync_from(store.collection or store.connect())
+    except Exception as e:
+        logger.error(f"Vector index sync failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return vector_index.stats()
 
 
 @app.post("/query")
-async def query_documents(request: QueryRequest):
+def query_documents(request: QueryRequest):
     try:
-        client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
-        collection = client.get_collection("corn-stress-knowledge")
-        results = collection.query(query_texts=[request.query], n_results=request.top_k)
+        results = search(request.query, request.top_k, where_of(request.filters))
         return {"results": results}
     except Exception:
         raise HTTPException(status_code=500, detail="Query failed")
 
 
+@app.post("/query/batch")
+def query_documents_batch(request: BatchQueryRequest):
+    """Results for each query, in order, from one embedding call and one collection.query"""
+    try:
+        results = search_batch(request.queries, request.top_k, where_of(request.filters))
+        return {"results": results}
+    except Exception:
+        raise HTTPException(status_code=500, detail="Batch query failed")
+
+
 @app.post("/chat")
-async def chat(request: QueryRequest):
+def chat(request: QueryRequest):
     try:
-        client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
-        collection = client.get_collection("corn-stress-knowledge")
-        results = collection.query(query_texts=[request.query], n_results=request.top_k)
+        results = search(request.query, max(request.top_k, CONTEXT_CANDIDATES), where_of(request.filters))
+        contexts = pack_contexts(candidates_from_results(results), CONTEXT_TOKEN_BUDGET, max_contexts=request.top_k)
 
-        context = "\n".join(results["documents"][0] if results["documents"] else [])
+        context = "\n".join(c["text"] for c in contexts)
 
         response = {
             "answer": f"Based on the context: {context[:500]}...",
-            "sources": results.get("metadatas", [[]])[0] if results.get("metadatas") else [],
+            "sources": [{"source": c["source"], "page": c["page"]} for c in contexts],
         }
         return response
     except Exception:
@@ -1,13 +1,60 @@
 import os
+import json
+import asyncio
 import logging
-from typing import Optional, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Iterator, Optional, List
 from datetime import datetime
 import chromadb
 import google.generativeai as genai
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
+try:
+    from api.metrics import install_metrics
+except ImportError:  # uvicorn rag_service_simple:app: the image copies api/metrics.py onto PYTHONPATH
+    try:
+        from metrics import install_metrics
+    except ImportError:
+        install_metrics = None
+
+try:
+    from rag.embedding_cache import DEFAULT_EMBEDDING_MODEL, EmbeddingCache
+except ImportError:  # run from inside rag/ (uvicorn rag_service_simple:app)
+    from embedding_cache import DEFAULT_EMBEDDING_MODEL, EmbeddingCache
+
+try:
+    from rag.answer_cache import SemanticAnswerCache, stress_bucket
+except ImportError:
+    from answer_cache import SemanticAnswerCache, stress_bucket
+
+try:
+    from rag.vector_index import VectorIndex
+except ImportError:
+    from vector_index import VectorIndex
+
+try:
+    from rag.bm25_index import BM25Index, hybrid_search
+except ImportError:
+    from bm25_index import BM25Index, hybrid_search
+
+try:
+    from rag.context_packer import candidates_from_results, pack_contexts
+except ImportError:
+    from context_packer import candidates_from_results, pack_contexts
+
+try:
+    from rag.metadata_filter import RetrievalFilter, where_of
+except ImportError:
+    from metadata_filter import RetrievalFilter, where_of
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -16,6 +63,31 @@ GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-1.5-pro")
 CHROMADB_HOST = os.environ.get("CHROMADB_HOST", "localhost")
 CHROMADB_PORT = int(os.environ.get("CHROMADB_PORT", "8000"))
 RAG_COLLECTION_NAME = os.environ.get("RAG_COLLECTION_NAME", "corn-stress-knowledge")
+# Query embedding cache; the model name must match the embedder used when seeding
+RAG_EMBEDDING_MODEL = os.environ.get("RAG_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")  # SQLite file; unset = memory only
+# Semantic answer cache: reuse an answer for a near-duplicate question in the same county/week/stress band
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_STRESS_BUCKET = float(os.environ.get("ANSWER_CACHE_STRESS_BUCKET", "10"))
+# "embedded": answer top-k from an in-process copy of the collection (synced from Chroma); "chroma": query Chroma
+RAG_RETRIEVAL_BACKEND = os.environ.get("RAG_RETRIEVAL_BACKEND", "chroma")
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH", "./vector_index")
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")  # float16 halves memory
+# Hybrid retrieval: BM25 (built by the seeder) fused with vector search by reciprocal rank fusion
+RAG_HYBRID_SEARCH = os.environ.get("RAG_HYBRID_SEARCH", "true").lower() == "true"
+BM25_INDEX_PATH = os.environ.get("BM25_INDEX_PATH", "./bm25_index")
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))  # per retriever, before fusion
+RAG_TOP_K = 5  # contexts in the prompt, at most
+# Context assembly: merge overlapping neighbours, drop near-duplicates, MMR, then pack into a token budget
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", "15"))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+# Blocking Chroma / embedding / Gemini calls run on this pool, never on the event loop
+RAG_EXECUTOR_WORKERS = int(os.environ.get("RAG_EXECUTOR_WORKERS", "32"))
+CHAT_CONCURRENCY = int(os.environ.get("CHAT_CONCURRENCY", "32"))  # chats in flight per worker
+CHAT_QUEUE_TIMEOUT = float(os.environ.get("CHAT_QUEUE_TIMEOUT", "10"))  # seconds to wait for a slot, then 503
 
 
 class ChatMessage(BaseModel):
@@ -23,6 +95,7 @@ class ChatMessage(BaseModel):
     county: Optional[str] = None
     week: Optional[int] = None
     agri_context: Optional[dict] = None
+    filters: Optional[RetrievalFilter] = None  # restrict retrieval by source, doc_type, page range, year
 
 
 class ChatResponse(BaseModel):
@@ -30,6 +103,7 @@ class ChatResponse(BaseModel):
     retrieved_contexts: List[dict] = []
     model: str
     timestamp: str
+    cached: bool = False
 
 
 app = FastAPI(title="AgriGuard RAG Service", version="1.0.0")
@@ -42,6 +116,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, Server-Timing and Prometheus /metrics
+if install_metrics is None:
+    logger.warning("metrics module not found: /metrics and Server-Timing are disabled")
+metrics = install_metrics(app, service="rag") if install_metrics else None
+
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
     logger.info("Gemini API configured")
@@ -54,64 +133,263 @@ except Exception as e:
     logger.error(f"ChromaDB error: {e}")
     collection = None
 
+embedding_cache = EmbeddingCache(
+    model_name=RAG_EMBEDDING_MODEL, max_entries=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH
+)
+vector_index = VectorIndex(VECTOR_INDEX_PATH, dtype=VECTOR_INDEX_DTYPE)
+if RAG_RETRIEVAL_BACKEND == "embedded":
+    try:
+        if not vector_index.load() and collection is not None:
+            vector_index.sync_from(collection)
+    except Exception as e:
+        logger.error(f"Vector index unavailable, falling back to ChromaDB: {e}")
+
+bm25_index = None
+if RAG_HYBRID_SEARCH:
+    try:
+        bm25_index = BM25Index.load(BM25_INDEX_PATH)
+    except Exception as e:
+        logger.error(f"BM25 index unreadable, using vector search only: {e}")
+    if bm25_index is None:
+        logger.info(f"No BM25 index at {BM25_INDEX_PATH}; using vector search only")
+
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE
+)
+
+
+# ==================== Concurrency ====================
+
+
+class ConcurrencyLimit:
+    """
+    Caps chats in flight per worker
+
+    Excess requests wait up to `timeout` seconds for a slot, then get a 503
+    with Retry-After instead of piling onto the executor.
+    """
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.peak = 0
+        self.rejected = 0
+        self._loop = None
+        self._semaphore = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Bound to the running loop on first use
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def acquire(self):
+        semaphore = self._get_semaphore()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many concurrent chats", headers={"Retry-After": "1"})
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "peak": self.peak,
+            "rejected": self.rejected,
+            "executor_workers": RAG_EXECUTOR_WORKERS,
+        }
+
+
+executor = ThreadPoolExecutor(max_workers=RAG_EXECUTOR_WORKERS, thread_name_prefix="rag")
+chat_limit = ConcurrencyLimit(CHAT_CONCURRENCY, CHAT_QUEUE_TIMEOUT)
+
+
+async def offload(fn, *args):
+    """Run a blocking call on the RAG executor"""
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args))
+
 SYSTEM_PROMPT = """You are AgriBot, an expert in Iowa corn farming and stress analysis.
 Answer questions about corn stress, yields, and farming practices based on retrieved knowledge.
 Keep responses concise and actionable."""
 
 
+GENERATION_CONFIG = dict(max_output_tokens=1024, temperature=0.3)
+
+
+def generate_answer(prompt: str) -> str:
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    response = model.generate_content(
+        prompt,
+        generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG),
+    )
+    return response.text
+
+
+def generate_answer_stream(prompt: str) -> Iterator[str]:
+    """Answer text chunks as Gemini produces them"""
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    response = model.generate_content(
+        prompt,
+        generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG),
+        stream=True,
+    )
+    for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+
+def answer_partition(message: ChatMessage) -> tuple:
+    """Answer cache partition: county, week, stress band and retrieval filters"""
+    where = where_of(message.filters)
+    return (
+        message.county,
+        message.week,
+        stress_bucket(message.agri_context, ANSWER_CACHE_STRESS_BUCKET),
+        json.dumps(where, sort_keys=True) if where else None,
+    )
+
+
+def retriever():
+    """Embedded index when enabled and loaded, else the Chroma collection"""
+    if RAG_RETRIEVAL_BACKEND == "embedded" and vector_index.ready:
+        return vector_index
+    return collection
+
+
+def retrieve_contexts(query: str, query_embedding: List[float], where: Optional[dict] = None) -> List[dict]:
+    """
+    Candidate chunks by vector similarity (fused with BM25 when the keyword
+    index is loaded), optionally pre-filtered by metadata, assembled into at
+    most RAG_TOP_K contexts within CONTEXT_TOKEN_BUDGET
+    """
+    backend = retriever()
+    filter_kwargs = {"where": where} if where else {}
+
+    def vector_search(n_results: int) -> dict:
+        return backend.query(query_embeddings=[query_embedding], n_results=n_results, **filter_kwargs)
+
+    if bm25_index is not None:
+        results = hybrid_search(
+            vector_search, bm25_index, query, CONTEXT_CANDIDATES, max(HYBRID_CANDIDATES, CONTEXT_CANDIDATES),
+            where=where,
+        )
+    else:
+        results = vector_search(CONTEXT_CANDIDATES)
+    return pack_contexts(candidates_from_results(results), CONTEXT_TOKEN_BUDGET, max_contexts=RAG_TOP_K)
+
+
+def build_prompt(message: ChatMessage, contexts: List[dict]) -> str:
+    context_str = "\n".join([f"- {c['text']}" for c in contexts]) if contexts else "No context found"
+
+    agri_data = message.agri_context or {}
+    county_info = f"\nCounty: {message.county}, Week: {message.week}" if message.county else ""
+    stress_info = ""
+    if agri_data:
+        stress_info = f"\nCurrent stress data: CSI={agri_data.get('csi_overall')}, Water={agri_data.get('water_stress')}, Heat={agri_data.get('heat_stress')}"
+
+    return f"""{SYSTEM_PROMPT}
+
+Question: {message.query}{county_info}{stress_info}
+
+Knowledge base context:
+{context_str}
+
+Answer:"""
+
+
 @app.get("/health")
 async def health():
     return {
-        "status": "healthy" if (collection and GEMINI_API_KEY) else "degraded",
+        "status": "healthy" if (retriever() is not None and GEMINI_API_KEY) else "degraded",
         "chroma_connected": collection is not None,
+        "retrieval_backend": "embedded" if retriever() is vector_index else "chroma",
         "gemini_configured": GEMINI_API_KEY is not None,
         "timestamp": datetime.now().isoformat(),
     }
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(message: ChatMessage):
-    if not collection or not GEMINI_API_KEY:
-        raise HTTPException(status_code=503, detail="Service not ready")
+@app.get("/stats")
+async def stats():
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "concurrency": chat_limit.stats(),
+        "vector_index": vector_index.stats(),
+        "bm25_index": bm25_index.stats() if bm25_index is not None else None,
+    }
 
-    try:
-        # Query ChromaDB for relevant documents
-        results = collection.query(query_texts=[message.query], n_results=5)
 
-        contexts = []
-        if results["documents"] and results["documents"][0]:
-            for doc, dist in zip(results["documents"][0], results["distances"][0]):
-                contexts.append({"text": doc[:500], "score": float(1 - dist)})
+@app.post("/index/sync")
+async def sync_index():
+    """Refresh the embedded vector index from ChromaDB (after re-seeding)"""
+    if collection is None:
+        raise HTTPException(status_code=503, detail="ChromaDB not connected")
+    try:
+        await offload(vector_index.sync_from, collection)
+    except Exception as e:
+        logger.error(f"Vector index sync failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return vector_index.stats()
 
-        # Build prompt with context
-        context_str = "\n".join([f"- {c['text']}" for c in contexts]) if contexts else "No context found"
 
-        agri_data = message.agri_context or {}
-        county_info = f"\nCounty: {message.county}, Week: {message.week}" if message.county else ""
-        stress_info = ""
-        if agri_data:
-            stress_info = f"\nCurrent stress data: CSI={agri_data.get('csi_overall')}, Water={agri_data.get('water_stress')}, Heat={agri_data.get('heat_stress')}"
+@app.post("/chat", response_model=ChatResponse)
+async def chat(message: ChatMessage):
+    if retriever() is None or not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Service not ready")
 
-        prompt = f"""{SYSTEM_PROMPT}
+    async with chat_limit.slot():
+        return await answer_chat(message)
 
-Question: {message.query}{county_info}{stress_info}
 
-Knowledge base context:
-{context_str}
+async def answer_chat(message: ChatMessage) -> ChatResponse:
+    try:
+        # Embedding cached per normalized query
+        query_embedding = (await offload(embedding_cache.embed, [message.query]))[0]
+
+        # Near-duplicate question for the same county, week and stress band: skip retrieval and the LLM
+        partition = answer_partition(message)
+        hit = answer_cache.lookup(partition, query_embedding)
+        if hit:
+            entry, similarity = hit
+            logger.info(f"Answer cache hit (similarity {similarity:.3f})")
+            return ChatResponse(
+                response=entry.answer,
+                retrieved_contexts=entry.contexts,
+                model=GEMINI_MODEL,
+                timestamp=datetime.now().isoformat(),
+                cached=True,
+            )
 
-Answer:"""
+        # Query ChromaDB for relevant documents
+        contexts = await offload(retrieve_contexts, message.query, query_embedding, where_of(message.filters))
 
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=1024,
-                temperature=0.3,
-            ),
-        )
+        answer = await offload(generate_answer, build_prompt(message, contexts))
+        answer_cache.store(partition, query_embedding, answer, contexts)
 
         return ChatResponse(
-            response=response.text,
+            response=answer,
             retrieved_contexts=contexts,
             model=GEMINI_MODEL,
             timestamp=datetime.now().isoformat(),
@@ -122,6 +400,108 @@ Answer:"""
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ==================== Streaming Chat ====================
+
+
+def format_stream_event(event: str, data: dict, stream_format: str) -> str:
+    if stream_format == "ndjson":
+        return json.dumps({"event": event, **data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def chat_events(message: ChatMessage, stream_format: str) -> Iterator[str]:
+    """
+    contexts -> token* -> done
+
+    Contexts go out as soon as retrieval finishes; tokens follow as the model
+    produces them. Runs in Starlette's threadpool (sync iterator), so the
+    blocking Chroma and Gemini calls never sit on the event loop.
+    """
+    started = time.perf_counter()
+
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    try:
+        query_embedding = embedding_cache.embed([message.query])[0]
+        partition = answer_partition(message)
+        hit = answer_cache.lookup(partition, query_embedding)
+        contexts = hit[0].contexts if hit else retrieve_contexts(message.query, query_embedding, where_of(message.filters))
+        retrieval_ms = elapsed_ms()
+        yield format_stream_event("contexts", {"retrieved_contexts": contexts}, stream_format)
+
+        first_token_ms = None
+        if hit:
+            chunks = [hit[0].answer]
+        else:
+            chunks = generate_answer_stream(build_prompt(message, contexts))
+        answer = []
+        for chunk in chunks:
+            if first_token_ms is None:
+                first_token_ms = elapsed_ms()
+            answer.append(chunk)
+            yield format_stream_event("token", {"text": chunk}, stream_format)
+
+        if not hit:
+            answer_cache.store(partition, query_embedding, "".join(answer), contexts)
+        yield format_stream_event(
+            "done",
+            {
+                "model": GEMINI_MODEL,
+                "cached": bool(hit),
+                "timestamp": datetime.now().isoformat(),
+                "timing": {
+                    "retrieval_ms": retrieval_ms,
+                    "first_token_ms": first_token_ms,
+                    "total_ms": elapsed_ms(),
+                },
+            },
+            stream_format,
+        )
+    except Exception as e:
+        # Headers are already sent; report the failure in-band
+        logger.error(f"Streaming chat error: {e}")
+        yield format_stream_event("error", {"detail": str(e)}, stream_format)
+
+
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """Streaming /chat: Server-Sent Events (default) or chunked NDJSON (?format=ndjson)"""
+    if retriever() is None or not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Service not ready")
+
+    # The slot is held until the stream finishes (or the client disconnects)
+    await chat_limit.acquire()
+    held = True
+
+    async def release():
+        # Runs on the event loop (asyncio.Semaphore is not thread-safe), at most once
+        nonlocal held
+        if held:
+            held = False
+            chat_limit.release()
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event in iterate_in_threadpool(chat_events(message, format)):
+                yield event
+        finally:
+            await release()
+
+    try:
+        media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+        # The background release covers a stream that is never started (client gone before the first event)
+        return StreamingResponse(
+            events(),
+            media_type=media_type,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(release),
+        )
+    except BaseException:
+        await release()
+        raise
+
+
 @app.get("/")
 async def root():
     return {"service": "AgriGuard RAG", "version": "1.0.0", "docs": "/docs"}
@@ -8,8 +8,9 @@ import os
 import sys
 import logging
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 import uuid
+from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -23,6 +24,7 @@ CHROMADB_HOST = os.environ.get("CHROMADB_HOST", "localhost")
 CHROMADB_PORT = int(os.environ.get("CHROMADB_PORT", "8000"))
 RAG_COLLECTION_NAME = os.environ.get("RAG_COLLECTION_NAME", "corn-stress-knowledge")
 KNOWLEDGE_BASE_DIR = os.environ.get("KNOWLEDGE_BASE_DIR", "./knowledge_base/pdfs")
+BM25_INDEX_PATH = os.environ.get("BM25_INDEX_PATH", "./bm25_index")  # keyword index for hybrid retrieval
 
 # ============================================================================
 # FUNCTIONS
@@ -59,8 +61,8 @@ def connect_chromadb(host: str = CHROMADB_HOST, port: int = CHROMADB_PORT):
                 sys.exit(1)
 
 
-def extract_text_from_pdf(pdf_path: Path) -> List[str]:
-    """Extract text from PDF file"""
+def extract_text_from_pdf(pdf_path: Path) -> List[Tuple[int, str]]:
+    """Extract (page number, text) pairs from PDF file"""
     try:
         from PyPDF2 import PdfReader
 
@@ -71,7 +73,7 @@ def extract_text_from_pdf(pdf_path: Path) -> List[str]:
             text = page.extract_text()
             if text.strip():
                 # Include source info in each chunk
-                texts.append(f"[Source: {pdf_path.name}, Page {page_num + 1}]\n{text}")
+                texts.append((page_num + 1, f"[Source: {pdf_path.name}, Page {page_num + 1}]\n{text}"))
 
         logger.info(f"  ✓ Extracted {len(texts)} pages from {pdf_path.name}")
         return texts
@@ -80,6 +82,35 @@ def extract_text_from_pdf(pdf_path: Path) -> List[str]:
         return []
 
 
+# File-name keywords -> doc_type, first match wins (filterable via the RAG APIs)
+DOC_TYPE_RULES = [
+    ("crop-progress", "nass_report"),
+    ("crop-production", "nass_report"),
+    ("nass", "nass_report"),
+    ("journal", "research_article"),
+    ("extension", "extension_guide"),
+    ("integrated crop management", "extension_guide"),
+]
+
+
+def infer_doc_type(filename: str) -> str:
+    name = filename.lower()
+    return next((doc_type for keyword, doc_type in DOC_TYPE_RULES if keyword in name), "technical_guide")
+
+
+def pdf_created_at(pdf_path: Path) -> str:
+    """PDF creation date (YYYY-MM-DD), falling back to the file's modification time"""
+    try:
+        from PyPDF2 import PdfReader
+
+        created = PdfReader(pdf_path).metadata.creation_date
+        if created:
+            return created.date().isoformat()
+    except Exception:
+        pass
+    return datetime.fromtimestamp(pdf_path.stat().st_mtime).date().isoformat()
+
+
 def split_text_into_chunks(text: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> List[str]:
     """Split text into overlapping chunks"""
     chunks = []
@@ -135,14 +166,24 @@ def seed_knowledge_base(pdf_dir: str = KNOWLEDGE_BASE_DIR, chunk_size: int = 100
         # Extract text from PDF
         texts = extract_text_from_pdf(pdf)
 
-        # Split into chunks
-        for text in texts:
+        # Document-level metadata (schema in docs/APPLICATION_DESIGN.md); year is numeric for range filters
+        created_at = pdf_created_at(pdf)
+        document_metadata = {
+            "source": pdf.name,
+            "type": "agricultural_knowledge",
+            "doc_type": infer_doc_type(pdf.name),
+            "created_at": created_at,
+            "year": int(created_at[:4]),
+        }
+
+        # Split into chunks; page and chunk position let the RAG service merge overlapping neighbours
+        for page, text in texts:
             chunks = split_text_into_chunks(text, chunk_size=chunk_size)
-            for chunk in chunks:
+            for chunk_index, chunk in enumerate(chunks):
                 chunk_id = str(uuid.uuid4())
                 all_chunks.append(chunk)
                 ids.append(chunk_id)
-                metadatas.append({"source": pdf.name, "type": "agricultural_knowledge"})
+                metadatas.append(dict(document_metadata, page=page, chunk_index=chunk_index))
 
     if not all_chunks:
         logger.warning("⚠  No text chunks extracted from PDFs")
@@ -169,6 +210,19 @@ def seed_knowledge_base(pdf_dir: str = KNOWLEDGE_BASE_DIR, chunk_size: int = 100
         logger.error(f"✗ Failed to add chunks to collection: {e}")
         sys.exit(1)
 
+    # Keyword index over the same chunk ids, for BM25 + vector fusion in the RAG service
+    logger.info(f"\n🔎 Building BM25 index at {BM25_INDEX_PATH}...")
+    try:
+        try:
+            from rag.bm25_index import BM25Index
+        except ImportError:
+            from bm25_index import BM25Index
+
+        BM25Index.build(ids, all_chunks, metadatas).save(BM25_INDEX_PATH)
+        logger.info("✓ BM25 index saved")
+    except Exception as e:
+        logger.warning(f"⚠  BM25 index not built, hybrid retrieval disabled: {e}")
+
     logger.info("\n✓ Knowledge base seeding complete!")
     return len(all_chunks)
 
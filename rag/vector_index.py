@@ -0,0 +1,203 @@
+"""
+Embedded Vector Index for the RAG Knowledge Base
+
+The knowledge base is small (~1k chunks), so exact search over one matrix
+beats a network round trip to ChromaDB. sync_from() copies a collection's
+embeddings (unit-normalized, float32 or float16), documents and metadata
+into a directory; load() memory-maps the matrix. query() takes the same
+arguments as Collection.query and returns the same shape, with cosine
+distances (the collection is seeded with hnsw:space=cosine). A `where`
+clause is evaluated against per-value metadata bitmaps built at load time.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from rag.metadata_filter import MetadataBitmaps
+except ImportError:
+    from metadata_filter import MetadataBitmaps
+
+logger = logging.getLogger(__name__)
+
+MATRIX_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+SYNC_PAGE_SIZE = 500
+
+
+@dataclass
+class IndexSnapshot:
+    matrix: np.ndarray  # (n_chunks, dim), rows unit-normalized
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[dict]
+    synced_at: float
+    bitmaps: MetadataBitmaps
+
+
+class VectorIndex:
+    """
+    Exact top-k cosine search over a memory-mapped embedding matrix
+
+    Readers use an immutable snapshot; sync_from() builds the next one in a
+    temporary directory and swaps it in, so queries never see a partial index.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32"):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._sync_lock = threading.Lock()
+        self.last_sync_ms = None
+        self.queries = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def __len__(self) -> int:
+        return len(self._snapshot.ids) if self._snapshot else 0
+
+    def load(self) -> bool:
+        """Memory-map a previously synced index; False when there is none on disk"""
+        matrix_path = os.path.join(self.path, MATRIX_FILE)
+        chunks_path = os.path.join(self.path, CHUNKS_FILE)
+        if not (os.path.exists(matrix_path) and os.path.exists(chunks_path)):
+            return False
+        with open(chunks_path) as f:
+            chunks = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode="r")
+        self._snapshot = IndexSnapshot(
+            matrix, chunks["ids"], chunks["documents"], chunks["metadatas"], chunks["synced_at"],
+            MetadataBitmaps(chunks["metadatas"]),
+        )
+        logger.info(f"Loaded vector index: {len(self)} chunks x {matrix.shape[1]} ({matrix.dtype}) from {self.path}")
+        return True
+
+    def sync_from(self, collection, page_size: int = SYNC_PAGE_SIZE) -> int:
+        """Copy every chunk of a Chroma collection to disk and swap it in; returns the chunk count"""
+        with self._sync_lock:
+            t0 = time.perf_counter()
+            ids, documents, metadatas, embeddings = [], [], [], []
+            offset = 0
+            while True:
+                page = collection.get(
+                    include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset
+                )
+                if not page["ids"]:
+                    break
+                ids += page["ids"]
+                documents += page["documents"]
+                metadatas += [m or {} for m in page["metadatas"]]
+                embeddings += page["embeddings"]
+                offset += len(page["ids"])
+                if len(page["ids"]) < page_size:
+                    break
+            if not ids:
+                raise RuntimeError("Collection is empty; keeping the current index")
+
+            vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            staging = tempfile.mkdtemp(prefix=".vector-index-", dir=os.path.dirname(os.path.abspath(self.path)))
+            matrix = np.lib.format.open_memmap(
+                os.path.join(staging, MATRIX_FILE), mode="w+", dtype=self.dtype, shape=vectors.shape
+            )
+            matrix[:] = vectors
+            matrix.flush()
+            del matrix
+            synced_at = time.time()
+            with open(os.path.join(staging, CHUNKS_FILE), "w") as f:
+                json.dump({"ids": ids, "documents": documents, "metadatas": metadatas, "synced_at": synced_at}, f)
+
+            self._swap_in(staging)
+            self.last_sync_ms = round((time.perf_counter() - t0) * 1000, 1)
+            logger.info(f"Synced vector index from Chroma: {len(ids)} chunks in {self.last_sync_ms} ms")
+            return len(ids)
+
+    def _swap_in(self, staging: str):
+        """
+        Rename the current directory aside, rename staging into place, then delete the old one
+
+        The path is only missing between two renames (never while a tree is
+        being deleted or written), and a failed swap puts the old index back.
+        """
+        retired = None
+        if os.path.exists(self.path):
+            retired = f"{staging}.old"  # staging is a unique mkdtemp name in the same directory
+            os.replace(self.path, retired)
+        try:
+            os.replace(staging, self.path)
+        except OSError:
+            if retired is not None:
+                os.replace(retired, self.path)
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.load()
+        if retired is not None:
+            # Old snapshot matrices stay readable: their mappings outlive the unlink
+            shutil.rmtree(retired, ignore_errors=True)
+
+    def query(self, query_embeddings: Sequence[Sequence[float]], n_results: int = 5,
+              where: Optional[dict] = None, **kwargs) -> dict:
+        """Collection.query-compatible exact search: one mat-vec product plus argpartition per query"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("Vector index not loaded")
+        self.queries += 1
+
+        # Copy: the caller's float32 array must not come back normalized
+        queries = np.array(query_embeddings, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        allowed = snapshot.bitmaps.mask(where)
+        if allowed is None:
+            matrix, rows = snapshot.matrix, None
+        else:
+            rows = np.flatnonzero(allowed)
+            matrix = snapshot.matrix[rows]  # only the filtered chunks are scored
+        scores = matrix @ queries.T  # (n_candidates, n_queries)
+        k = min(n_results, len(scores))
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for column in scores.T:
+            if k == 0:
+                top = np.empty(0, dtype=int)
+            elif k < len(column):
+                top = np.argpartition(-column, k - 1)[:k]
+            else:
+                top = np.arange(len(column))
+            top = top[np.argsort(-column[top], kind="stable")][:k]
+            similarities = column[top]
+            if rows is not None:
+                top = rows[top]
+            result["ids"].append([snapshot.ids[i] for i in top])
+            result["documents"].append([snapshot.documents[i] for i in top])
+            result["metadatas"].append([snapshot.metadatas[i] for i in top])
+            result["distances"].append([float(1 - similarity) for similarity in similarities])
+        return result
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "ready": snapshot is not None,
+            "chunks": len(self),
+            "dim": int(snapshot.matrix.shape[1]) if snapshot else None,
+            "dtype": str(self.dtype),
+            "path": self.path,
+            "synced_at": snapshot.synced_at if snapshot else None,
+            "last_sync_ms": self.last_sync_ms,
+            "queries": self.queries,
+        }
@@ -2,19 +2,68 @@
 Integration tests for API Orchestrator
 Tests actual FastAPI endpoints using TestClient
 """
+import asyncio
+import json
 import pytest
 import sys
+import time
 import os
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import httpx
 from fastapi.testclient import TestClient
+import api.api_orchestrator as orchestrator
+import api.http_helpers as http_helpers
 from api.api_orchestrator import main_app as app
 
 client = TestClient(app)
 
 
+def mcsi_week(fips, week, heat_days=True):
+    # Typical mid-season Iowa week: LST in °C, water deficit and precipitation in mm/day
+    indicators = {"ndvi_mean": 0.7, "lst_mean": 28.0, "water_deficit_mean": 1.5, "precipitation_mean": 3.0}
+    if heat_days:
+        indicators["lst_days_above_32C"] = 1
+    return {"fips": fips, "week_of_season": week, "overall_stress_index": 30.0, "indicators": indicators}
+
+
+@pytest.fixture
+def upstream_calls(monkeypatch):
+    """Route all upstream traffic to an in-process mock and record each request"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        path = request.url.path
+        if path.endswith("/timeseries"):
+            fips = path.split("/")[3]
+            return httpx.Response(200, json=[mcsi_week(fips, w) for w in range(18, 21)])
+        if path.startswith("/mcsi/county/"):
+            return httpx.Response(200, json=mcsi_week(path.split("/")[3], 20))
+        if path == "/forecast":
+            return httpx.Response(200, json={"yield_forecast_bu_acre": 190.0, "model_r2": 0.8})
+        if path == "/health":
+            return httpx.Response(200, json={"status": "healthy"})
+        return httpx.Response(404)
+
+    for upstream in orchestrator.UPSTREAMS.values():
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        monkeypatch.setattr(upstream, "_client", None)
+        monkeypatch.setattr(upstream, "requests", 0)
+        monkeypatch.setattr(upstream, "errors", 0)
+        monkeypatch.setattr(upstream, "breaker", orchestrator.CircuitBreaker())
+        monkeypatch.setattr(upstream, "healthy", {url: None for url in upstream.base_urls})
+        monkeypatch.setattr(upstream, "active_url", upstream.base_urls[0])
+        monkeypatch.setattr(upstream, "flights", orchestrator.SingleFlight())
+        monkeypatch.setattr(upstream, "etag", None)
+        monkeypatch.setattr(upstream, "last_modified", None)
+    monkeypatch.setattr(orchestrator, "response_cache", orchestrator.ResponseCache())
+    monkeypatch.setattr(orchestrator, "yield_batch_unavailable_until", 0.0)
+    return calls
+
+
 class TestAPIHealth:
     """Test health check endpoint"""
 
@@ -71,3 +120,769 @@ class TestAPIOrchestration:
         """Test CORS middleware is configured"""
         middlewares = [m for m in app.user_middleware]
         assert len(middlewares) > 0
+
+
+class TestUpstreamPooling:
+    """Test shared, lifespan-managed upstream clients"""
+
+    def test_client_reused_across_requests(self, upstream_calls):
+        """Test one pooled client serves every request and closes on shutdown"""
+        with TestClient(app) as c:
+            pooled = orchestrator.UPSTREAMS["mcsi"].client
+            assert c.get("/api/mcsi/19001").status_code == 200
+            assert c.get("/api/mcsi/19003").status_code == 200
+            assert orchestrator.UPSTREAMS["mcsi"].client is pooled
+
+            stats = c.get("/api/upstreams").json()
+            assert stats["mcsi"]["requests"] == 2
+            assert stats["mcsi"]["in_flight"] == 0
+            assert stats["mcsi"]["pool"]["max_connections"] == orchestrator.UPSTREAM_MAX_CONNECTIONS
+
+        assert pooled.is_closed
+
+    def test_yield_uses_both_upstreams(self, upstream_calls):
+        """Test yield route goes through the MCSI and yield pools"""
+        with TestClient(app) as c:
+            response = c.get("/api/yield/19001")
+
+        assert response.status_code == 200
+        assert response.json()["predicted_yield"] == 190.0
+        paths = [r.url.path for r in upstream_calls if r.url.path != "/health"]
+        assert paths == ["/mcsi/county/19001/timeseries", "/forecast"]
+
+
+class TestUpstreamRouting:
+    """Test health-aware routing and circuit breaking"""
+
+    def test_breaker_state_transitions(self):
+        """Test closed -> open -> half-open -> closed"""
+        now = [0.0]
+        breaker = orchestrator.CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=lambda: now[0])
+
+        for _ in range(3):
+            assert breaker.allow()
+            breaker.record_failure()
+        assert breaker.state == "open" and not breaker.allow()
+
+        now[0] = 10.0
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+        assert not breaker.allow()  # only one trial at a time
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        now[0] = 20.0
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == "closed" and breaker.allow()
+
+    def test_routes_to_healthy_candidate(self, upstream_calls, monkeypatch):
+        """Test an unresolvable primary URL is skipped after the startup probe"""
+        upstream = orchestrator.UPSTREAMS["mcsi"]
+        primary_host = httpx.URL(upstream.base_urls[0]).host
+        inner = upstream.transport.handler
+
+        def handler(request):
+            if request.url.host == primary_host:
+                raise httpx.ConnectError("name does not resolve", request=request)
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            for fips in ("19001", "19003", "19005"):
+                assert c.get(f"/api/mcsi/{fips}").status_code == 200
+            stats = c.get("/api/upstreams").json()["mcsi"]
+
+        assert stats["active_url"] == upstream.base_urls[1]
+        data_calls = [r for r in upstream_calls if r.url.path != "/health"]
+        assert len(data_calls) == 3
+        assert all(r.url.host != primary_host for r in data_calls)
+
+    def test_open_circuit_fails_fast(self, upstream_calls, monkeypatch):
+        """Test requests stop reaching a dead upstream once the circuit opens"""
+        upstream = orchestrator.UPSTREAMS["mcsi"]
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            raise httpx.ConnectError("connection refused", request=request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        monkeypatch.setattr(upstream, "breaker", orchestrator.CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        with TestClient(app) as c:
+            probes = len(attempts)
+            codes = [c.get("/api/mcsi/19001").status_code for _ in range(5)]
+            assert c.get("/api/upstreams").json()["mcsi"]["circuit"] == "open"
+
+        assert codes == [503] * 5
+        assert len(attempts) - probes == 2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache:
+    """Test TTL/LRU response cache with stale-while-revalidate and stale-if-error"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def counting_fetch(self):
+        state = {"calls": 0, "fail": False}
+
+        async def fetch():
+            state["calls"] += 1
+            if state["fail"]:
+                raise httpx.ConnectError("upstream down")
+            return {"version": state["calls"]}
+
+        return state, fetch
+
+    def test_key_ignores_param_order_and_none(self):
+        """Test cache keys normalize query params"""
+        key = orchestrator.ResponseCache.key
+        assert key("/mcsi/19001/timeseries", {"limit": 30, "start_date": None}) == "/mcsi/19001/timeseries?limit=30"
+        assert key("/x", {"b": 1, "a": 2}) == key("/x", {"a": 2, "b": 1})
+        assert key("/yield/19001", {"week": None}) == "/yield/19001"
+
+    async def test_fresh_hit_skips_fetch(self, clock, counting_fetch):
+        """Test entries within TTL are served without calling upstream"""
+        state, fetch = counting_fetch
+        cache = orchestrator.ResponseCache(ttl=60, clock=clock)
+        assert await cache.get_or_fetch("k", fetch) == {"version": 1}
+        clock.now += 30
+        assert await cache.get_or_fetch("k", fetch) == {"version": 1}
+        assert state["calls"] == 1
+        assert cache.stats()["hit_ratio"] == 0.5
+
+    async def test_lru_eviction(self, clock, counting_fetch):
+        """Test least recently used entries are evicted at capacity"""
+        _, fetch = counting_fetch
+        cache = orchestrator.ResponseCache(max_entries=2, ttl=60, clock=clock)
+        await cache.get_or_fetch("a", fetch)
+        await cache.get_or_fetch("b", fetch)
+        await cache.get_or_fetch("a", fetch)
+        await cache.get_or_fetch("c", fetch)
+        assert set(cache._entries) == {"a", "c"}
+        assert cache.stats()["evictions"] == 1
+
+    async def test_stale_while_revalidate(self, clock, counting_fetch):
+        """Test stale entries are served immediately and refreshed once in the background"""
+        state, fetch = counting_fetch
+        cache = orchestrator.ResponseCache(ttl=60, stale_while_revalidate=600, clock=clock)
+        await cache.get_or_fetch("k", fetch)
+        clock.now += 120
+        first = await cache.get_or_fetch("k", fetch)
+        second = await cache.get_or_fetch("k", fetch)
+        assert first == second == {"version": 1}
+        await asyncio.gather(*cache._refreshing.values())
+        assert state["calls"] == 2
+        assert await cache.get_or_fetch("k", fetch) == {"version": 2}
+        assert cache.stats()["stale_hits"] == 2
+
+    async def test_stale_if_error(self, clock, counting_fetch):
+        """Test expired entries are served when upstream fails, within the error window"""
+        state, fetch = counting_fetch
+        cache = orchestrator.ResponseCache(ttl=60, stale_while_revalidate=0, stale_if_error=3600, clock=clock)
+        await cache.get_or_fetch("k", fetch)
+        state["fail"] = True
+        clock.now += 600
+        assert await cache.get_or_fetch("k", fetch) == {"version": 1}
+        assert cache.stats()["stale_on_error"] == 1
+        clock.now += 3600
+        with pytest.raises(httpx.ConnectError):
+            await cache.get_or_fetch("k", fetch)
+
+    def test_route_served_from_cache(self, upstream_calls):
+        """Test repeated orchestrator calls reach MCSI once"""
+        with TestClient(app) as c:
+            for _ in range(3):
+                assert c.get("/api/mcsi/19001").status_code == 200
+            stats = c.get("/api/cache").json()
+        assert len([r for r in upstream_calls if r.url.path != "/health"]) == 1
+        assert stats["hits"] == 2
+
+
+class TestRequestCoalescing:
+    """Test singleflight collapsing of identical concurrent upstream calls"""
+
+    async def test_followers_share_leader_result(self):
+        """Test concurrent calls with one key run the function once"""
+        flights = orchestrator.SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return {"ok": True}
+
+        waiters = [asyncio.create_task(flights.do("k", fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+
+        assert results == [{"ok": True}] * 5
+        assert len(calls) == 1
+        assert flights.stats()["collapsed_calls"] == 4
+        assert flights.stats()["in_flight"] == 0
+
+    async def test_followers_share_leader_error(self):
+        """Test an upstream error reaches every waiting caller"""
+        flights = orchestrator.SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0)
+            raise httpx.ConnectError("down")
+
+        results = await asyncio.gather(*[flights.do("k", fetch) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(r, httpx.ConnectError) for r in results)
+        assert flights.stats()["upstream_calls"] == 1
+
+    async def test_leader_cancellation_does_not_cancel_followers(self):
+        """Test a disconnected first caller does not fail the others"""
+        flights = orchestrator.SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return 42
+
+        leader = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        assert await follower == 42
+
+    async def test_concurrent_route_calls_hit_upstream_once(self, upstream_calls):
+        """Test a herd of identical dashboard requests reaches MCSI once"""
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            responses = await asyncio.gather(*[c.get("/api/mcsi/19001") for _ in range(10)])
+            stats = (await c.get("/api/upstreams")).json()["mcsi"]["coalescing"]
+
+        assert all(r.status_code == 200 for r in responses)
+        assert len([r for r in upstream_calls if r.url.path != "/health"]) == 1
+        assert stats["collapsed_calls"] == 9
+
+
+class TestCountyDashboard:
+    """Test the concurrent county dashboard composite endpoint"""
+
+    def test_dashboard_fetches_each_dataset_once(self, upstream_calls):
+        """Test the yield forecast reuses the dashboard's timeseries"""
+        with TestClient(app) as c:
+            response = c.get("/api/county/19001/dashboard")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["partial"] is False and data["errors"] == {}
+        assert data["mcsi"]["fips"] == "19001"
+        assert len(data["timeseries"]) == 3
+        assert data["yield"]["predicted_yield"] == 190.0
+        assert set(data["timings_ms"]) == {"mcsi", "timeseries", "yield"}
+
+        paths = [r.url.path for r in upstream_calls if r.url.path != "/health"]
+        assert sorted(paths) == ["/forecast", "/mcsi/county/19001", "/mcsi/county/19001/timeseries"]
+
+    def test_slow_upstream_returns_partial(self, upstream_calls, monkeypatch):
+        """Test a yield call past its deadline leaves the rest of the page intact"""
+        upstream = orchestrator.UPSTREAMS["yield"]
+        inner = upstream.transport.handler
+
+        async def handler(request):
+            if request.url.path == "/forecast":
+                await asyncio.sleep(1.0)
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        monkeypatch.setattr(orchestrator, "DASHBOARD_CALL_TIMEOUT", 0.1)
+        with TestClient(app) as c:
+            data = c.get("/api/county/19001/dashboard").json()
+
+        assert data["partial"] is True
+        assert data["yield"] is None
+        assert "timed out" in data["errors"]["yield"]
+        assert data["mcsi"] is not None and data["timeseries"] is not None
+
+    def test_all_upstreams_down_is_503(self, upstream_calls, monkeypatch):
+        """Test the endpoint fails only when nothing could be fetched"""
+
+        def handler(request):
+            raise httpx.ConnectError("connection refused", request=request)
+
+        for upstream in orchestrator.UPSTREAMS.values():
+            monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            response = c.get("/api/county/19001/dashboard")
+        assert response.status_code == 503
+
+
+class TestStatewideYield:
+    """Test the statewide yield fan-out endpoint"""
+
+    @pytest.fixture
+    def concurrency_probe(self, upstream_calls, monkeypatch):
+        """Slow the MCSI mock down slightly and record peak concurrent timeseries calls"""
+        upstream = orchestrator.UPSTREAMS["mcsi"]
+        inner = upstream.transport.handler
+        state = {"active": 0, "peak": 0}
+
+        async def handler(request):
+            if request.url.path.endswith("/timeseries"):
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+                await asyncio.sleep(0.005)
+                state["active"] -= 1
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        return state
+
+    def test_all_counties_with_bounded_concurrency(self, upstream_calls, concurrency_probe):
+        """Test 99 counties are forecast with at most `concurrency` pipelines in flight"""
+        with TestClient(app) as c:
+            data = c.get("/api/yield/state", params={"concurrency": 4}).json()
+
+        summary = data["summary"]
+        assert summary["counties"] == 99 and summary["succeeded"] == 99 and summary["failed"] == 0
+        assert summary["mode"] == "per_county"
+        assert len({r["fips"] for r in data["results"]}) == 99
+        assert all(r["latency_ms"] >= 0 for r in data["results"])
+        assert 1 < concurrency_probe["peak"] <= 4
+
+    def test_uses_batch_endpoint_when_available(self, upstream_calls, monkeypatch):
+        """Test the yield service is called once per batch instead of once per county"""
+        upstream = orchestrator.UPSTREAMS["yield"]
+        inner = upstream.transport.handler
+
+        def handler(request):
+            if request.url.path == "/forecast/batch":
+                upstream_calls.append(request)
+                n = len(json.loads(request.content)["requests"])
+                return httpx.Response(200, json={"forecasts": [{"predicted_yield": 180.0, "uncertainty": 9.0}] * n})
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            data = c.get("/api/yield/state").json()
+
+        yield_calls = [r for r in upstream_calls if r.url.path.startswith("/forecast")]
+        assert data["summary"]["mode"] == "batch"
+        assert [r.url.path for r in yield_calls] == ["/forecast/batch"]
+        assert all(r["forecast"]["predicted_yield"] == 180.0 for r in data["results"])
+        assert all(r["forecast"]["confidence_interval"] == 9.0 for r in data["results"])
+
+        item = json.loads(yield_calls[0].content)["requests"][0]
+        assert set(item) == {"fips", "week", "year", "heat_days", "water_deficit", "precip", "ndvi_avg", "ndvi_min"}
+        assert item["week"] == 20 and item["ndvi_avg"] == pytest.approx(0.7)
+        assert item["heat_days"] == 3 and item["precip"] == pytest.approx(63.0)
+
+        # Batch forecasts never stand in for the per-county route
+        with TestClient(app) as c:
+            county = c.get("/api/yield/19001").json()
+        assert county["predicted_yield"] == 190.0
+
+    def test_batch_requests_validate_against_yield_service(self):
+        """Test batch items built from an MCSI timeseries are valid yield ForecastRequests"""
+        yield_svc = pytest.importorskip("ml_models.yield_forecast.yield_forecast_service")
+        timeseries = [mcsi_week("19001", w) for w in range(18, 21)]
+        yield_svc.BatchForecastRequest(requests=[orchestrator.build_forecast_request("19001", timeseries)])
+
+    def test_realistic_season_is_not_clipped(self):
+        """Test a full season of typical indicators forecasts inside the yield service's bounds"""
+        yield_svc = pytest.importorskip("ml_models.yield_forecast.yield_forecast_service")
+        timeseries = [mcsi_week("19001", w) for w in range(21, 41)]
+        item = orchestrator.build_forecast_request("19001", timeseries)
+        forecast = yield_svc.predict_forecasts([yield_svc.ForecastRequest(**item)], yield_svc.load_model())[0]
+
+        assert item["heat_days"] == 20
+        assert yield_svc.YIELD_FLOOR < forecast["predicted_yield"] < yield_svc.YIELD_CEILING
+
+    def test_no_batch_without_heat_day_counts(self, upstream_calls, monkeypatch):
+        """Test MCSI data with only a mean LST is forecast per county, never via /forecast/batch"""
+        upstream = orchestrator.UPSTREAMS["mcsi"]
+        inner = upstream.transport.handler
+
+        def handler(request):
+            if not request.url.path.endswith("/timeseries"):
+                return inner(request)
+            fips = request.url.path.split("/")[3]
+            return httpx.Response(200, json=[mcsi_week(fips, w, heat_days=False) for w in range(18, 21)])
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        assert orchestrator.build_forecast_request("19001", [mcsi_week("19001", 20, heat_days=False)]) is None
+        with TestClient(app) as c:
+            summary = c.get("/api/yield/state").json()["summary"]
+
+        assert summary["mode"] == "per_county" and summary["succeeded"] == 99
+        assert not [r for r in upstream_calls if r.url.path == "/forecast/batch"]
+
+    def test_batch_rejection_is_an_error_not_fallback(self, upstream_calls, monkeypatch):
+        """Test a 422 from /forecast/batch fails the counties and does not disable batching"""
+        upstream = orchestrator.UPSTREAMS["yield"]
+        inner = upstream.transport.handler
+
+        def handler(request):
+            if request.url.path == "/forecast/batch":
+                return httpx.Response(422, json={"detail": "bad request"})
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            summary = c.get("/api/yield/state").json()["summary"]
+
+        assert summary["mode"] == "batch"
+        assert summary["failed"] == 99
+        assert orchestrator.yield_batch_unavailable_until == 0.0
+
+    def test_missing_batch_endpoint_is_rechecked(self, upstream_calls, monkeypatch):
+        """Test a 404 falls back to per-county calls only until the retry interval passes"""
+        with TestClient(app) as c:
+            assert c.get("/api/yield/state").json()["summary"]["mode"] == "per_county"
+            probes = [r for r in upstream_calls if r.url.path == "/forecast/batch"]
+            assert len(probes) == 1
+            assert orchestrator.yield_batch_unavailable_until > time.monotonic()
+
+            orchestrator.response_cache.clear()
+            c.get("/api/yield/state")
+            assert len([r for r in upstream_calls if r.url.path == "/forecast/batch"]) == 1
+
+            monkeypatch.setattr(orchestrator, "yield_batch_unavailable_until", time.monotonic() - 1)
+            orchestrator.response_cache.clear()
+            c.get("/api/yield/state")
+            assert len([r for r in upstream_calls if r.url.path == "/forecast/batch"]) == 2
+
+    def test_failures_are_reported_per_county(self, upstream_calls, monkeypatch):
+        """Test one failing county does not fail the statewide response"""
+        upstream = orchestrator.UPSTREAMS["mcsi"]
+        inner = upstream.transport.handler
+
+        def handler(request):
+            if "/19001/" in request.url.path:
+                return httpx.Response(500)
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            summary = c.get("/api/yield/state").json()["summary"]
+
+        assert summary["failed"] == 1
+        assert summary["failures"] == {"19001": "upstream returned 500"}
+
+    def test_streaming_ndjson(self, upstream_calls):
+        """Test stream=true emits one line per county and a closing summary"""
+        with TestClient(app) as c:
+            response = c.get("/api/yield/state", params={"stream": "true"})
+
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert len(lines) == 100
+        assert lines[-1]["summary"]["succeeded"] == 99
+        assert {line["fips"] for line in lines[:-1]} == set(orchestrator.IOWA_COUNTY_FIPS)
+
+
+class TestConditionalGet:
+    """Test ETag / Last-Modified pass-through and 304s from known data versions"""
+
+    LAST_MODIFIED = "Sun, 26 Oct 2025 00:00:00 GMT"
+
+    @pytest.fixture
+    def versions(self, upstream_calls, monkeypatch):
+        """Make the mock upstreams emit validators from a mutable version"""
+        current = {"mcsi": 'W/"mcsi-v1"', "yield": 'W/"yield-v1"'}
+        for name, upstream in orchestrator.UPSTREAMS.items():
+            inner = upstream.transport.handler
+
+            def handler(request, name=name, inner=inner):
+                response = inner(request)
+                if name == "mcsi" or request.url.path == "/health":
+                    response.headers["ETag"] = current[name]
+                    response.headers["Last-Modified"] = self.LAST_MODIFIED
+                return response
+
+            monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        return current
+
+    @staticmethod
+    def data_calls(calls):
+        return [r for r in calls if r.url.path != "/health"]
+
+    def test_mcsi_validators_passed_through(self, upstream_calls, versions):
+        """Test MCSI ETag and Last-Modified reach the client"""
+        with TestClient(app) as c:
+            response = c.get("/api/mcsi/19001")
+        assert response.headers["etag"] == 'W/"mcsi-v1"'
+        assert response.headers["last-modified"] == self.LAST_MODIFIED
+        assert response.headers["cache-control"] == "no-cache"
+
+    def test_if_none_match_answered_without_upstream(self, upstream_calls, versions):
+        """Test a matching revalidation returns 304 without touching cache or upstream"""
+        with TestClient(app) as c:
+            etag = c.get("/api/mcsi/19001").headers["etag"]
+            lookups = orchestrator.response_cache.stats()
+            response = c.get("/api/mcsi/19005", headers={"If-None-Match": etag})
+            modified = c.get("/api/mcsi/19001", headers={"If-Modified-Since": self.LAST_MODIFIED})
+
+        assert response.status_code == 304 and response.content == b""
+        assert modified.status_code == 304
+        assert len(self.data_calls(upstream_calls)) == 1
+        assert orchestrator.response_cache.stats()["misses"] == lookups["misses"]
+
+    def test_new_version_invalidates(self, upstream_calls, versions):
+        """Test a new MCSI week clears the cache and stops matching old ETags"""
+        with TestClient(app) as c:
+            old = c.get("/api/mcsi/19001").headers["etag"]
+            versions["mcsi"] = 'W/"mcsi-v2"'
+            c.get("/api/mcsi/19003")
+            response = c.get("/api/mcsi/19001", headers={"If-None-Match": old})
+
+        assert response.status_code == 200
+        assert response.headers["etag"] == 'W/"mcsi-v2"'
+        assert len(self.data_calls(upstream_calls)) == 3
+
+    def test_yield_etag_depends_on_model_version(self, upstream_calls, versions):
+        """Test yield responses are revalidated against both MCSI and yield model versions"""
+        with TestClient(app) as c:
+            etag = c.get("/api/yield/19001").headers["etag"]
+            assert c.get("/api/yield/19001", headers={"If-None-Match": etag}).status_code == 304
+
+            orchestrator.UPSTREAMS["yield"].etag = 'W/"yield-v2"'
+            assert c.get("/api/yield/19001", headers={"If-None-Match": etag}).status_code == 200
+
+    def test_partial_dashboard_not_tagged(self, upstream_calls, versions, monkeypatch):
+        """Test a degraded dashboard carries no ETag and is refetched once upstreams recover"""
+        upstream = orchestrator.UPSTREAMS["yield"]
+        inner = upstream.transport.handler
+        down = {"forecast": True}
+
+        def handler(request):
+            if request.url.path == "/forecast" and down["forecast"]:
+                return httpx.Response(500)
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            partial = c.get("/api/county/19001/dashboard")
+            down["forecast"] = False
+            complete = c.get("/api/county/19001/dashboard")
+            revalidated = c.get("/api/county/19001/dashboard", headers={"If-None-Match": complete.headers["etag"]})
+
+        assert partial.json()["partial"] is True
+        assert "etag" not in partial.headers
+        assert partial.headers["cache-control"] == "no-store"
+        assert complete.json()["partial"] is False
+        assert complete.headers["cache-control"] == "no-cache"
+        assert revalidated.status_code == 304
+
+    def test_statewide_with_failures_not_tagged(self, upstream_calls, versions, monkeypatch):
+        """Test a statewide result with failed counties carries no ETag"""
+        upstream = orchestrator.UPSTREAMS["mcsi"]
+        inner = upstream.transport.handler
+
+        def handler(request):
+            if "/19001/" in request.url.path:
+                return httpx.Response(500)
+            return inner(request)
+
+        monkeypatch.setattr(upstream, "transport", httpx.MockTransport(handler))
+        with TestClient(app) as c:
+            response = c.get("/api/yield/state")
+            streamed = c.get("/api/yield/state", params={"stream": "true"})
+
+        assert response.json()["summary"]["failed"] == 1
+        assert "etag" not in response.headers and "etag" not in streamed.headers
+        assert response.headers["cache-control"] == "no-store"
+
+
+class TestCompression:
+    """Test negotiated compression and precompressed cache entries"""
+
+    @pytest.fixture
+    def counters(self, upstream_calls, monkeypatch):
+        monkeypatch.setattr(orchestrator, "COMPRESSION_MIN_BYTES", 0)
+        fresh = {
+            "br": {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0},
+            "gzip": {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0},
+            "precompressed_hits": 0,
+            "below_threshold": 0,
+        }
+        monkeypatch.setattr(orchestrator, "compression_counters", fresh)
+        return fresh
+
+    def test_negotiation(self):
+        """Test br is preferred, q=0 excludes and unknown encodings fall back to none"""
+        negotiate = orchestrator.negotiate_encoding
+        assert negotiate("gzip, deflate, br") == ("br" if http_helpers.brotli else "gzip")
+        assert negotiate("br;q=0, gzip") == "gzip"
+        assert negotiate("identity") is None
+        assert negotiate(None) is None
+
+    def test_cached_entry_compressed_once(self, counters):
+        """Test repeat hits reuse the stored gzip bytes"""
+        with TestClient(app) as c:
+            first = c.get("/api/mcsi/19001/timeseries", headers={"Accept-Encoding": "gzip"})
+            second = c.get("/api/mcsi/19001/timeseries", headers={"Accept-Encoding": "gzip"})
+            stats = c.get("/api/cache").json()["compression"]
+
+        assert first.headers["content-encoding"] == "gzip"
+        assert first.headers["vary"] == "Accept-Encoding"
+        assert first.json() == second.json() and len(first.json()) == 3
+        assert counters["gzip"]["responses"] == 1
+        assert stats["precompressed_hits"] == 1
+        assert stats["gzip"]["ratio"] > 1
+
+    def test_identity_when_not_accepted(self, counters):
+        """Test clients without Accept-Encoding get the raw JSON"""
+        with TestClient(app) as c:
+            response = c.get("/api/mcsi/19001", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.json()["fips"] == "19001"
+
+    def test_uncached_routes_compressed_by_middleware(self, counters):
+        """Test composite responses are compressed on the fly and streams are left alone"""
+        with TestClient(app) as c:
+            dashboard = c.get("/api/county/19001/dashboard", headers={"Accept-Encoding": "gzip"})
+            stream = c.get("/api/yield/state", params={"stream": "true"}, headers={"Accept-Encoding": "gzip"})
+
+        assert dashboard.headers["content-encoding"] == "gzip"
+        assert dashboard.json()["mcsi"]["fips"] == "19001"
+        assert "content-encoding" not in stream.headers
+
+
+class TestDataPush:
+    """Test SSE notifications of new upstream data versions"""
+
+    class FakeRequest:
+        def __init__(self):
+            self.disconnected = False
+
+        async def is_disconnected(self):
+            return self.disconnected
+
+    @pytest.fixture
+    def broker(self, upstream_calls, monkeypatch):
+        broker = orchestrator.EventBroker()
+        monkeypatch.setattr(orchestrator, "broker", broker)
+        return broker
+
+    @staticmethod
+    def new_version(etag):
+        orchestrator.UPSTREAMS["mcsi"]._observe_version(httpx.Response(200, headers={"ETag": etag}))
+
+    @staticmethod
+    def parse(message):
+        fields = dict(line.split(": ", 1) for line in message.strip().splitlines() if not line.startswith(":"))
+        return fields["event"], json.loads(fields["data"])
+
+    async def test_version_change_fans_out(self, broker):
+        """Test one MCSI version change reaches every subscriber once"""
+        everyone = broker.subscribe()
+        county = broker.subscribe(["19001"], summary=True)
+        runner = asyncio.create_task(broker.run())
+        try:
+            self.new_version('W/"mcsi-v1"')  # first version seen: nothing to announce
+            self.new_version('W/"mcsi-v2"')
+            plain = await asyncio.wait_for(everyone.queue.get(), 1)
+            detailed = await asyncio.wait_for(county.queue.get(), 1)
+        finally:
+            runner.cancel()
+
+        event, data = self.parse(plain)
+        assert event == "data_version"
+        assert data["source"] == "mcsi" and data["version"] == 'W/"mcsi-v2"'
+        assert "counties" not in data
+        _, data = self.parse(detailed)
+        assert data["counties"]["19001"]["week_of_season"] == 20
+        assert everyone.queue.empty() and broker.stats()["published"] == 1
+
+    def test_slow_subscriber_drops_oldest(self, broker):
+        """Test a full subscriber queue loses old events instead of blocking the broker"""
+        sub = broker.subscribe()
+        for i in range(orchestrator.SSE_QUEUE_SIZE + 2):
+            broker._deliver(sub, f"event {i}")
+        assert broker.stats()["dropped"] == 2
+        assert sub.queue.get_nowait() == "event 2"
+
+    async def test_stream_greets_then_pushes(self, broker, monkeypatch):
+        """Test the SSE stream sends versions, keepalives and pushed events, then unsubscribes"""
+        monkeypatch.setattr(orchestrator, "SSE_KEEPALIVE", 0.01)
+        request = self.FakeRequest()
+        sub = broker.subscribe(["19001"])
+        stream = orchestrator.sse_stream(request, sub)
+
+        hello = await stream.__anext__()
+        assert hello.startswith("retry: ")
+        assert self.parse(hello.split("\n", 1)[1])[0] == "hello"
+        assert await stream.__anext__() == ": keepalive\n\n"
+
+        broker._deliver(sub, orchestrator.format_sse("data_version", {"version": "v2"}))
+        assert self.parse(await stream.__anext__()) == ("data_version", {"version": "v2"})
+
+        request.disconnected = True
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        assert sub not in broker.subscribers
+
+    def test_subscriber_limit(self, broker, monkeypatch):
+        """Test subscriptions beyond the limit are refused"""
+        monkeypatch.setattr(orchestrator, "SSE_MAX_SUBSCRIBERS", 1)
+        broker.subscribe()
+        assert client.get("/api/events").status_code == 503
+
+
+class TestMetrics:
+    """Test latency histograms, Server-Timing and the Prometheus endpoint"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test Prometheus bucket rendering"""
+        from api.metrics import Histogram
+
+        h = Histogram("latency_seconds", "test", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            h.observe(value, "/x")
+        lines = h.render()
+        assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{route="/x",le="1"} 2' in lines
+        assert 'latency_seconds_bucket{route="/x",le="+Inf"} 3' in lines
+        assert 'latency_seconds_count{route="/x"} 3' in lines
+
+    def test_server_timing_breaks_down_upstreams(self, upstream_calls):
+        """Test a yield request reports time spent in MCSI and yield separately"""
+        with TestClient(app) as c:
+            response = c.get("/api/yield/19001")
+
+        timing = response.headers["server-timing"]
+        names = [part.split(";")[0].strip() for part in timing.split(",")]
+        assert names == ["mcsi", "yield", "total"]
+
+    def test_prometheus_endpoint(self, upstream_calls):
+        """Test /metrics labels routes by template and records upstream outcomes"""
+        with TestClient(app) as c:
+            c.get("/api/mcsi/19001")
+            c.get("/api/mcsi/19003")
+            response = c.get("/metrics")
+
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        body = response.text
+        assert 'http_requests_total{route="/api/mcsi/{fips}",method="GET",status="200"}' in body
+        assert "/api/mcsi/19001" not in body
+        assert 'dependency_request_duration_seconds_count{dependency="mcsi",outcome="2xx"}' in body
+        assert "http_requests_in_flight" in body
+
+    def test_reusable_by_other_services(self):
+        """Test the yield service exposes the same instrumentation"""
+        import ml_models.yield_forecast.yield_forecast_service as yield_svc
+
+        yield_client = TestClient(yield_svc.app)
+        assert "server-timing" in yield_client.get("/health").headers
+        assert 'http_requests_total{route="/health"' in yield_client.get("/metrics").text
@@ -66,3 +66,129 @@ class TestMCSIDataStructures:
 
         for week in [1, 13, 26]:
             assert week in valid_weeks
+
+
+class TestDataVersion:
+    """Test data-version validators used for conditional GET"""
+
+    def _frame(self):
+        import pandas as pd
+
+        return pd.DataFrame(
+            {
+                "fips": ["19001", "19001"],
+                "week_start": pd.to_datetime(["2025-10-13", "2025-10-20"]),
+                "water_deficit_mean": [2.0, 3.0],
+            }
+        )
+
+    def test_version_changes_with_content(self):
+        """Test any data correction changes the ETag"""
+        data = self._frame()
+        etag, last_modified = mcsi.compute_data_version(data)
+        assert etag.startswith('W/"mcsi-')
+        assert mcsi.compute_data_version(data.copy()) == (etag, last_modified)
+
+        data.loc[0, "water_deficit_mean"] = 2.5
+        assert mcsi.compute_data_version(data)[0] != etag
+
+    def test_etag_matching(self):
+        """Test weak comparison, lists and wildcard in If-None-Match"""
+        etag = 'W/"mcsi-abc"'
+        assert mcsi.etag_matches('"mcsi-abc"', etag)
+        assert mcsi.etag_matches('"other", W/"mcsi-abc"', etag)
+        assert mcsi.etag_matches("*", etag)
+        assert not mcsi.etag_matches('"other"', etag)
+        assert not mcsi.etag_matches(None, etag)
+
+
+class TestCompression:
+    """Test response compression helpers"""
+
+    def test_negotiation(self):
+        """Test q-values and the gzip fallback"""
+        assert mcsi.negotiate_encoding("br;q=0, gzip;q=0.5") == "gzip"
+        assert mcsi.negotiate_encoding("identity") is None
+
+    def test_gzip_round_trip(self):
+        """Test compressed bodies decode to the original and are counted"""
+        import gzip
+
+        body = b'{"recommendations": "monitor soil moisture"}' * 100
+        before = mcsi.compression_counters["gzip"]["responses"]
+        compressed = mcsi.compress_body(body, "gzip", mcsi.compression_counters)
+        assert gzip.decompress(compressed) == body
+        assert len(compressed) < len(body)
+        assert mcsi.compression_counters["gzip"]["responses"] == before + 1
+
+
+class TestConditionalGet:
+    """Test which GETs carry data-version validators"""
+
+    ETAG = 'W/"mcsi-test"'
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        from fastapi.testclient import TestClient
+
+        monkeypatch.setattr(mcsi.calculator, "etag", self.ETAG)
+        monkeypatch.setattr(mcsi.calculator, "last_modified", "Sun, 26 Oct 2025 00:00:00 GMT")
+        return TestClient(mcsi.app)
+
+    def test_non_data_endpoints_are_never_304(self, client):
+        """Test /compression and /indicators ignore If-None-Match and carry no ETag"""
+        for path in ("/compression", "/indicators"):
+            response = client.get(path, headers={"If-None-Match": self.ETAG})
+            assert response.status_code == 200
+            assert "etag" not in response.headers
+
+    def test_health_advertises_version_without_304(self, client):
+        """Test /health carries the ETag but always returns a body"""
+        response = client.get("/health", headers={"If-None-Match": self.ETAG})
+        assert response.status_code == 200
+        assert response.headers["etag"] == self.ETAG
+
+    def test_data_endpoints_answer_304(self, client):
+        """Test a current If-None-Match on /mcsi/* is answered without recomputing"""
+        response = client.get("/mcsi/latest", headers={"If-None-Match": self.ETAG})
+        assert response.status_code == 304
+        assert response.headers["etag"] == self.ETAG
+
+
+class TestCompressionMiddleware:
+    """Test compressed responses keep the headers set inside the app"""
+
+    ORIGIN = "http://localhost:3000"
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        from collections import OrderedDict
+
+        from fastapi.testclient import TestClient
+
+        monkeypatch.setattr(mcsi.calculator, "etag", 'W/"mcsi-test"')
+        monkeypatch.setattr(mcsi, "response_bodies", OrderedDict())
+        return TestClient(mcsi.app)
+
+    def test_cors_survives_compression(self, client):
+        """Test a compressed JSON GET still carries CORS and content headers"""
+        response = client.get("/indicators", headers={"Origin": self.ORIGIN, "Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] in ("*", self.ORIGIN)
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["content-type"].startswith("application/json")
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert int(response.headers["content-length"]) < len(response.content)
+
+    def test_cors_on_body_cache_hit(self, client):
+        """Test a cached /mcsi/* body is served with the caller's CORS headers"""
+        body = b'{"fips": "19001"}'
+        mcsi.response_bodies[('W/"mcsi-test"', "/mcsi/latest", "")] = {
+            "headers": [(b"content-type", b"application/json"), (b"x-route", b"kept")],
+            "identity": body,
+        }
+        response = client.get("/mcsi/latest", headers={"Origin": self.ORIGIN})
+        assert response.content == body
+        assert response.headers["access-control-allow-origin"] in ("*", self.ORIGIN)
+        assert response.headers["x-route"] == "kept"
+        assert response.headers["etag"] == 'W/"mcsi-test"'
@@ -12,6 +12,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 # Try to import RAG service
 try:
     import rag.rag_service
+    from rag.embedding_cache import EmbeddingCache, normalize_query
+    from rag.answer_cache import SemanticAnswerCache, stress_bucket
     RAG_AVAILABLE = True
 except ImportError:
     RAG_AVAILABLE = False
@@ -55,3 +57,1085 @@ class TestRAGDataStructures:
         assert "answer" in response
         assert "sources" in response
         assert len(response["answer"]) > 0
+
+
+class FakeCollection:
+    def __init__(self, fail_times=0):
+        self.queries = []
+        self.wheres = []
+        self.fail_times = fail_times
+
+    def query(self, n_results, query_embeddings=None, query_texts=None, where=None, **kwargs):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise ConnectionError("chroma restarted")
+        self.queries.append(query_embeddings or query_texts)
+        self.wheres.append(where)
+        return {
+            "ids": [["doc-1"]],
+            "documents": [["NDVI above 0.6 indicates healthy corn."]],
+            "metadatas": [[{"source": "MCSI-Interpretation-Guide.pdf"}]],
+            "distances": [[0.12]],
+        }
+
+
+def hash_embedder(texts):
+    """Deterministic stand-in for the ONNX embedder: bag of hashed words, L2-normalized"""
+    import zlib
+    import numpy as np
+
+    vectors = []
+    for text in texts:
+        v = np.zeros(64, dtype=np.float32)
+        for word in text.lower().split():
+            v[zlib.crc32(word.encode()) % 64] += 1.0
+        vectors.append((v / (np.linalg.norm(v) or 1.0)).tolist())
+    return vectors
+
+
+class FakeChromaClient:
+    instances = []
+
+    def __init__(self, host, port, collection=None):
+        self.collection = collection or FakeCollection()
+        self.get_collection_calls = 0
+        FakeChromaClient.instances.append(self)
+
+    def get_collection(self, name):
+        self.get_collection_calls += 1
+        return self.collection
+
+
+@pytest.fixture
+def simple_service(monkeypatch):
+    """rag_service_simple on in-process fakes: FakeCollection, hash embeddings, a stub LLM, empty caches"""
+    import rag.rag_service_simple as simple
+
+    monkeypatch.setattr(simple, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(simple, "collection", FakeCollection())
+    monkeypatch.setattr(simple, "bm25_index", None)
+    monkeypatch.setattr(simple, "generate_answer", lambda prompt: "Stub answer")
+    monkeypatch.setattr(simple, "embedding_cache", EmbeddingCache(hash_embedder, model_name="hash-64"))
+    monkeypatch.setattr(simple, "answer_cache", SemanticAnswerCache())
+    return simple
+
+
+class TestChromaStore:
+    """Test the shared Chroma client/collection handle"""
+
+    @pytest.fixture
+    def store(self, monkeypatch):
+        import rag.rag_service as rag_service
+
+        FakeChromaClient.instances = []
+        store = rag_service.ChromaStore("chroma", 8000, "corn-stress-knowledge", client_factory=FakeChromaClient)
+        monkeypatch.setattr(rag_service, "store", store)
+        monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache(hash_embedder, model_name="hash-64"))
+        return store
+
+    def test_collection_resolved_once(self, store):
+        """Test the client and collection are created at startup, not per request"""
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+
+        with TestClient(rag_service.app) as client:
+            assert client.get("/ready").status_code == 200
+            for _ in range(3):
+                assert client.post("/query", json={"query": "What is NDVI?", "top_k": 1}).status_code == 200
+            assert client.post("/chat", json={"query": "What is NDVI?"}).json()["answer"].startswith("Based on")
+
+        assert len(FakeChromaClient.instances) == 1
+        assert FakeChromaClient.instances[0].get_collection_calls == 1
+        # warm-up + 3 queries + 1 chat
+        assert len(FakeChromaClient.instances[0].collection.queries) == 5
+        assert store.status()["warmup_ms"] is not None
+
+    def test_retrieval_runs_off_event_loop(self, store, monkeypatch):
+        """Test embedding and collection queries for /query, /query/batch and /chat run in the threadpool"""
+        import asyncio
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+
+        on_loop = []
+        search_batch = rag_service.search_batch
+
+        def recording_search_batch(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return search_batch(*args, **kwargs)
+
+        monkeypatch.setattr(rag_service, "search_batch", recording_search_batch)
+        with TestClient(rag_service.app) as client:
+            assert client.post("/query", json={"query": "What is NDVI?"}).status_code == 200
+            assert client.post("/query/batch", json={"queries": ["NDVI", "heat stress"]}).status_code == 200
+            assert client.post("/chat", json={"query": "What is NDVI?"}).status_code == 200
+
+        assert on_loop == [False, False, False]
+
+    def test_reconnects_after_failure(self, store):
+        """Test a failed query re-resolves the collection and retries once"""
+        store.connect()
+        store.collection.fail_times = 1
+
+        results = store.query(query_embeddings=hash_embedder(["heat stress"]), n_results=1)
+
+        assert results["ids"] == [["doc-1"]]
+        assert store.connects == 2
+
+    def test_not_ready_until_connected(self, store, monkeypatch):
+        """Test readiness fails while Chroma is unreachable and recovers on the next query"""
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+
+        def unreachable(host, port):
+            raise ConnectionError("connection refused")
+
+        monkeypatch.setattr(store, "client_factory", unreachable)
+        with TestClient(rag_service.app) as client:
+            assert client.get("/ready").status_code == 503
+            assert client.get("/health").json()["chroma"]["last_error"] == "connection refused"
+
+            monkeypatch.setattr(store, "client_factory", FakeChromaClient)
+            assert client.post("/query", json={"query": "What is NDVI?"}).status_code == 200
+            assert client.get("/ready").status_code == 200
+
+
+class TestEmbeddingCache:
+    """Test the normalized query embedding cache"""
+
+    class CountingEmbedder:
+        def __init__(self):
+            self.batches = []
+
+        def __call__(self, texts):
+            self.batches.append(list(texts))
+            return hash_embedder(texts)
+
+    def test_normalization(self):
+        """Test case, whitespace and trailing punctuation are ignored"""
+        assert normalize_query("  What is   NDVI? ") == normalize_query("what is ndvi") == "what is ndvi"
+
+    def test_repeat_queries_skip_embedding(self):
+        """Test variants of a question are embedded once"""
+        embedder = self.CountingEmbedder()
+        cache = EmbeddingCache(embedder, model_name="hash-64")
+
+        first = cache.embed(["What is NDVI?"])
+        again = cache.embed(["what is ndvi", "Water stress in corn", "WHAT IS NDVI"])
+
+        assert again[0] == again[2] == first[0]
+        assert embedder.batches == [["what is ndvi"], ["water stress in corn"]]
+        stats = cache.stats()
+        assert stats["misses"] == 2 and stats["hits"] == 1
+        assert stats["hit_ratio"] == pytest.approx(1 / 3, abs=1e-3)
+
+    def test_lru_eviction(self):
+        """Test the memory tier is bounded"""
+        cache = EmbeddingCache(self.CountingEmbedder(), model_name="hash-64", max_entries=2)
+        cache.embed(["a"])
+        cache.embed(["b"])
+        cache.embed(["a"])
+        cache.embed(["c"])
+        assert list(cache._entries) == ["a", "c"]
+
+    def test_disk_tier_survives_restart_and_is_keyed_by_model(self, tmp_path):
+        """Test a new process reads vectors from disk, but never another model's"""
+        path = str(tmp_path / "embeddings.sqlite")
+        EmbeddingCache(self.CountingEmbedder(), model_name="hash-64", path=path).embed(["heat stress"])
+
+        embedder = self.CountingEmbedder()
+        restarted = EmbeddingCache(embedder, model_name="hash-64", path=path)
+        vector = restarted.embed(["Heat stress?"])[0]
+        assert embedder.batches == []
+        assert restarted.stats()["disk_hits"] == 1
+        assert vector == pytest.approx(hash_embedder(["heat stress"])[0])
+
+        other = self.CountingEmbedder()
+        EmbeddingCache(other, model_name="other-model", path=path).embed(["heat stress"])
+        assert other.batches == [["heat stress"]]
+
+    def test_service_searches_with_query_embeddings(self, monkeypatch):
+        """Test /query sends cached vectors to Chroma instead of text"""
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+
+        FakeChromaClient.instances = []
+        embedder = self.CountingEmbedder()
+        monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache(embedder, model_name="hash-64"))
+        monkeypatch.setattr(
+            rag_service, "store", rag_service.ChromaStore("chroma", 8000, "kb", client_factory=FakeChromaClient)
+        )
+        with TestClient(rag_service.app) as client:
+            for _ in range(3):
+                client.post("/query", json={"query": "What is NDVI?"})
+            stats = client.get("/stats").json()["embedding_cache"]
+
+        queries = FakeChromaClient.instances[0].collection.queries
+        assert all(isinstance(q[0], list) for q in queries)
+        assert stats["misses"] == 2  # warm-up query + "what is ndvi"
+        assert stats["hits"] == 2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSemanticAnswerCache:
+    """Test reuse of chat answers for near-duplicate questions"""
+
+    @pytest.fixture
+    def cache(self):
+        return SemanticAnswerCache(threshold=0.8, ttl=60, max_entries=2, clock=FakeClock())
+
+    def test_similar_question_hits_same_partition_only(self, cache):
+        """Test hits need similar embeddings and the same county/week/stress band"""
+        partition = ("Story", 28, stress_bucket({"csi_overall": 42}))
+        cache.store(partition, hash_embedder(["what is ndvi"])[0], "NDVI measures greenness.", [])
+
+        hit = cache.lookup(partition, hash_embedder(["what is the ndvi"])[0])
+        assert hit and hit[0].answer == "NDVI measures greenness."
+        assert hit[1] >= 0.8
+        assert cache.lookup(partition, hash_embedder(["how does heat affect pollination"])[0]) is None
+        assert cache.lookup(("Story", 29, partition[2]), hash_embedder(["what is ndvi"])[0]) is None
+
+    def test_stress_bucket(self):
+        """Test nearby stress readings share a band; missing values are kept distinct"""
+        assert stress_bucket({"csi_overall": 41, "water_stress": "55.0"}) == stress_bucket(
+            {"csi_overall": 48.9, "water_stress": 59}
+        )
+        assert stress_bucket({"csi_overall": 41}) != stress_bucket({"csi_overall": 51})
+        assert stress_bucket(None) == (None, None, None)
+
+    def test_ttl_and_lru(self, cache):
+        """Test entries expire and the cache stays bounded"""
+        vector = hash_embedder(["what is ndvi"])[0]
+        cache.store("a", vector, "A", [])
+        cache.clock.now += 61
+        assert cache.lookup("a", vector) is None
+        assert cache.stats()["expired"] == 1
+
+        for name in ("b", "c", "d"):
+            cache.store(name, vector, name.upper(), [])
+        assert cache.lookup("b", vector) is None
+        assert cache.lookup("d", vector)[0].answer == "D"
+        assert cache.stats()["evicted"] == 1
+
+    def test_chat_skips_llm_on_hit(self, simple_service, monkeypatch):
+        """Test a repeated question is answered from cache without retrieval or the LLM"""
+        from fastapi.testclient import TestClient
+
+        simple = simple_service
+        collection = simple.collection
+        prompts = []
+
+        def stub_llm(prompt):
+            prompts.append(prompt)
+            return "Stub answer"
+
+        monkeypatch.setattr(simple, "generate_answer", stub_llm)
+        monkeypatch.setattr(simple, "answer_cache", SemanticAnswerCache(threshold=0.8))
+
+        client = TestClient(simple.app)
+        message = {"query": "What is NDVI?", "county": "Story", "week": 28, "agri_context": {"csi_overall": 42}}
+        first = client.post("/chat", json=message).json()
+        again = client.post("/chat", json=dict(message, query="what is the NDVI", agri_context={"csi_overall": 45}))
+        other_week = client.post("/chat", json=dict(message, week=29)).json()
+
+        assert first["cached"] is False and again.json()["cached"] is True
+        assert again.json()["response"] == "Stub answer"
+        assert again.json()["retrieved_contexts"] == first["retrieved_contexts"]
+        assert other_week["cached"] is False
+        assert len(prompts) == 2 and len(collection.queries) == 2
+        assert client.get("/stats").json()["answer_cache"]["hits"] == 1
+
+
+class TestStreamingChat:
+    """Test /chat/stream event order and timing metadata"""
+
+    @pytest.fixture
+    def simple(self, simple_service, monkeypatch):
+        def fake_stream(prompt):
+            yield from ["NDVI ", "measures ", "greenness."]
+
+        monkeypatch.setattr(simple_service, "generate_answer_stream", fake_stream)
+        monkeypatch.setattr(simple_service, "answer_cache", SemanticAnswerCache(threshold=0.8))
+        return simple_service
+
+    @staticmethod
+    def parse_sse(body):
+        import json
+
+        events = []
+        for block in body.strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    def test_sse_contexts_then_tokens_then_done(self, simple):
+        """Test contexts arrive first, tokens in order, timing last"""
+        from fastapi.testclient import TestClient
+
+        response = TestClient(simple.app).post("/chat/stream", json={"query": "What is NDVI?"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self.parse_sse(response.text)
+
+        assert [name for name, _ in events] == ["contexts", "token", "token", "token", "done"]
+        assert events[0][1]["retrieved_contexts"][0]["text"].startswith("NDVI above 0.6")
+        assert "".join(data["text"] for name, data in events if name == "token") == "NDVI measures greenness."
+        timing = events[-1][1]["timing"]
+        assert timing["retrieval_ms"] <= timing["first_token_ms"] <= timing["total_ms"]
+        assert events[-1][1]["cached"] is False
+
+    def test_ndjson_and_answer_cache(self, simple, monkeypatch):
+        """Test NDJSON framing; a streamed answer is cached for /chat"""
+        import json
+        from fastapi.testclient import TestClient
+
+        client = TestClient(simple.app)
+        response = client.post("/chat/stream?format=ndjson", json={"query": "What is NDVI?"})
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[0]["event"] == "contexts" and lines[-1]["event"] == "done"
+
+        monkeypatch.setattr(simple, "generate_answer", None)  # a cache miss would now fail
+        cached = client.post("/chat", json={"query": "what is ndvi"}).json()
+        assert cached["cached"] is True and cached["response"] == "NDVI measures greenness."
+
+    def test_errors_reported_in_band(self, simple, monkeypatch):
+        """Test a model failure after headers are sent becomes an error event"""
+        from fastapi.testclient import TestClient
+
+        def broken_stream(prompt):
+            yield "NDVI "
+            raise RuntimeError("quota exceeded")
+
+        monkeypatch.setattr(simple, "generate_answer_stream", broken_stream)
+        events = self.parse_sse(TestClient(simple.app).post("/chat/stream", json={"query": "What is NDVI?"}).text)
+        assert events[-1] == ("error", {"detail": "quota exceeded"})
+        assert simple.answer_cache.stats()["entries"] == 0
+
+
+class GatedLLM:
+    """Blocking stub LLM: every call parks its worker thread until open(), like generate_content on the network"""
+
+    def __init__(self):
+        import threading
+
+        self.gate = threading.Event()
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self._lock:
+            self.waiting += 1
+        if not self.gate.wait(timeout=10):
+            raise RuntimeError("LLM gate never opened")
+        return "Stub answer"
+
+    def open(self):
+        self.gate.set()
+
+    async def until_waiting(self, calls: int, timeout: float = 10.0):
+        """Yield to the loop until `calls` generations are parked at once"""
+        import asyncio
+
+        async def poll():
+            while self.waiting < calls:
+                await asyncio.sleep(0.005)
+
+        await asyncio.wait_for(poll(), timeout)
+
+
+class TestNonBlockingChat:
+    """Test chats overlap their I/O waits and respect the concurrency cap"""
+
+    @pytest.fixture
+    def llm(self, simple_service, monkeypatch):
+        llm = GatedLLM()
+        monkeypatch.setattr(simple_service, "generate_answer", llm)
+        monkeypatch.setattr(simple_service, "answer_cache", SemanticAnswerCache(threshold=0.99))
+        yield llm
+        llm.open()  # never leave a worker thread parked
+
+    @pytest.fixture
+    def simple(self, simple_service, llm):
+        return simple_service
+
+    @staticmethod
+    def client(simple):
+        import httpx
+
+        return httpx.AsyncClient(app=simple.app, base_url="http://rag")
+
+    async def test_concurrent_chats_overlap(self, simple, llm, monkeypatch):
+        """Test ten blocking generations are in flight at once and /health answers meanwhile"""
+        import asyncio
+
+        monkeypatch.setattr(simple, "chat_limit", simple.ConcurrencyLimit(limit=32, timeout=5))
+        async with self.client(simple) as client:
+            chats = [asyncio.ensure_future(client.post("/chat", json={"query": f"question {i} about corn"}))
+                     for i in range(10)]
+            await llm.until_waiting(10)
+            health = await client.get("/health")
+            assert not any(chat.done() for chat in chats)
+            llm.open()
+            responses = await asyncio.gather(*chats)
+
+        assert health.status_code == 200
+        assert all(r.status_code == 200 for r in responses)
+        assert simple.chat_limit.peak == 10 and simple.chat_limit.active == 0
+
+    async def test_health_answers_during_chat(self, simple, llm):
+        """Test the event loop stays free while a chat is generating"""
+        import asyncio
+
+        async with self.client(simple) as client:
+            chat = asyncio.ensure_future(client.post("/chat", json={"query": "What is NDVI?"}))
+            await llm.until_waiting(1)
+            health = await client.get("/health")
+            assert not chat.done()
+            llm.open()
+            assert (await chat).status_code == 200
+
+        assert health.status_code == 200
+
+    async def test_cap_rejects_when_queue_times_out(self, simple, llm, monkeypatch):
+        """Test chats beyond the cap wait, then get 503 with Retry-After"""
+        import asyncio
+
+        monkeypatch.setattr(simple, "chat_limit", simple.ConcurrencyLimit(limit=1, timeout=0.05))
+        async with self.client(simple) as client:
+            first = asyncio.ensure_future(client.post("/chat", json={"query": "What is NDVI?"}))
+            await llm.until_waiting(1)
+            rejected = await client.post("/chat", json={"query": "Heat stress at silking"})
+            llm.open()
+            assert (await first).status_code == 200
+            stats = (await client.get("/stats")).json()["concurrency"]
+
+        assert rejected.status_code == 503
+        assert rejected.headers["retry-after"] == "1"
+        assert stats["rejected"] == 1 and stats["active"] == 0
+
+    async def test_stream_holds_slot_until_done(self, simple, monkeypatch):
+        """Test /chat/stream releases its slot after the last event"""
+        monkeypatch.setattr(simple, "generate_answer_stream", lambda prompt: iter(["a", "b"]))
+        monkeypatch.setattr(simple, "chat_limit", simple.ConcurrencyLimit(limit=1, timeout=0.05))
+        async with self.client(simple) as client:
+            for _ in range(2):
+                response = await client.post("/chat/stream", json={"query": "What is NDVI?"})
+                assert response.status_code == 200 and "event: done" in response.text
+
+        assert simple.chat_limit.active == 0 and simple.chat_limit.rejected == 0
+
+    async def test_stream_slot_released_on_event_loop(self, simple, monkeypatch):
+        """Test the stream's slot is returned from the loop thread, not a worker thread"""
+        import threading
+
+        limit = simple.ConcurrencyLimit(limit=1, timeout=0.05)
+        release = limit.release
+        threads = []
+
+        def recording_release():
+            threads.append(threading.get_ident())
+            release()
+
+        monkeypatch.setattr(limit, "release", recording_release)
+        monkeypatch.setattr(simple, "chat_limit", limit)
+        monkeypatch.setattr(simple, "generate_answer_stream", lambda prompt: iter(["a"]))
+        async with self.client(simple) as client:
+            response = await client.post("/chat/stream", json={"query": "What is NDVI?"})
+
+        assert response.status_code == 200
+        assert threads == [threading.get_ident()]
+
+    async def test_stream_setup_failure_releases_slot(self, simple, monkeypatch):
+        """Test an error while building the streaming response does not leak the slot"""
+        def broken_response(*args, **kwargs):
+            raise RuntimeError("bad response")
+
+        monkeypatch.setattr(simple, "chat_limit", simple.ConcurrencyLimit(limit=1, timeout=0.05))
+        monkeypatch.setattr(simple, "StreamingResponse", broken_response)
+        async with self.client(simple) as client:
+            with pytest.raises(RuntimeError):
+                await client.post("/chat/stream", json={"query": "What is NDVI?"})
+
+        assert simple.chat_limit.active == 0
+
+
+class KnowledgeBaseCollection:
+    """Chroma collection stand-in holding hash-embedded chunks, for get() pagination"""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.ids = [f"chunk-{i}" for i in range(len(self.documents))]
+        self.embeddings = hash_embedder(self.documents)
+        self.metadatas = [
+            {"source": f"guide-{i % 3}.pdf", "page": i + 1, "year": 2020 + i % 2} for i in range(len(self.documents))
+        ]
+        self.get_calls = 0
+
+    def get(self, include, limit, offset):
+        self.get_calls += 1
+        window = slice(offset, offset + limit)
+        return {
+            "ids": self.ids[window],
+            "documents": self.documents[window],
+            "metadatas": self.metadatas[window],
+            "embeddings": self.embeddings[window],
+        }
+
+
+KB_DOCUMENTS = [
+    "ndvi above 0.6 indicates healthy corn canopy",
+    "water stress during pollination reduces kernel set",
+    "heat above 35 c at silking damages pollen",
+    "nitrogen deficiency shows as yellowing of lower leaves",
+    "vapor pressure deficit drives evapotranspiration",
+    "soil moisture below wilting point stops uptake",
+    "grain fill depends on late season photosynthesis",
+]
+
+
+class TestVectorIndex:
+    """Test the embedded, memory-mapped vector index"""
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        from rag.vector_index import VectorIndex
+
+        index = VectorIndex(str(tmp_path / "index"))
+        index.sync_from(KnowledgeBaseCollection(KB_DOCUMENTS), page_size=3)
+        return index
+
+    def test_top_k_matches_brute_force(self, index):
+        """Test ranking and cosine distances equal an exact sort"""
+        import numpy as np
+
+        query = hash_embedder(["water stress pollination"])
+        result = index.query(query_embeddings=query, n_results=3)
+
+        matrix = np.asarray(hash_embedder(KB_DOCUMENTS))
+        expected = np.argsort(-(matrix @ np.asarray(query[0])), kind="stable")[:3]
+        assert result["ids"][0] == [f"chunk-{i}" for i in expected]
+        assert result["documents"][0][0] == "water stress during pollination reduces kernel set"
+        assert result["distances"][0] == sorted(result["distances"][0])
+        assert set(result) >= {"ids", "documents", "metadatas", "distances"}
+
+    def test_paginated_sync_and_reload(self, index, tmp_path):
+        """Test every page is copied and a new process memory-maps it from disk"""
+        import numpy as np
+        from rag.vector_index import VectorIndex
+
+        assert len(index) == len(KB_DOCUMENTS)
+        reloaded = VectorIndex(str(tmp_path / "index"))
+        assert reloaded.load()
+        assert isinstance(reloaded._snapshot.matrix, np.memmap)
+        query = hash_embedder(["heat at silking"])
+        assert reloaded.query(query, n_results=2)["ids"] == index.query(query, n_results=2)["ids"]
+        assert not VectorIndex(str(tmp_path / "missing")).load()
+
+    def test_float16_and_batch_queries(self, tmp_path):
+        """Test a float16 index answers several queries in one call"""
+        from rag.vector_index import VectorIndex
+
+        index = VectorIndex(str(tmp_path / "fp16"), dtype="float16")
+        index.sync_from(KnowledgeBaseCollection(KB_DOCUMENTS))
+        result = index.query(hash_embedder(["ndvi healthy canopy", "nitrogen yellowing leaves"]), n_results=100)
+
+        assert index._snapshot.matrix.dtype.name == "float16"
+        assert [ids[0] for ids in result["ids"]] == ["chunk-0", "chunk-3"]
+        assert len(result["ids"][0]) == len(KB_DOCUMENTS)
+
+    def test_empty_collection_keeps_current_index(self, index):
+        """Test an empty re-seed does not wipe a working index"""
+        with pytest.raises(RuntimeError):
+            index.sync_from(KnowledgeBaseCollection([]))
+        assert len(index) == len(KB_DOCUMENTS)
+
+    def test_query_leaves_caller_array_untouched(self, index):
+        """Test queries are normalized on a copy, not in the caller's float32 array"""
+        import numpy as np
+
+        query = np.asarray(hash_embedder(["heat at silking"]), dtype=np.float32) * 3
+        before = query.copy()
+        index.query(query, n_results=2)
+        np.testing.assert_array_equal(query, before)
+
+    def test_resync_swaps_directories(self, index, tmp_path, monkeypatch):
+        """Test a re-sync leaves only the new index on disk, and a failed swap restores the old one"""
+        import os
+        from rag import vector_index
+
+        index.sync_from(KnowledgeBaseCollection(KB_DOCUMENTS[:3]))
+        assert len(index) == 3
+        assert sorted(os.listdir(tmp_path)) == ["index"]
+
+        real_replace = os.replace
+        calls = []
+
+        def failing_replace(src, dst):
+            calls.append((src, dst))
+            if len(calls) == 2:  # staging -> index
+                raise OSError("disk full")
+            real_replace(src, dst)
+
+        monkeypatch.setattr(vector_index.os, "replace", failing_replace)
+        with pytest.raises(OSError):
+            index.sync_from(KnowledgeBaseCollection(KB_DOCUMENTS))
+        monkeypatch.undo()
+
+        assert sorted(os.listdir(tmp_path)) == ["index"]
+        reloaded = vector_index.VectorIndex(str(tmp_path / "index"))
+        assert reloaded.load() and len(reloaded) == 3
+
+    def test_chat_without_chroma(self, simple_service, tmp_path, monkeypatch):
+        """Test the simple service answers from the embedded index when Chroma is down"""
+        from fastapi.testclient import TestClient
+        from rag.vector_index import VectorIndex
+
+        simple = simple_service
+
+        index = VectorIndex(str(tmp_path / "index"))
+        index.sync_from(KnowledgeBaseCollection(KB_DOCUMENTS))
+        monkeypatch.setattr(simple, "RAG_RETRIEVAL_BACKEND", "embedded")
+        monkeypatch.setattr(simple, "vector_index", index)
+        monkeypatch.setattr(simple, "collection", None)
+
+        client = TestClient(simple.app)
+        response = client.post("/chat", json={"query": "heat at silking"})
+        assert response.status_code == 200
+        assert response.json()["retrieved_contexts"][0]["text"] == "heat above 35 c at silking damages pollen"
+        assert client.get("/health").json()["retrieval_backend"] == "embedded"
+        assert client.post("/index/sync").status_code == 503
+
+    def test_rag_service_ready_from_disk_index(self, tmp_path, monkeypatch):
+        """Test /ready and /query succeed from a synced index with Chroma unreachable"""
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+        from rag.vector_index import VectorIndex
+
+        VectorIndex(str(tmp_path / "index")).sync_from(KnowledgeBaseCollection(KB_DOCUMENTS))
+
+        def unreachable(host, port):
+            raise ConnectionError("chroma down")
+
+        monkeypatch.setattr(rag_service, "RAG_RETRIEVAL_BACKEND", "embedded")
+        monkeypatch.setattr(rag_service, "vector_index", VectorIndex(str(tmp_path / "index")))
+        monkeypatch.setattr(rag_service, "store", rag_service.ChromaStore("chroma", 8000, "kb", client_factory=unreachable))
+        monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache(hash_embedder, model_name="hash-64"))
+
+        with TestClient(rag_service.app) as client:
+            assert client.get("/ready").status_code == 200
+            results = client.post("/query", json={"query": "ndvi canopy", "top_k": 1}).json()["results"]
+        assert results["ids"] == [["chunk-0"]]
+
+
+class TestHybridRetrieval:
+    """Test BM25 keyword search and reciprocal rank fusion"""
+
+    DOCUMENTS = KB_DOCUMENTS + [
+        "MOD13A1 is the 16-day 500 m MODIS vegetation index product",
+        "Stress at VT/R1 (tasseling to silking) costs the most yield",
+        "SDD (stress degree days) accumulate above 30 C",
+    ]
+
+    @pytest.fixture
+    def bm25(self):
+        from rag.bm25_index import BM25Index
+
+        return BM25Index.build([f"chunk-{i}" for i in range(len(self.DOCUMENTS))], self.DOCUMENTS)
+
+    def test_tokenize_keeps_codes(self):
+        """Test product codes and growth stages survive tokenization"""
+        from rag.bm25_index import tokenize
+
+        assert tokenize("VT/R1 and MOD13A1, NDVI 0.6") == ["vt/r1", "vt", "r1", "and", "mod13a1", "ndvi", "0.6", "0", "6"]
+
+    def test_exact_terms_rank_first(self, bm25):
+        """Test acronyms dense retrieval misses are found by BM25"""
+        assert bm25.query("What does MOD13A1 measure?", 3)["ids"][0][0] == "chunk-7"
+        assert bm25.query("yield loss at vt/r1", 3)["ids"][0][0] == "chunk-8"
+        assert bm25.query("SDD", 3)["ids"][0] == ["chunk-9"]
+        assert bm25.query("unrelated gibberish", 3)["ids"] == [[]]
+
+    def test_persisted_postings_round_trip(self, bm25, tmp_path):
+        """Test the compact index saved at seed time loads with identical scores"""
+        import numpy as np
+        from rag.bm25_index import BM25Index
+
+        bm25.save(str(tmp_path / "bm25"))
+        loaded = BM25Index.load(str(tmp_path / "bm25"))
+        assert loaded.doc_ids.dtype == np.uint32 and loaded.tfs.dtype == np.uint16
+        np.testing.assert_allclose(loaded.scores("water stress silking"), bm25.scores("water stress silking"))
+        assert BM25Index.load(str(tmp_path / "missing")) is None
+
+    def test_rrf_rewards_agreement(self):
+        """Test a chunk ranked well by both retrievers beats one ranked first by one"""
+        from rag.bm25_index import reciprocal_rank_fusion
+
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]])
+        assert [chunk_id for chunk_id, _ in fused] == ["b", "a", "d", "c"]
+        assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+
+    def test_fused_result_shape(self, bm25):
+        """Test fusion keeps Collection.query shape; keyword-only hits have no distance"""
+        from rag.bm25_index import hybrid_search
+
+        calls = []
+
+        def vector_search(n_results):
+            calls.append(n_results)
+            return FakeCollection().query(n_results=n_results, query_embeddings=[[0.0]])
+
+        result = hybrid_search(vector_search, bm25, "MOD13A1 product", n_results=2, candidates=20)
+        assert calls == [20]
+        assert set(result["ids"][0]) == {"doc-1", "chunk-7"}
+        distances = dict(zip(result["ids"][0], result["distances"][0]))
+        assert distances == {"doc-1": 0.12, "chunk-7": None}
+        assert result["metadatas"][0][result["ids"][0].index("doc-1")] == {"source": "MCSI-Interpretation-Guide.pdf"}
+
+    def test_chat_contexts_include_keyword_hits(self, bm25, simple_service, monkeypatch):
+        """Test the simple service fuses BM25 hits into the chat contexts"""
+        simple = simple_service
+        monkeypatch.setattr(simple, "bm25_index", bm25)
+        contexts = simple.retrieve_contexts("Stress at VT/R1", hash_embedder(["Stress at VT/R1"])[0])
+
+        texts = [c["text"] for c in contexts]
+        assert texts[:2] == ["NDVI above 0.6 indicates healthy corn.", "Stress at VT/R1 (tasseling to silking) costs the most yield"]
+        assert all(c["score"] > 0 for c in contexts)
+
+    def test_rag_service_query_is_hybrid(self, bm25, tmp_path, monkeypatch):
+        """Test /query merges the keyword index loaded at startup"""
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+
+        bm25.save(str(tmp_path / "bm25"))
+        FakeChromaClient.instances = []
+        monkeypatch.setattr(rag_service, "BM25_INDEX_PATH", str(tmp_path / "bm25"))
+        monkeypatch.setattr(rag_service, "store", rag_service.ChromaStore("chroma", 8000, "kb", client_factory=FakeChromaClient))
+        monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache(hash_embedder, model_name="hash-64"))
+        monkeypatch.setattr(rag_service, "bm25_index", None)
+
+        with TestClient(rag_service.app) as client:
+            results = client.post("/query", json={"query": "SDD accumulation", "top_k": 3}).json()["results"]
+            assert client.get("/health").json()["bm25_index"]["chunks"] == len(self.DOCUMENTS)
+
+        assert results["ids"][0][:2] in (["chunk-9", "doc-1"], ["doc-1", "chunk-9"])
+        assert len(results["scores"][0]) == 2
+
+
+class TestContextPacker:
+    """Test merging, deduplication, MMR and token budgeting of prompt contexts"""
+
+    PAGE = (
+        "Corn is most sensitive to water stress from tasseling through silking. "
+        "A week of severe stress at VT/R1 can cut yield by a third. "
+        "Stress degree days accumulate when canopy temperature exceeds air temperature. "
+        "NDVI from MOD13A1 lags visible wilting by roughly a week. "
+        "Scout fields for leaf rolling before noon, when it is a reliable drought signal. "
+        "Late-season nitrogen loss shows as firing of the lower leaves. "
+        "Yield potential is largely set by kernel number, fixed within two weeks of silking. "
+        "Grain fill then depends on how long the canopy stays green into September. "
+    )
+
+    def chunk(self, chunk_id, text, score, source="guide.pdf", page=4, position=None):
+        metadata = {"source": source, "page": page}
+        if position is not None:
+            metadata["chunk_index"] = position
+        return {"id": chunk_id, "text": text, "metadata": metadata, "score": score}
+
+    def seeded_chunks(self, source="guide.pdf", prefix="c", positions=True):
+        """Split like seed_rag_knowledge_base: 300-char chunks, 60-char overlap"""
+        step = 240
+        return [
+            self.chunk(f"{prefix}{i}", self.PAGE[start:start + 300], 0.9 - i * 0.05, source,
+                       position=i if positions else None)
+            for i, start in enumerate(range(0, len(self.PAGE) - 60, step))
+        ]
+
+    def test_adjacent_chunks_merge_without_repeating_overlap(self):
+        """Test overlapping neighbours from one page become one passage"""
+        from rag.context_packer import merge_adjacent
+
+        for positions in (True, False):  # older collections have no chunk positions
+            chunks = self.seeded_chunks(positions=positions)
+            passages = merge_adjacent([chunks[1], chunks[0], chunks[2]])
+            assert len(passages) == 1
+            assert passages[0]["text"] == self.PAGE[: 2 * 240 + 300]
+            assert sorted(passages[0]["ids"]) == ["c0", "c1", "c2"]
+            assert passages[0]["score"] == chunks[0]["score"]
+
+        chunks = self.seeded_chunks()
+        assert len(merge_adjacent([chunks[0], chunks[2]])) == 2
+
+    def test_different_pages_do_not_merge(self):
+        """Test chunks only merge within the same source and page"""
+        from rag.context_packer import merge_adjacent
+
+        first, second = self.seeded_chunks()[:2]
+        second["metadata"]["page"] = 5
+        assert len(merge_adjacent([first, second])) == 2
+
+    def test_reindexed_duplicates_dropped(self):
+        """Test the same PDF seeded twice contributes each passage once"""
+        from rag.context_packer import pack_contexts
+
+        original = self.chunk("a", self.PAGE[:600], 0.9, source="guide.pdf", page=1)
+        copy = self.chunk("b", self.PAGE[:600] + " Reviewed 2023.", 0.88, source="guide (1).pdf", page=1)
+        other = self.chunk("c", "Nitrogen deficiency shows as V-shaped yellowing on lower leaves.", 0.5, page=9)
+
+        contexts = pack_contexts([original, copy, other], token_budget=1000)
+        assert [c["ids"] for c in contexts] == [["a"], ["c"]]
+
+    def test_mmr_prefers_diverse_context(self):
+        """Test a redundant runner-up yields to a different topic"""
+        from rag.context_packer import mmr_order
+
+        top = self.chunk("a", "water stress at silking reduces kernel set in corn", 0.90, page=1)
+        similar = self.chunk("b", "water stress at silking reduces kernel number in corn", 0.89, page=2)
+        different = self.chunk("c", "heat above 35 c damages pollen viability", 0.80, page=3)
+        assert [p["id"] for p in mmr_order([top, similar, different], lambda_=0.5)] == ["a", "c", "b"]
+
+    def test_token_budget(self):
+        """Test contexts fit the budget; an oversized passage is trimmed at a sentence"""
+        from rag.context_packer import estimate_tokens, pack_contexts
+
+        long = self.chunk("a", self.PAGE, 0.9)
+        short = self.chunk("b", "Irrigate at night to cut evaporation losses.", 0.8, page=9)
+        contexts = pack_contexts([long, short], token_budget=100)
+
+        assert sum(c["tokens"] for c in contexts) <= 100
+        assert self.PAGE.startswith(contexts[0]["text"]) and contexts[0]["text"].endswith(".")
+        assert contexts[0]["tokens"] < estimate_tokens(self.PAGE)
+        assert estimate_tokens(contexts[0]["text"]) == contexts[0]["tokens"]
+
+        assert len(pack_contexts([long, short], token_budget=10_000, max_contexts=1)) == 1
+
+    def test_chat_prompt_uses_packed_contexts(self, simple_service, monkeypatch):
+        """Test /chat sends merged, deduplicated contexts to the LLM"""
+        from fastapi.testclient import TestClient
+
+        simple = simple_service
+
+        chunks = self.seeded_chunks() + self.seeded_chunks(source="guide-copy.pdf", prefix="d")
+
+        class OverlappingCollection:
+            def query(self, n_results, **kwargs):
+                top = chunks[:n_results]
+                return {
+                    "ids": [[c["id"] for c in top]],
+                    "documents": [[c["text"] for c in top]],
+                    "metadatas": [[c["metadata"] for c in top]],
+                    "distances": [[1 - c["score"] for c in top]],
+                }
+
+        prompts = []
+        monkeypatch.setattr(simple, "collection", OverlappingCollection())
+        monkeypatch.setattr(simple, "generate_answer", lambda prompt: prompts.append(prompt) or "Stub answer")
+
+        contexts = TestClient(simple.app).post("/chat", json={"query": "stress at VT/R1"}).json()["retrieved_contexts"]
+        assert len(contexts) == 1
+        assert contexts[0]["source"] == "guide.pdf"
+        assert prompts[0].count("A week of severe stress at VT/R1") == self.PAGE[: len(contexts[0]["text"])].count(
+            "A week of severe stress at VT/R1"
+        )
+
+
+class TestBatchQuery:
+    """Test /query/batch: one embedding call and one collection.query for N queries"""
+
+    class MultiQueryCollection:
+        def __init__(self):
+            self.calls = []
+
+        def query(self, n_results, query_embeddings=None, **kwargs):
+            self.calls.append(len(query_embeddings))
+            count = len(query_embeddings)
+            return {
+                "ids": [[f"q{i}-doc{j}" for j in range(n_results)] for i in range(count)],
+                "documents": [[f"document {j} for query {i}" for j in range(n_results)] for i in range(count)],
+                "metadatas": [[{"source": "guide.pdf"}] * n_results for _ in range(count)],
+                "distances": [[0.1 * (j + 1) for j in range(n_results)] for _ in range(count)],
+                "embeddings": None,
+            }
+
+    @pytest.fixture
+    def service(self, monkeypatch):
+        import rag.rag_service as rag_service
+
+        collection = self.MultiQueryCollection()
+        embedder = TestEmbeddingCache.CountingEmbedder()
+        FakeChromaClient.instances = []
+        monkeypatch.setattr(
+            rag_service, "store",
+            rag_service.ChromaStore("chroma", 8000, "kb", client_factory=lambda host, port: FakeChromaClient(host, port, collection)),
+        )
+        monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache(embedder, model_name="hash-64"))
+        monkeypatch.setattr(rag_service, "bm25_index", None)
+        return rag_service, collection, embedder
+
+    def test_one_embedding_and_one_chroma_call(self, service):
+        """Test N queries cost one embed call and one multi-query collection.query"""
+        from fastapi.testclient import TestClient
+
+        rag_service, collection, embedder = service
+        queries = ["What is NDVI?", "heat stress at silking", "SDD thresholds"]
+        with TestClient(rag_service.app) as client:
+            collection.calls.clear()
+            embedder.batches.clear()
+            response = client.post("/query/batch", json={"queries": queries, "top_k": 2})
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert collection.calls == [3]
+        assert embedder.batches == [["what is ndvi", "heat stress at silking", "sdd thresholds"]]
+        assert [r["ids"] for r in results] == [[["q0-doc0", "q0-doc1"]], [["q1-doc0", "q1-doc1"]], [["q2-doc0", "q2-doc1"]]]
+        assert results[1]["distances"] == [[0.1, 0.2]]
+
+    def test_matches_single_query_shape(self, service):
+        """Test each batch entry has the same shape as a /query result"""
+        from fastapi.testclient import TestClient
+
+        rag_service, _, _ = service
+        with TestClient(rag_service.app) as client:
+            single = client.post("/query", json={"query": "What is NDVI?", "top_k": 2}).json()["results"]
+            batch = client.post("/query/batch", json={"queries": ["What is NDVI?"], "top_k": 2}).json()["results"]
+        assert batch == [single]
+
+    def test_batch_size_validated(self, service):
+        """Test empty and oversized batches are rejected"""
+        from fastapi.testclient import TestClient
+
+        rag_service, _, _ = service
+        client = TestClient(rag_service.app)
+        assert client.post("/query/batch", json={"queries": []}).status_code == 422
+        too_many = ["q"] * (rag_service.MAX_BATCH_QUERIES + 1)
+        assert client.post("/query/batch", json={"queries": too_many}).status_code == 422
+
+    def test_hybrid_batch_fuses_per_query(self, service, monkeypatch):
+        """Test keyword hits are fused into the matching query's results only"""
+        from fastapi.testclient import TestClient
+        from rag.bm25_index import BM25Index
+
+        rag_service, collection, _ = service
+        bm25 = BM25Index.build(["kb-sdd", "kb-ndvi"], ["SDD stress degree days", "NDVI from MOD13A1"])
+        with TestClient(rag_service.app) as client:
+            monkeypatch.setattr(rag_service, "bm25_index", bm25)
+            collection.calls.clear()
+            results = client.post("/query/batch", json={"queries": ["SDD", "MOD13A1"], "top_k": 3}).json()["results"]
+
+        assert collection.calls == [2]
+        assert "kb-sdd" in results[0]["ids"][0] and "kb-ndvi" not in results[0]["ids"][0]
+        assert "kb-ndvi" in results[1]["ids"][0] and "kb-sdd" not in results[1]["ids"][0]
+
+
+class TestMetadataFilters:
+    """Test structured retrieval filters: Chroma where clauses and metadata bitmaps"""
+
+    def test_filter_to_where(self):
+        """Test filters become Chroma where clauses ($and only for several conditions)"""
+        from rag.metadata_filter import RetrievalFilter
+
+        assert RetrievalFilter().to_where() is None
+        assert RetrievalFilter(doc_type="nass_report").to_where() == {"doc_type": {"$eq": "nass_report"}}
+        assert RetrievalFilter(source=["a.pdf", "b.pdf"], page_min=2, page_max=5, year=2025).to_where() == {
+            "$and": [
+                {"source": {"$in": ["a.pdf", "b.pdf"]}},
+                {"page": {"$gte": 2}},
+                {"page": {"$lte": 5}},
+                {"year": {"$eq": 2025}},
+            ]
+        }
+        with pytest.raises(ValueError):
+            RetrievalFilter(page_min=5, page_max=2)
+
+    def test_bitmaps_evaluate_where(self):
+        """Test equality, $in, ranges and $and against precomputed bitmaps"""
+        import numpy as np
+        from rag.metadata_filter import MetadataBitmaps, RetrievalFilter
+
+        bitmaps = MetadataBitmaps(KnowledgeBaseCollection(KB_DOCUMENTS).metadatas)
+
+        def rows(**filters):
+            return list(np.flatnonzero(bitmaps.mask(RetrievalFilter(**filters).to_where())))
+
+        assert rows(source="guide-1.pdf") == [1, 4]
+        assert rows(source=["guide-0.pdf", "guide-2.pdf"], page_min=3) == [2, 3, 5, 6]
+        assert rows(year=2021, page_max=4) == [1, 3]
+        assert rows(doc_type="nass_report") == []  # field missing on every chunk
+        assert bitmaps.mask(None) is None
+
+    def test_embedded_index_filters_before_ranking(self, tmp_path):
+        """Test top-k comes only from matching chunks, with correct distances"""
+        import numpy as np
+        from rag.vector_index import VectorIndex
+
+        index = VectorIndex(str(tmp_path / "index"))
+        index.sync_from(KnowledgeBaseCollection(KB_DOCUMENTS))
+        query = hash_embedder(["ndvi healthy canopy"])
+        unfiltered = index.query(query, n_results=1)
+        filtered = index.query(query, n_results=3, where={"source": {"$eq": "guide-1.pdf"}})
+
+        assert unfiltered["ids"] == [["chunk-0"]]
+        assert filtered["ids"] == [["chunk-1", "chunk-4"]] or filtered["ids"] == [["chunk-4", "chunk-1"]]
+        vectors = dict(zip(index._snapshot.ids, np.asarray(hash_embedder(KB_DOCUMENTS))))
+        for chunk_id, distance in zip(filtered["ids"][0], filtered["distances"][0]):
+            assert distance == pytest.approx(1 - float(vectors[chunk_id] @ np.asarray(query[0])), abs=1e-6)
+        assert index.query(query, n_results=3, where={"year": {"$eq": 1999}})["ids"] == [[]]
+
+    def test_bm25_respects_filter(self):
+        """Test keyword hits outside the filter are not fused back in"""
+        from rag.bm25_index import BM25Index
+
+        bm25 = BM25Index.build(
+            ["progress", "guide"],
+            ["Iowa corn silking 85 percent", "Corn silking under water stress"],
+            [{"doc_type": "nass_report"}, {"doc_type": "extension_guide"}],
+        )
+        assert bm25.query("corn silking", 5, {"doc_type": {"$eq": "nass_report"}})["ids"] == [["progress"]]
+
+    def test_query_api_passes_where_to_chroma(self, monkeypatch):
+        """Test /query and /query/batch send filters to Chroma as where"""
+        from fastapi.testclient import TestClient
+        import rag.rag_service as rag_service
+
+        FakeChromaClient.instances = []
+        monkeypatch.setattr(rag_service, "store", rag_service.ChromaStore("chroma", 8000, "kb", client_factory=FakeChromaClient))
+        monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache(hash_embedder, model_name="hash-64"))
+        monkeypatch.setattr(rag_service, "bm25_index", None)
+
+        with TestClient(rag_service.app) as client:
+            client.post("/query", json={"query": "silking progress", "filters": {"doc_type": "nass_report"}})
+            client.post("/query/batch", json={"queries": ["a"], "filters": {"page_min": 1, "page_max": 3}})
+            client.post("/query", json={"query": "no filter"})
+            bad = client.post("/query", json={"query": "x", "filters": {"page_min": 4, "page_max": 1}})
+
+        wheres = FakeChromaClient.instances[0].collection.wheres
+        assert wheres[1:] == [
+            {"doc_type": {"$eq": "nass_report"}},
+            {"$and": [{"page": {"$gte": 1}}, {"page": {"$lte": 3}}]},
+            None,
+        ]
+        assert bad.status_code == 422
+
+    def test_chat_filters_scope_retrieval_and_answer_cache(self, simple_service):
+        """Test chat filters reach Chroma and keep cached answers apart"""
+        from fastapi.testclient import TestClient
+
+        simple = simple_service
+        collection = simple.collection
+
+        client = TestClient(simple.app)
+        question = {"query": "How far along is silking?", "county": "Story", "week": 30}
+        filtered = client.post("/chat", json=dict(question, filters={"doc_type": "nass_report"})).json()
+        unfiltered = client.post("/chat", json=question).json()
+
+        assert collection.wheres == [{"doc_type": {"$eq": "nass_report"}}, None]
+        assert filtered["cached"] is False and unfiltered["cached"] is False
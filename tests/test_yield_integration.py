@@ -6,6 +6,7 @@ Tests actual yield forecasting functions
 import pytest
 import sys
 import os
+import numpy as np
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -77,3 +78,455 @@ class TestYieldDataStructures:
 
         uncertainty = 0.31
         assert 0 <= uncertainty <= 1
+
+
+class TestPredictionIntervals:
+    """Test bootstrap ensemble prediction intervals"""
+
+    def _synthetic_data(self, n=300, seed=1):
+        rng = np.random.default_rng(seed)
+        X = np.column_stack(
+            [
+                rng.uniform(0, 20, n),  # heat_days
+                rng.uniform(0, 30, n),  # water_deficit
+                rng.uniform(200, 600, n),  # precip
+                rng.uniform(0.5, 0.9, n),  # ndvi_avg
+                rng.uniform(0.2, 0.6, n),  # ndvi_min
+            ]
+        )
+        true_w = np.array([150.0, -1.2, -0.8, 0.05, 60.0, -15.0])
+        y = true_w[0] + X @ true_w[1:] + rng.normal(0, 8.0, n)
+        return X, y
+
+    def test_bootstrap_fit_recovers_coefficients(self):
+        """Test ensemble fit recovers the generating coefficients"""
+        X, y = self._synthetic_data()
+        model = yield_svc.fit_bootstrap_ensemble(X, y, n_members=100, seed=0)
+
+        assert model.ensemble.shape == (100, 6)
+        assert model.coefficients["heat_days"] == pytest.approx(-1.2, abs=0.3)
+        assert model.mae < 10
+
+    def test_intervals_cover_observations(self):
+        """Test 90% intervals cover roughly 90% of outcomes"""
+        X, y = self._synthetic_data(n=600)
+        model = yield_svc.fit_bootstrap_ensemble(X[:300], y[:300], n_members=400, seed=0)
+        pred = model.predict(X[300:], np.full(300, 30), level=0.9)
+
+        covered = np.mean((y[300:] >= pred["lower"]) & (y[300:] <= pred["upper"]))
+        assert pred["method"] == "bootstrap_ensemble"
+        assert 0.8 <= covered <= 0.98
+        assert np.all(pred["lower"] <= pred["point"]) and np.all(pred["point"] <= pred["upper"])
+
+    def test_heuristic_fallback_without_ensemble(self):
+        """Test built-in model keeps the week-based uncertainty"""
+        model = yield_svc.YieldModel([198.7, -1.2, -0.8, 0.15, 45.0, -15.0])
+        pred = model.predict(np.zeros((4, 5)), np.array([10, 25, 32, 40]))
+
+        assert pred["method"] == "heuristic"
+        np.testing.assert_allclose(pred["upper"] - pred["point"], [15.0, 12.0, 8.32, 5.0])
+
+    def test_artifact_round_trip(self, tmp_path):
+        """Test ensemble model survives save/load"""
+        X, y = self._synthetic_data()
+        model = yield_svc.fit_bootstrap_ensemble(X, y, n_members=20)
+        path = tmp_path / "model.npz"
+        model.save(str(path))
+
+        loaded = yield_svc.YieldModel.from_artifact(str(path))
+        assert loaded.name == model.name
+        np.testing.assert_allclose(loaded.ensemble, model.ensemble)
+        np.testing.assert_allclose(loaded.residuals, model.residuals)
+
+    def test_batch_forecast_endpoint(self):
+        """Test /forecast/batch returns one forecast per county"""
+        from fastapi.testclient import TestClient
+
+        client = TestClient(yield_svc.app)
+        req = {"week": 25, "year": 2025, "heat_days": 3, "water_deficit": 5, "precip": 300, "ndvi_avg": 0.7, "ndvi_min": 0.4}
+        response = client.post("/forecast/batch", json={"requests": [dict(req, fips="19001"), dict(req, fips="19153")]})
+
+        assert response.status_code == 200
+        forecasts = response.json()["forecasts"]
+        assert [f["fips"] for f in forecasts] == ["19001", "19153"]
+        assert forecasts[0]["confidence_interval_lower"] <= forecasts[0]["predicted_yield"]
+
+        single = client.post("/forecast", json=dict(req, fips="19001")).json()
+        assert single["predicted_yield"] == pytest.approx(forecasts[0]["predicted_yield"])
+
+    def test_row_quantiles_match_numpy(self):
+        """Test sorted-row quantiles agree with np.quantile"""
+        values = np.random.default_rng(0).normal(size=(7, 51))
+        expected = np.quantile(values, [0.05, 0.95], axis=1)
+        np.testing.assert_allclose(yield_svc.row_quantiles(values.copy(), [0.05, 0.95]), expected)
+
+
+class TestScenarioGrid:
+    """Test broadcasted scenario evaluation"""
+
+    BASE = {"week": 25, "year": 2025, "heat_days": 3, "water_deficit": 5, "precip": 300, "ndvi_avg": 0.7, "ndvi_min": 0.4}
+
+    def test_grid_matches_pointwise_forecasts(self):
+        """Test every grid cell equals a forecast on the perturbed features"""
+        model = yield_svc.load_model()
+        X = np.array([[3, 5, 300, 0.7, 0.4], [8, 20, 150, 0.6, 0.3]], dtype=float)
+        perturbations = {"heat_days": [-2, 0, 4], "precip": [-50, 0]}
+        grid = yield_svc.scenario_grid(model, X, perturbations)
+
+        assert grid.shape == (2, 3, 2)
+        for c in range(2):
+            for i, dh in enumerate(perturbations["heat_days"]):
+                for j, dp in enumerate(perturbations["precip"]):
+                    shifted = X[c] + np.array([dh, 0, dp, 0, 0])
+                    assert grid[c, i, j] == pytest.approx(model.point(shifted)[0])
+
+    def test_scenarios_endpoint(self):
+        """Test /forecast/scenarios returns a compact matrix"""
+        from fastapi.testclient import TestClient
+
+        client = TestClient(yield_svc.app)
+        body = {
+            "baselines": [dict(self.BASE, fips="19001"), dict(self.BASE, fips="19153")],
+            "perturbations": {"heat_days": list(range(0, 10)), "precip": list(range(-50, 50, 5))},
+        }
+        response = client.post("/forecast/scenarios", json=body)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["shape"] == [2, 10, 20]
+        assert len(data["yields"]) == 2 and len(data["yields"][0]) == 10 and len(data["yields"][0][0]) == 20
+        # More heat lowers yield
+        assert data["yields"][0][9][10] < data["yields"][0][0][10]
+
+    def test_scenarios_rejects_unknown_feature(self):
+        """Test unknown perturbation features are rejected"""
+        from fastapi.testclient import TestClient
+
+        client = TestClient(yield_svc.app)
+        body = {"baselines": [dict(self.BASE, fips="19001")], "perturbations": {"soil_ph": [1, 2]}}
+        assert client.post("/forecast/scenarios", json=body).status_code == 422
+
+
+class TestBacktestHarness:
+    """Test forecast backtest replay from Parquet fixtures"""
+
+    @pytest.fixture
+    def fixtures(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        import pandas as pd
+
+        rng = np.random.default_rng(3)
+        rows = []
+        for year in range(2016, 2025):
+            for fips in ["19001", "19153", "19169"]:
+                for week in range(21, 25):
+                    rows.append(
+                        {
+                            "fips": fips,
+                            "year": year,
+                            "week": week,
+                            "heat_days": rng.uniform(0, 10),
+                            "water_deficit": rng.uniform(0, 20),
+                            "precip": rng.uniform(100, 400),
+                            "ndvi_avg": rng.uniform(0.5, 0.9),
+                            "ndvi_min": rng.uniform(0.2, 0.5),
+                        }
+                    )
+        features = pd.DataFrame(rows)
+        yields = features[["fips", "year"]].drop_duplicates().assign(actual_yield=lambda d: rng.uniform(170, 220, len(d)))
+        features.to_parquet(tmp_path / "weekly.parquet")
+        yields.to_parquet(tmp_path / "yields.parquet")
+        return str(tmp_path / "weekly.parquet"), str(tmp_path / "yields.parquet")
+
+    def test_in_process_report(self, fixtures):
+        """Test in-process replay reports accuracy per week and latency percentiles"""
+        from ml_models.yield_forecast import backtest
+
+        df = backtest.load_fixtures(*fixtures, start_year=2016, end_year=2024)
+        report = backtest.run_backtest(df, backtest.InProcessPredictor())
+
+        assert report["n_forecasts"] == 9 * 3 * 4
+        assert set(report["accuracy"]["by_week"]) == {"21", "22", "23", "24"}
+        assert report["accuracy"]["by_week"]["21"]["n"] == 27
+        assert report["latency_ms_per_call"]["p50"] <= report["latency_ms_per_call"]["p99"]
+        assert report["throughput_forecasts_per_s"] > 0
+
+    def test_http_replay_matches_in_process(self, fixtures):
+        """Test HTTP replay (batched) scores the same as in-process"""
+        from fastapi.testclient import TestClient
+        from ml_models.yield_forecast import backtest
+
+        df = backtest.load_fixtures(*fixtures, start_year=2020, end_year=2021)
+        http = backtest.HttpPredictor("http://testserver", client=TestClient(yield_svc.app))
+        http_report = backtest.run_backtest(df, http, batch_size=10)
+        local_report = backtest.run_backtest(df, backtest.InProcessPredictor())
+
+        assert http_report["mode"] == "http"
+        assert http_report["n_forecasts"] == 2 * 3 * 4
+        assert http_report["accuracy"]["overall"]["mae"] == pytest.approx(local_report["accuracy"]["overall"]["mae"])
+
+    def test_empty_year_range_reports_nothing(self, fixtures):
+        """Test a filter that leaves no rows yields an empty report instead of raising"""
+        from ml_models.yield_forecast import backtest
+
+        df = backtest.load_fixtures(*fixtures, start_year=2030, end_year=2031)
+        report = backtest.run_backtest(df, backtest.InProcessPredictor())
+
+        assert report["n_forecasts"] == 0
+        assert report["years"] is None
+        assert report["latency_ms_per_call"] is None
+        assert report["accuracy"]["overall"]["n"] == 0
+        assert report["accuracy"]["overall"]["mae"] is None
+        assert backtest.latency_summary([]) is None
+
+
+class TestModelHotSwap:
+    """Test candidate loading, shadow scoring and promotion"""
+
+    REQ = {"fips": "19001", "week": 25, "year": 2025, "heat_days": 3, "water_deficit": 5, "precip": 300, "ndvi_avg": 0.7, "ndvi_min": 0.4}
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        from fastapi.testclient import TestClient
+
+        monkeypatch.setattr(yield_svc, "ADMIN_TOKEN", "secret")
+        live = yield_svc.registry.live
+        yield TestClient(yield_svc.app, headers={"X-Admin-Token": "secret"})
+        yield_svc.registry.live = live
+        yield_svc.registry.clear_candidate()
+
+    @pytest.fixture
+    def candidate_path(self, tmp_path):
+        candidate = yield_svc.YieldModel([180.0, -1.0, -0.5, 0.1, 50.0, -10.0], name="candidate-v2")
+        path = tmp_path / "candidate.npz"
+        candidate.save(str(path))
+        return str(path)
+
+    def test_shadow_scoring_records_divergence(self, client, candidate_path):
+        """Test sampled traffic is scored on the candidate without changing responses"""
+        before = client.post("/forecast", json=self.REQ).json()
+
+        response = client.post("/admin/model/candidate", json={"path": candidate_path, "sample_rate": 1.0})
+        assert response.status_code == 200
+        assert response.json()["candidate"]["name"] == "candidate-v2"
+
+        served = client.post("/forecast", json=self.REQ).json()
+        assert served["predicted_yield"] == pytest.approx(before["predicted_yield"])
+
+        status = client.get("/admin/model").json()
+        assert status["shadow"]["forecasts"] == 1
+        assert status["shadow"]["mean_abs_diff"] > 0
+
+    def test_promote_swaps_live_model(self, client, candidate_path):
+        """Test promotion makes the candidate serve traffic"""
+        assert client.post("/admin/model/promote").status_code == 409
+
+        client.post("/admin/model/candidate", json={"path": candidate_path, "sample_rate": 0.0})
+        response = client.post("/admin/model/promote")
+        assert response.status_code == 200
+        assert response.json()["live"]["name"] == "candidate-v2"
+        assert response.json()["candidate"] is None
+
+        served = client.post("/forecast", json=self.REQ).json()
+        assert served["baseline_yield"] == 180.0
+
+    def test_health_etag_tracks_live_model(self, client, candidate_path):
+        """Test the health ETag changes when a new model is promoted"""
+        before = client.get("/health").headers["etag"]
+        client.post("/admin/model/candidate", json={"path": candidate_path, "sample_rate": 0.0})
+        assert client.get("/health").headers["etag"] == before
+        client.post("/admin/model/promote")
+        assert client.get("/health").headers["etag"] != before
+
+    def test_health_etag_tracks_weights_not_name(self, client):
+        """Test two same-named bootstrap models advertise different ETags"""
+        rng = np.random.default_rng(9)
+        X = rng.uniform(0, 1, (60, 5))
+        first = yield_svc.fit_bootstrap_ensemble(X, rng.normal(180, 5, 60), n_members=5)
+        second = yield_svc.fit_bootstrap_ensemble(X, rng.normal(180, 5, 60), n_members=5)
+        assert first.name == second.name
+
+        yield_svc.registry.live = first
+        before = client.get("/health").headers["etag"]
+        yield_svc.registry.live = second
+        assert client.get("/health").headers["etag"] != before
+
+    def test_admin_endpoints_fail_closed(self, monkeypatch, candidate_path):
+        """Test admin endpoints refuse requests without a configured and matching token"""
+        from fastapi.testclient import TestClient
+
+        client = TestClient(yield_svc.app)
+        monkeypatch.setattr(yield_svc, "ADMIN_TOKEN", None)
+        monkeypatch.setattr(yield_svc, "ADMIN_INSECURE", False)
+        assert client.post("/admin/model/candidate", json={"path": candidate_path}).status_code == 503
+        assert client.get("/admin/model").status_code == 503
+
+        monkeypatch.setattr(yield_svc, "ADMIN_TOKEN", "secret")
+        assert client.get("/admin/model").status_code == 403
+        assert client.get("/admin/model", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert client.get("/admin/model", headers={"X-Admin-Token": "secret"}).status_code == 200
+        assert yield_svc.registry.candidate is None
+
+    def test_bad_artifact_rejected(self, client, tmp_path):
+        """Test unreadable artifacts leave the registry untouched"""
+        response = client.post("/admin/model/candidate", json={"path": str(tmp_path / "missing.npz")})
+        assert response.status_code == 400
+        assert client.get("/admin/model").json()["candidate"] is None
+
+
+class TestIncrementalRefit:
+    """Test sufficient-statistics refits"""
+
+    def _data(self, n, seed):
+        rng = np.random.default_rng(seed)
+        X = np.column_stack(
+            [rng.uniform(0, 20, n), rng.uniform(0, 30, n), rng.uniform(200, 600, n), rng.uniform(0.5, 0.9, n), rng.uniform(0.2, 0.6, n)]
+        )
+        y = 150.0 + X @ np.array([-1.2, -0.8, 0.05, 60.0, -15.0]) + rng.normal(0, 5.0, n)
+        return X, y
+
+    def test_incremental_matches_full_fit(self):
+        """Test stats updated in two releases solve to the full least-squares fit"""
+        X, y = self._data(400, 0)
+        stats = yield_svc.SufficientStatistics.from_data(X[:300], y[:300])
+        stats.update(X[300:], y[300:])
+
+        full = yield_svc.fit_bootstrap_ensemble(X, y, n_members=5)
+        np.testing.assert_allclose(stats.solve(), full.weights, rtol=1e-6, atol=1e-6)
+        assert stats.r2(stats.solve()) == pytest.approx(full.r2, abs=1e-6)
+
+    def test_duplicate_keys_ignored(self, tmp_path):
+        """Test replaying the same county-years does not double count, and state round-trips"""
+        X, y = self._data(10, 1)
+        keys = [f"19{i:03d}:2024" for i in range(10)]
+        stats = yield_svc.SufficientStatistics.from_data(X, y, keys)
+        assert stats.update(X, y, keys) == 0
+
+        path = str(tmp_path / "stats.npz")
+        stats.save(path)
+        loaded = yield_svc.SufficientStatistics.load(path)
+        assert loaded.n == 10 and loaded.keys == stats.keys
+        np.testing.assert_allclose(loaded.xtx, stats.xtx)
+
+    def test_duplicate_keys_within_batch_counted_once(self):
+        """Test a key repeated inside one batch is absorbed once"""
+        X, y = self._data(2, 3)
+        stats = yield_svc.SufficientStatistics()
+        assert stats.update(X, y, ["19001:2024", "19001:2024"]) == 1
+        assert stats.n == 1
+
+    def test_artifact_keeps_training_statistics(self, tmp_path):
+        """Test fitted models save their training statistics so refits can start from them"""
+        X, y = self._data(50, 8)
+        model = yield_svc.fit_bootstrap_ensemble(X, y, n_members=5, keys=[f"19{i:03d}:2020" for i in range(50)])
+        path = str(tmp_path / "model.npz")
+        model.save(path)
+
+        loaded = yield_svc.YieldModel.from_artifact(path)
+        assert loaded.training.n == 50 and loaded.training.keys == model.training.keys
+        np.testing.assert_allclose(loaded.training.solve(), model.weights, atol=1e-6)
+
+    @pytest.fixture
+    def admin(self, tmp_path, monkeypatch):
+        from fastapi.testclient import TestClient
+
+        monkeypatch.setattr(yield_svc, "STATS_PATH", str(tmp_path / "stats.npz"))
+        monkeypatch.setattr(yield_svc, "REFIT_MODEL_PATH", str(tmp_path / "refit.npz"))
+        monkeypatch.setattr(yield_svc, "stats", None)
+        monkeypatch.setattr(yield_svc, "ADMIN_TOKEN", "secret")
+        live = yield_svc.registry.live
+        yield TestClient(yield_svc.app, headers={"X-Admin-Token": "secret"})
+        yield_svc.registry.live = live
+
+    def _observations(self, X, y, first_year=2016):
+        names = yield_svc.FEATURE_NAMES
+        return [
+            dict(zip(names, row.tolist()), fips=f"19{i % 99:03d}", year=first_year + i // 99, actual_yield=float(t))
+            for i, (row, t) in enumerate(zip(X, y))
+        ]
+
+    def test_observations_refit_from_training_statistics(self, admin, tmp_path):
+        """Test new yields refit on top of the live model's training data after a held-out check"""
+        X, y = self._data(400, 2)
+        keys = [f"19{i % 99:03d}:{2010 + i // 99}" for i in range(len(y))]
+        yield_svc.registry.live = yield_svc.fit_bootstrap_ensemble(X, y, n_members=20, keys=keys)
+
+        X_new, y_new = self._data(200, 4)
+        y_new = y_new - 1.0 * X_new[:, 0]  # heat damage got worse: heat_days slope -2.2
+        response = admin.post("/admin/model/observations", json={"observations": self._observations(X_new, y_new, 2016)})
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["refit"] and data["added"] == 200
+        assert data["total_samples"] == 600
+        validation = data["validation"]
+        assert validation["refit_mae"] <= validation["live_mae"]
+        assert data["model"]["mae"] == pytest.approx(validation["refit_mae"])
+        assert -2.2 < data["coefficients"]["heat_days"] < -1.4
+        assert yield_svc.registry.live.name.startswith("bootstrap_linear+refit-n")
+        assert (tmp_path / "stats.npz").exists() and (tmp_path / "refit.npz").exists()
+
+        again = admin.post("/admin/model/observations", json={"observations": self._observations(X_new[:5], y_new[:5], 2016)}).json()
+        assert again["added"] == 0 and again["duplicates"] == 5 and not again["refit"]
+
+    def test_small_batch_does_not_replace_model(self, admin):
+        """Test a handful of observations without training statistics is stored but not fit"""
+        live = yield_svc.registry.live
+        X, y = self._data(7, 5)
+        data = admin.post("/admin/model/observations", json={"observations": self._observations(X, y)}).json()
+
+        assert data["added"] == 7 and not data["refit"]
+        assert "samples" in data["validation"]["reason"]
+        assert yield_svc.registry.live is live
+        assert yield_svc.stats.n == 7
+
+    def test_refit_rejected_when_worse_on_holdout(self, admin, monkeypatch):
+        """Test a refit that loses to the live model on held-out rows is not promoted"""
+        X, y = self._data(400, 6)
+        live = yield_svc.fit_bootstrap_ensemble(X, y, n_members=20)
+        yield_svc.registry.live = live
+        monkeypatch.setattr(yield_svc, "REFIT_MAE_TOLERANCE", 0.0)
+
+        X_new, y_new = self._data(200, 7)
+        data = admin.post("/admin/model/observations", json={"observations": self._observations(X_new, y_new)}).json()
+
+        assert not data["refit"]
+        assert data["validation"]["refit_mae"] is not None
+        assert yield_svc.registry.live is live
+        assert yield_svc.stats.n == 600
+
+    def test_promote_discards_previous_model_statistics(self, admin, tmp_path):
+        """Test observations after a promotion start from the new model, not the old one's statistics"""
+        X, y = self._data(30, 11)
+        admin.post("/admin/model/observations", json={"observations": self._observations(X, y)})
+        assert yield_svc.stats.n == 30
+
+        candidate = yield_svc.YieldModel([180.0, -1.0, -0.5, 0.1, 50.0, -10.0], name="candidate-v2")
+        path = str(tmp_path / "candidate.npz")
+        candidate.save(path)
+        admin.post("/admin/model/candidate", json={"path": path, "sample_rate": 0.0})
+        assert admin.post("/admin/model/promote").status_code == 200
+        assert yield_svc.stats is None
+
+        X_new, y_new = self._data(5, 12)
+        data = admin.post("/admin/model/observations", json={"observations": self._observations(X_new, y_new, 2030)}).json()
+        assert data["total_samples"] == 5
+        assert yield_svc.stats.owner == candidate.version
+
+    def test_saved_statistics_only_load_for_their_model(self, admin):
+        """Test statistics saved for one model lineage are ignored when another is live"""
+        X, y = self._data(400, 13)
+        base = yield_svc.fit_bootstrap_ensemble(X, y, n_members=5)
+        stats = yield_svc.SufficientStatistics.from_data(X, y)
+        stats.owner = base.version
+        stats.save(yield_svc.STATS_PATH)
+
+        refit = base.refit(stats)
+        refit.save(yield_svc.REFIT_MODEL_PATH)
+        assert yield_svc.YieldModel.from_artifact(yield_svc.REFIT_MODEL_PATH).base_version == base.version
+        assert yield_svc.load_stats(refit).n == 400
+        assert yield_svc.load_stats(base).owner == base.version
+
+        other = yield_svc.fit_bootstrap_ensemble(X, y + 1.0, n_members=5)
+        assert other.name == base.name
+        assert yield_svc.load_stats(other) is None